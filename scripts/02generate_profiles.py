@@ -3,122 +3,85 @@
 # For each model in llm_models.csv (generated in 01save_llm_models.py), a set of client profiles is generated. The generated profiles contain the following fields:
 # - client_id: Unique identifier for each client
 # - the profile generated by the LLM: sex, first name, last name, diagnosis, physical complaints, ADL assistance, mobility description, cognitive and behavioral aspects
-# - start_date: Randomly generated start date for the client's care
-# - duration: Randomly generated duration of care in weeks
+# - start_date: Admission date of the client, from the ward simulation or drawn at random
+# - duration: Duration of care in weeks, from the ward simulation or drawn at random
 # - complications: Randomly selected complications from a predefined library
+# - bed, discharge_date, outcome: Bed and end of the simulated stay (empty while the client is still admitted)
+
+# Profiles are requested in parallel batches until the target number of distinct profiles is reached.
+# Profiles with a name or clinical picture that was generated before are rejected.
+# Start date, duration and complications are drawn with a seeded numpy Generator (see src/pipeline/profiles.py).
+# With a number of beds set, a ward with that many beds is simulated over the period (see src/pipeline/occupancy.py):
+# one profile per stay, with the admission date, length of stay and outcome (discharge or death) of the simulation.
+# All models get profiles for the same simulated stays. The stays are saved to stays.csv.
 
 # The script uses the Jinja2 template engine to load prompts for generating client profiles.
 # The generated profiles are saved to a CSV file named profiles_<model>.csv in the data directory.
 
-import random
-from datetime import datetime
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from jinja2 import Environment, FileSystemLoader
 
-from llm.llm_factory import LLMFactory
-from prompts.generate_profiles_rm import ClientProfiles
+from pipeline.occupancy import simulate_occupancy
+from pipeline.profiles import ProfileEngine
 
 datapath = Path(__file__).resolve().parents[1] / "data"
-prompts_path = Path(__file__).resolve().parents[1] / "src" / "prompts"
 
 # Load llm metadata
 df_models = pd.read_csv(datapath / "llm_models.csv")
 
-complications_library = [
-    "gewichtsverlies",
-    "algehele achteruitgang",
-    "decubitus",
-    "urineweginfectie",
-    "pneumonie",
-    "delier",
-    "verergering van onderliggende lichamelijke klachten",
-    "verbetering van de klachten",
-    "overlijden",
-    "valpartij",
-]
-
-
-def pick_start_date(from_date="2024-01-01", to_date="2025-01-01"):
-    from_date = datetime.strptime(from_date, "%Y-%m-%d")
-    to_date = datetime.strptime(to_date, "%Y-%m-%d")
-    return from_date + (to_date - from_date) * random.random()
-
-
-def determine_duration(mean=10, std_dev=4):
-    return int(np.round(np.random.normal(mean, std_dev)))
-
-
-def sample_complications(complications_library, min_n=1, max_n=3):
-    num = random.randint(min_n, max_n)
-    return ", ".join(random.sample(complications_library, num))
-
-
-# Load the prompts
-env = Environment(loader=FileSystemLoader(prompts_path))
-s_template = env.get_template("generate_profiles_s.jinja")
-system_prompt = s_template.render()
-u_template = env.get_template("generate_profiles_u.jinja")
-user_prompt = u_template.render(
-    # # Uncomment lines to swich between somatic/psychogeriatric ward
-    # profile_type="somatische afdeling",
-    # description="mensen met een hoge zorgzwaarte ten gevolge van een somatische aandoening",
-    profile_type="psychogeriatrische afdeling",
-    description="mensen met een gevorderde dementie met een hoge zorgzwaarte",
-)
-
-# Combine the system and user prompts into a list of messages
-messages = [
-    {"role": "system", "content": system_prompt},
-    {"role": "user", "content": user_prompt},
-]
+ward_type = "pg"  # "som" for a somatic ward, "pg" for a psychogeriatric ward
+num_profiles = 8  # Number of distinct profiles per model, when no ward is simulated
+beds = 8  # Beds of the simulated ward, None draws num_profiles independent attributes
+from_date, to_date = "2024-01-01", "2024-04-01"  # Period of the simulated ward
+mean_stay_weeks = 10  # Mean length of stay on the simulated ward
+death_rate = 0.6  # Share of stays on the simulated ward that end with death
+batch_size = 8  # Number of profiles requested per completion
+concurrency = 4  # Number of completions running in parallel
+seed = None  # Set an integer for reproducible start dates, durations and complications
+wire_format = "full"  # "compact" requests short JSON keys to save output tokens
+
+# Simulate the stays on the ward, shared by all models
+df_stays = None
+if beds is not None:
+    df_stays = simulate_occupancy(
+        num_wards=1,
+        beds=beds,
+        from_date=from_date,
+        to_date=to_date,
+        rng=np.random.default_rng(seed),
+        mean_stay_weeks=mean_stay_weeks,
+        death_rate=death_rate,
+    )
+    df_stays.to_csv(datapath / "stays.csv", index=False)
+    print(f"Simulated {len(df_stays)} stays on {beds} beds")
 
 # Iterate over each row in the models DataFrame
 for _, row_models in df_models.iterrows():
     provider = row_models["llm_provider"]  # Extract the LLM provider
     model = row_models["llm_model"]  # Extract the LLM model
 
-    # Create an instance of the LLMFactory for the given provider
-    factory = LLMFactory(provider=provider)
-
-    try:
-        # Generate client profiles using the LLM
-        print(f"Generating client profiles with {model}...")
-        response_model, raw_response = factory.create_completion(
-            response_model=ClientProfiles,  # Expected response model
-            model=model,  # LLM model to use, overrides the default model from llm_config
-            messages=messages,  # Input messages
-        )
-
-        # Convert the generated client profiles to a pandas DataFrame
-        df_profiles = pd.DataFrame(
-            [profile.model_dump() for profile in response_model.clients]
-        )
-        # Define the output file path for saving the profiles
-        output_path = datapath / f"profiles_{model}.csv"
-
-        # Add a unique client ID to each profile
-        df_profiles.insert(0, "client_id", range(1, len(df_profiles) + 1))
-
-        # Add a start date to each profile
-        df_profiles["start_date"] = [
-            pick_start_date(from_date="2024-01-01", to_date="2025-01-01")
-            for _ in range(len(df_profiles))
-        ]
-        # Add a duration to each profile
-        df_profiles["duration"] = [
-            determine_duration(mean=10, std_dev=4) for _ in range(len(df_profiles))
-        ]
-        # Add complications to each profile
-        df_profiles["complications"] = [
-            sample_complications(complications_library, 1, 3)
-            for _ in range(len(df_profiles))
-        ]
-
-        # Save the DataFrame to a CSV file
-        df_profiles.to_csv(output_path, index=False)
-    except Exception as e:
-        # Handle any errors that occur during the LLM interaction
-        print(f"Error with model {model}:", e)
+    engine = ProfileEngine(
+        provider=provider,
+        model=model,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        seed=seed,
+        wire_format=wire_format,
+    )
+
+    # Generate client profiles using the LLM
+    print(f"Generating client profiles with {model}...")
+    df_profiles = engine.generate(
+        ward_type=ward_type,
+        num_profiles=num_profiles if df_stays is None else None,
+        df_stays=df_stays,
+    )
+    if df_profiles.empty:
+        print(f"Error with model {model}: no profiles generated")
+        continue
+
+    # Save the DataFrame to a CSV file
+    output_path = datapath / f"profiles_{model}.csv"
+    df_profiles.to_csv(output_path, index=False)
@@ -17,41 +17,21 @@ import os
 from pathlib import Path
 
 import pandas as pd
-from jinja2 import Environment, FileSystemLoader
 from tqdm import tqdm
 
-from llm.llm_factory import LLMFactory
+from llm.failover import FailoverRouter
+from llm.wire_format import create_wire_completion
+from pipeline.work_items import ROW_COLUMNS, result_rows, scenario_item
 from prompts.generate_scenarios_rm import ClientScenarios
+from tracing.spans import span
 
 datapath = Path(__file__).resolve().parents[1] / "data"
-prompts_path = Path(__file__).resolve().parents[1] / "src" / "prompts"
 
 # Load metadata for LLMs (providers and models)
 df_models = pd.read_csv(datapath / "llm_models.csv")
 
-
-# Function to format client profile into a string
-def format_naam(row):
-    titel = "Mevrouw" if row["geslacht"] == "v" else "Meneer"
-    return f"{titel} {row['voornaam']} {row['achternaam']}"
-
-
-def format_client_profile(row: pd.Series) -> str:
-    return (
-        f"Naam: {format_naam(row)}\n"
-        f"Diagnose: {row['diagnose']}\n"
-        f"Lichamelijke klachten: {row['somatiek']}\n"
-        f"ADL: {row['adl']}\n"
-        f"Mobiliteit: {row['mobiliteit']}\n"
-        f"Gedrag: {row['gedrag']}"
-    )
-
-
-# Load the Jinja2 templates for prompts
-env = Environment(loader=FileSystemLoader(prompts_path))
-s_template = env.get_template("generate_scenarios_s.jinja")
-system_prompt = s_template.render()  # Render the system prompt template
-u_template = env.get_template("generate_scenarios_u.jinja")  # User prompt template
+# Wire format of the completions: "full" or "compact" (short JSON keys)
+wire_format = "full"
 
 # Iterate over each LLM model row
 for _, row_models in df_models.iterrows():
@@ -67,7 +47,8 @@ for _, row_models in df_models.iterrows():
     # Check if the scenarios file already exists
     if not os.path.exists(fn_scenarios):
         scenario_list = []  # Initialize list to store scenarios
-        factory = LLMFactory(provider=provider)  # Create LLM factory instance
+        # Create a router that fails over to equivalent endpoints
+        factory = FailoverRouter(provider=provider, model=model)
 
         # Iterate over each client profile
         for _, row_profiles in tqdm(
@@ -75,61 +56,31 @@ for _, row_models in df_models.iterrows():
             total=df_profiles.shape[0],
             desc=f"Generating Scenario's for {model}",
         ):
-            # Get profile details to pass to the prompt
-            profile = format_client_profile(row_profiles)
-            num_weeks = row_profiles["duration"]
-            complications = row_profiles["complications"]
-            start_date = pd.to_datetime(row_profiles["start_date"])
-            sex = row_profiles["geslacht"]
-
-            # Render the user prompt using the template
-            user_prompt = u_template.render(
-                client_profile=profile,
-                num_weeks=num_weeks,
-                zijn_haar="haar" if sex == "v" else "zijn",
-                complications=complications,
-                dhr_mw="mw." if sex == "v" else "dhr.",
-            )
-
-            # Prepare messages for the LLM
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ]
+            # Render the prompt with the client profile (src/pipeline/work_items.py)
+            item = scenario_item(provider, model, row_profiles, wire_format)
 
             # Generate completion using the LLM
-            response_model, _ = factory.create_completion(
+            response_model, _ = create_wire_completion(
+                factory,
                 response_model=ClientScenarios,
-                messages=messages,
+                messages=item["messages"],
+                wire_format=wire_format,
                 model=model,
             )
 
             # Process the response and append scenarios to the list
-            for scenario in response_model.scenario:
-                scenario_list.append(
-                    (
-                        row_profiles["client_id"],
-                        scenario.week,
-                        start_date + pd.Timedelta(weeks=scenario.week),
-                        scenario.events_description,
-                    )
-                )
+            scenario_list.extend(
+                result_rows(item, response_model, factory.last_endpoint)
+            )
 
-        # Create a DataFrame from the scenario list
-        df_scenarios = pd.DataFrame(
-            scenario_list,
-            columns=[
-                "client_id",
-                "week",
-                "date_start_of_week",
-                "events_description",
-            ],
-        )
-        # Add a scenario ID column
-        df_scenarios.insert(0, "scenario_id", range(1, len(df_scenarios) + 1))
-        # Save the scenarios to a CSV file
-        df_scenarios.to_csv(fn_scenarios, index=False)
-        print(f"Data saved to {fn_scenarios}.")
+        with span("persist", model=model):
+            # Create a DataFrame from the scenario list
+            df_scenarios = pd.DataFrame(scenario_list, columns=ROW_COLUMNS["scenarios"])
+            # Add a scenario ID column
+            df_scenarios.insert(0, "scenario_id", range(1, len(df_scenarios) + 1))
+            # Save the scenarios to a CSV file
+            df_scenarios.to_csv(fn_scenarios, index=False)
+            print(f"Data saved to {fn_scenarios}.")
     else:
         # If the file exists, load the data
         print("Scenario file found. Loading data...")
@@ -13,41 +13,29 @@
 from pathlib import Path
 
 import pandas as pd
-from jinja2 import Environment, FileSystemLoader
 from tqdm import tqdm
 
-from llm.llm_factory import LLMFactory
+from llm.failover import FailoverRouter
+from llm.hedging import get_hedge_policy
+from llm.wire_format import create_wire_completion
+from pipeline.cascade import ModelCascade
+from pipeline.work_items import ROW_COLUMNS, format_naam, record_item, result_rows
 from prompts.generate_records_rm import ClientRecord
+from tracing.spans import span
 
 # --- Configuration ---
 datapath = Path(__file__).resolve().parents[1] / "data"
-prompts_path = Path(__file__).resolve().parents[1] / "src" / "prompts"
 
 df_models = pd.read_csv(datapath / "llm_models.csv")
 
+# Wire format of the completions: "full" or "compact" (short keys, day offset and HH:MM
+# instead of full datetimes). See scripts/measure_wire_format.py for the savings per model.
+wire_format = "full"
 
-# Function to format client profile into a string
-def format_naam(row: pd.Series) -> str:
-    titel = "Mevrouw" if row["geslacht"] == "v" else "Meneer"
-    return f"{titel} {row['voornaam']} {row['achternaam']}"
-
-
-def format_client_profile(row: pd.Series) -> str:
-    return (
-        f"Naam: {format_naam(row)}\n"
-        f"Diagnose: {row['diagnose']}\n"
-        f"Lichamelijke klachten: {row['somatiek']}\n"
-        f"ADL: {row['adl']}\n"
-        f"Mobiliteit: {row['mobiliteit']}\n"
-        f"Gedrag: {row['gedrag']}"
-    )
-
-
-# Load the Jinja2 templates for prompts
-env = Environment(loader=FileSystemLoader(prompts_path))
-s_template = env.get_template("generate_records_s.jinja")
-system_prompt = s_template.render()
-u_template = env.get_template("generate_records_u.jinja")
+# Model cascade: records of quiet scenario weeks go to the cheaper model configured in the
+# cascade settings (src/config/llm_config.py). The route is saved per note.
+cascade = False
+record_columns = ROW_COLUMNS["records"] + (["route"] if cascade else [])
 
 # Loop over llm_models
 for _, row_models in df_models.iterrows():
@@ -62,7 +50,11 @@ for _, row_models in df_models.iterrows():
 
     # Initialize list to store records
     records_list = []
-    factory = LLMFactory(provider=provider)
+    if cascade:
+        factory = ModelCascade(provider=provider, model=model)
+        routes = factory.classify(df_scenarios, df_profiles)
+    else:
+        factory = FailoverRouter(provider=provider, model=model)
 
     # Loop over client profiles
     for _, row_profiles in tqdm(
@@ -72,8 +64,6 @@ for _, row_models in df_models.iterrows():
     ):
         # Get profile details to pass to the prompt
         client_name = format_naam(row_profiles)
-        client_profile = format_client_profile(row_profiles)
-        admission_date = pd.to_datetime(row_profiles["start_date"])
 
         # Get scenarios for the current client_id
         df_profile_scenarios = df_scenarios[
@@ -87,54 +77,44 @@ for _, row_models in df_models.iterrows():
             desc=f"Generating records for {client_name}",
         ):
 
-            current_week = row_profile_scenarios["week"]
-
-            past_scenario_list = df_profile_scenarios[
-                df_profile_scenarios["week"] < row_profile_scenarios["week"]
-            ]["events_description"].tolist()
-
-            past_scenario = "\n".join(past_scenario_list)
-            week_scenario = row_profile_scenarios["events_description"]
-            start_date = (
-                admission_date + pd.Timedelta(weeks=(current_week - 1))
-            ).date()
-            sex = row_profiles["geslacht"]
-
-            # Render the user prompt using the template
-            user_prompt = u_template.render(
-                client_profile=client_profile,
-                weekno=current_week - 1,
-                events_description=past_scenario,
-                scenario=week_scenario,
-                start_date=start_date,
-                dhr_mw="mw." if sex == "v" else "dhr.",
+            # Render the prompt with the past and current week (src/pipeline/work_items.py)
+            item = record_item(
+                provider,
+                model,
+                row_profiles,
+                df_profile_scenarios,
+                row_profile_scenarios,
+                wire_format,
             )
 
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ]
-
-            response_model, _ = factory.create_completion(
+            route = routes[row_profile_scenarios["scenario_id"]] if cascade else None
+            route_kwargs = {"route": route} if cascade else {}
+            response_model, _ = create_wire_completion(
+                factory,
                 response_model=ClientRecord,
-                messages=messages,
+                messages=item["messages"],
+                wire_format=wire_format,
+                start_date=pd.to_datetime(item["start_date"]).date(),
                 model=model,
+                **route_kwargs,
             )
 
-            for record in response_model.record:
-                records_list.append(
-                    (
-                        row_profiles["client_id"],
-                        row_profile_scenarios["scenario_id"],
-                        record.date,
-                        record.note,
-                    )
-                )
-
-            # Save the records to a CSV file after each scenario-line. Prevents loss of data in case of an error or interruption.
-            df_records = pd.DataFrame(
-                records_list, columns=["client_id", "scenario_id", "date", "note"]
+            records_list.extend(
+                row + ((route,) if cascade else ())
+                for row in result_rows(item, response_model, factory.last_endpoint)
             )
-            # Add a note ID column
-            df_records.insert(0, "note_id", range(1, len(df_records) + 1))
-            df_records.to_csv(fn_records, index=False)
+
+            with span("persist", model=model):
+                # Save the records to a CSV file after each scenario-line. Prevents loss of data in case of an error or interruption.
+                df_records = pd.DataFrame(records_list, columns=record_columns)
+                # Add a note ID column
+                df_records.insert(0, "note_id", range(1, len(df_records) + 1))
+                df_records.to_csv(fn_records, index=False)
+
+    if cascade:
+        print(factory.format_report())
+
+# Report hedging activity when hedged requests are enabled in llm_config
+hedge_policy = get_hedge_policy()
+if hedge_policy is not None:
+    print(hedge_policy.format_report())
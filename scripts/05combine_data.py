@@ -3,11 +3,28 @@ from pathlib import Path
 import pandas as pd
 from datasets import Dataset
 
+from pipeline.versions import (
+    TABLE_KEYS,
+    list_versions,
+    load_version,
+    read_manifest,
+    row_hashes,
+    write_version,
+)
+
 # Read the list of LLM models and their associated ward names
 datapath = Path(__file__).resolve().parents[1] / "data"
 
 df_models = pd.read_csv(datapath / "llm_models.csv")
 
+# Every run is saved as a version in MemoryLane/versions, only the rows that changed since the last version are
+# written (a delta). None writes a complete base version when more than base_ratio of the rows changed since the
+# last base, True always writes one. Load a version with pipeline.versions.load_version, or the changes since a
+# version with changes_since.
+base = None
+base_ratio = 0.5
+versions_dir = datapath / "MemoryLane/versions"
+
 data = {
     "profiles": [],
     "scenarios": [],
@@ -33,9 +50,12 @@ for _, row in df_models.iterrows():
             # Skip processing if any of the files are missing
             continue
 
-        # Add ward and model information to the profiles DataFrame
+        # Add ward and model information to the profiles DataFrame, and the model to the others: ids repeat across
+        # models, the model is part of the key of a row
         df_p["ward"] = ward
         df_p["model"] = model
+        df_s["model"] = model
+        df_r["model"] = model
 
         # Update client_id, scenario_id, and note_id with unique prefixes
         df_p["client_id"] = df_p["client_id"].apply(lambda x: f"c{prefix}_{int(x):02d}")
@@ -55,10 +75,40 @@ for _, row in df_models.iterrows():
         data["records"].append(df_r)
 
 
+# The rows of the last version, hashed again so a change of the hash columns does not mark every row as changed.
+# The combined files in MemoryLane are only an export of the last version, they may have been redacted since.
+previous = {}
+if list_versions(versions_dir):
+    for name, df_previous in load_version(versions_dir).items():
+        df_previous["row_hash"] = row_hashes(df_previous, name)
+        previous[name] = df_previous[TABLE_KEYS[name] + ["row_hash"]]
+
+tables = {}
 for name in ["profiles", "scenarios", "records"]:
     df_list = data[name]
-    df = pd.concat(df_list)
-    df.to_csv(datapath / f"MemoryLane/{name}.csv", index=False)
+    df = pd.concat(df_list, ignore_index=True)
+    df["row_hash"] = row_hashes(df, name)
+    tables[name] = df
+
+# Save the version first, then export only the combined files of the tables that changed
+version = write_version(versions_dir, tables, previous, base, base_ratio)
+manifest = read_manifest(versions_dir, version) if version is not None else None
+for name, df in tables.items():
+    fn_table = datapath / f"MemoryLane/{name}.csv"
+    if fn_table.exists() and (
+        manifest is None or not manifest["tables"][name]["changes"]
+    ):
+        continue
+    df.to_csv(fn_table, index=False)
     # Uncomment the following lines to push the datasets to Hugging Face Hub
     # ds = Dataset.from_pandas(df)
     # ds.push_to_hub(f"ekrombouts/memory_lane_{name}", private=True)
+
+if version is None:
+    print("No changes since the last version")
+else:
+    for name, table in manifest["tables"].items():
+        print(
+            f"Version {version} {name}: {table['rows']} rows, {table['added']} added, "
+            f"{table['changed']} changed, {table['removed']} removed"
+        )
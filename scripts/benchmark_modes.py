@@ -0,0 +1,53 @@
+# Benchmark structured-output modes per provider and model
+
+# Compares the instructor modes (tools, JSON schema, JSON, markdown JSON) on ClientRecord, ClientScenarios
+# and ClientProfiles: validity, retries, output tokens and latency. Prints a summary and recommends the
+# fastest mode that always produced valid output, to be set in model_modes in src/config/llm_config.py.
+#
+# Usage:
+#   python benchmark_modes.py --provider azureopenai --model gpt-4o-mini --record recording.jsonl
+#   python benchmark_modes.py --provider azureopenai --model gpt-4o-mini --replay recording.jsonl
+#   python benchmark_modes.py --provider ollama --model phi4 --base-url http://localhost:8000/v1
+
+import argparse
+from pathlib import Path
+
+from llm.mode_benchmark import recommend, run_benchmark, summarize
+
+datapath = Path(__file__).resolve().parents[1] / "data"
+
+parser = argparse.ArgumentParser(description="Benchmark structured-output modes")
+parser.add_argument("--provider", required=True)
+parser.add_argument("--model", required=True)
+parser.add_argument("--modes", nargs="+", help="instructor mode values to compare")
+parser.add_argument("--repeats", type=int, default=3)
+parser.add_argument("--base-url", help="Base URL of an OpenAI-compatible stand-in")
+parser.add_argument(
+    "--record", type=Path, help="Record the responses to this JSONL file"
+)
+parser.add_argument(
+    "--replay", type=Path, help="Replay recorded responses from this JSONL file"
+)
+args = parser.parse_args()
+
+df_results = run_benchmark(
+    provider=args.provider,
+    model=args.model,
+    modes=args.modes,
+    repeats=args.repeats,
+    base_url=args.base_url,
+    record_path=args.record,
+    replay_path=args.replay,
+)
+df_results.to_csv(datapath / f"mode_benchmark_{args.model}.csv", index=False)
+
+df_summary = summarize(df_results)
+print(df_summary.to_string(index=False))
+
+mode = recommend(df_summary)
+if mode is None:
+    print("No mode produced valid output for every response model.")
+else:
+    print(
+        f'Recommended: model_modes = {{"{args.model}": "{mode}"}} for {args.provider}'
+    )
@@ -0,0 +1,54 @@
+# Diversity report: compare the lexical diversity of the notes of each model
+
+# Collects the records (per ward and model) and the category notes (per model and category, and per model overall),
+# and computes per group: note lengths, distinct-1/2/3, sampled self-BLEU, exact and near duplicates (MinHash) and
+# the mean similarity of random pairs. Groups run in parallel. See src/pipeline/diversity.py for the metrics.
+# Records are read from records_<model>.csv in the data directory and the ward subdirectories.
+#
+# Output:
+#   data/diversity_report.csv    one row per group
+#   data/vocabulary_overlap.csv  Jaccard similarity of the vocabularies of groups with the same source and category
+#
+# Usage:
+#   python diversity_report.py
+#   python diversity_report.py --workers 4 --seed 1
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from pipeline.diversity import diversity_report, load_notes
+
+datapath = Path(__file__).resolve().parents[1] / "data"
+
+parser = argparse.ArgumentParser(
+    description="Diversity metrics per ward, model and category"
+)
+parser.add_argument("--workers", type=int, default=None, help="Default: CPU count")
+parser.add_argument("--seed", type=int, default=0)
+args = parser.parse_args()
+
+start = time.perf_counter()
+df_notes = load_notes(datapath)
+print(f"Loaded {len(df_notes)} notes in {time.perf_counter() - start:.1f}s")
+
+if df_notes.empty:
+    print("No records or category notes found, nothing to report.")
+    sys.exit()
+
+df_report, df_overlap = diversity_report(df_notes, args.workers, args.seed)
+df_report.to_csv(datapath / "diversity_report.csv", index=False)
+df_overlap.to_csv(datapath / "vocabulary_overlap.csv", index=False)
+print(f"{len(df_report)} groups in {time.perf_counter() - start:.1f}s")
+
+if df_report.empty:
+    print("No group has enough notes to report.")
+    sys.exit()
+
+columns = ["notes", "words_p50", "distinct_2", "self_bleu", "near_duplicates"]
+for source, df_source in df_report.groupby("source"):
+    print(f"\n{source}")
+    print(
+        df_source.set_index(["ward", "model", "category"])[columns].round(3).to_string()
+    )
@@ -0,0 +1,43 @@
+# Generate scenarios and records in one streaming run
+
+# Combines 03generate_scenarios.py and 04generate_records.py without the barrier between them: the records
+# of a client are generated as soon as its scenario exists, while the scenarios of other clients are still
+# being generated. Scenario and record calls have separate concurrency limits.
+# The output is the same as that of the two scripts: scenarios_<model>.csv and records_<model>.csv in the
+# data directory. Every completion is appended as soon as it is done; a restart skips the clients and weeks
+# that are already saved.
+
+from pathlib import Path
+
+import pandas as pd
+
+from pipeline.streaming import StreamingPipeline
+
+# --- Configuration ---
+datapath = Path(__file__).resolve().parents[1] / "data"
+
+df_models = pd.read_csv(datapath / "llm_models.csv")
+
+scenario_concurrency = 2  # Scenario completions running in parallel per model
+record_concurrency = 6  # Record completions running in parallel per model
+wire_format = "full"  # "full" or "compact", see scripts/measure_wire_format.py
+
+for _, row_models in df_models.iterrows():
+    provider = row_models["llm_provider"]
+    model = row_models["llm_model"]
+
+    fn_scenarios = datapath / f"scenarios_{model}.csv"
+    fn_records = datapath / f"records_{model}.csv"
+    df_profiles = pd.read_csv(datapath / f"profiles_{model}.csv")
+    pipeline = StreamingPipeline(
+        provider=provider,
+        model=model,
+        scenario_concurrency=scenario_concurrency,
+        record_concurrency=record_concurrency,
+        wire_format=wire_format,
+    )
+    df_scenarios, df_records = pipeline.run(df_profiles, fn_scenarios, fn_records)
+    print(
+        f"{len(df_scenarios)} scenario weeks and {len(df_records)} notes saved to "
+        f"{fn_scenarios} and {fn_records}."
+    )
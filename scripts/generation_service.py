@@ -0,0 +1,164 @@
+# Generation service: a long-running process for small generation jobs
+
+# Instead of starting a script for every few extra clients or an extra category of notes, start the service once.
+# It keeps the provider clients, templates and model list warm, and runs the calls of all submitted jobs on one
+# shared pool of threads (round-robin over the jobs, with an optional limit per provider). A job runs one or more
+# stages (profiles, scenarios, records, notes) for one or all models in llm_models.csv, and appends the results to
+# the usual data files. See src/jobs/service.py for the API.
+#
+# Usage:
+#   python generation_service.py serve --port 8770 --threads 8 --limit ollama=1
+#   python generation_service.py submit --stages profiles scenarios records --model gpt-4o-mini --num-profiles 2
+#   python generation_service.py submit --stages notes --categories adl --num-notes 20
+#   python generation_service.py status [job_id]
+#   python generation_service.py watch <job_id>     (streams the job's events)
+#   python generation_service.py cancel <job_id>
+#
+# Use --socket /tmp/gencare.sock instead of --port to serve and connect over a Unix socket.
+# Ctrl+C or SIGTERM drains the service: new jobs are refused and accepted jobs are finished first.
+
+import argparse
+import http.client
+import json
+import signal
+import socket
+import threading
+from pathlib import Path
+
+datapath = Path(__file__).resolve().parents[1] / "data"
+
+parser = argparse.ArgumentParser(description="Generation service and its client")
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=8770)
+parser.add_argument("--socket", help="Unix socket path, instead of host and port")
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+serve_parser = subparsers.add_parser("serve", help="Run the service")
+serve_parser.add_argument("--threads", type=int, default=8)
+serve_parser.add_argument(
+    "--limit",
+    action="append",
+    default=[],
+    help="Maximum calls in flight for a provider, e.g. ollama=1",
+)
+serve_parser.add_argument("--drain-timeout", type=float, default=None)
+serve_parser.add_argument("--verbose", action="store_true")
+
+submit_parser = subparsers.add_parser("submit", help="Submit a job")
+submit_parser.add_argument(
+    "--stages",
+    nargs="+",
+    choices=["profiles", "scenarios", "records", "notes"],
+    required=True,
+)
+submit_parser.add_argument("--model", help="llm_model from llm_models.csv, default all")
+submit_parser.add_argument("--num-profiles", type=int, default=1)
+submit_parser.add_argument("--ward-type", choices=["som", "pg"], default="pg")
+submit_parser.add_argument("--client-ids", type=int, nargs="+")
+submit_parser.add_argument("--categories", nargs="+")
+submit_parser.add_argument("--num-notes", type=int, default=50)
+submit_parser.add_argument("--num-completions", type=int, default=1)
+submit_parser.add_argument("--wire-format", choices=["full", "compact"], default="full")
+submit_parser.add_argument(
+    "--watch", action="store_true", help="Stream the job's events after submitting"
+)
+
+status_parser = subparsers.add_parser("status", help="Show all jobs or one job")
+status_parser.add_argument("job_id", nargs="?")
+watch_parser = subparsers.add_parser("watch", help="Stream the events of a job")
+watch_parser.add_argument("job_id")
+cancel_parser = subparsers.add_parser("cancel", help="Cancel a job")
+cancel_parser.add_argument("job_id")
+
+args = parser.parse_args()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str):
+        super().__init__("localhost")
+        self.socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def request(method: str, path: str, body=None):
+    if args.socket:
+        connection = UnixHTTPConnection(args.socket)
+    else:
+        connection = http.client.HTTPConnection(args.host, args.port)
+    connection.request(
+        method,
+        path,
+        body=json.dumps(body) if body is not None else None,
+        headers={"Content-Type": "application/json"},
+    )
+    return connection.getresponse()
+
+
+def watch(job_id: str) -> None:
+    response = request("GET", f"/jobs/{job_id}/events")
+    for line in response:
+        event = json.loads(line)
+        details = ", ".join(
+            f"{k}={v}" for k, v in event.items() if k not in ("event", "time")
+        )
+        print(f"{event['event']}: {details}")
+
+
+if args.command == "serve":
+    from jobs.service import GenerationService, ServiceServer, UnixServiceServer
+
+    limits = {k: int(v) for k, v in (limit.split("=") for limit in args.limit)}
+    service = GenerationService(datapath, threads=args.threads, limits=limits)
+    if args.socket:
+        server = UnixServiceServer(args.socket, service, args.verbose)
+        print(f"Serving on {args.socket}")
+    else:
+        server = ServiceServer((args.host, args.port), service, args.verbose)
+        print(f"Serving on http://{args.host}:{args.port}")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stop.wait()
+
+    # Keep serving status requests while draining, new jobs get a 503
+    print("Draining: waiting for the accepted jobs to finish...")
+    drained = service.drain(args.drain_timeout)
+    server.shutdown()
+    server.server_close()
+    print("Drained." if drained else "Drain timeout, unfinished jobs were abandoned.")
+
+elif args.command == "submit":
+    spec = {
+        "stages": args.stages,
+        "model": args.model,
+        "num_profiles": args.num_profiles,
+        "ward_type": args.ward_type,
+        "client_ids": args.client_ids,
+        "categories": args.categories,
+        "num_notes": args.num_notes,
+        "num_completions": args.num_completions,
+        "wire_format": args.wire_format,
+    }
+    response = request("POST", "/jobs", spec)
+    result = json.loads(response.read())
+    if response.status != 202:
+        print(f"Error {response.status}: {result['error']}")
+    else:
+        print(f"Job {result['job_id']} submitted")
+        if args.watch:
+            watch(result["job_id"])
+
+elif args.command == "status":
+    path = f"/jobs/{args.job_id}" if args.job_id else "/jobs"
+    print(json.dumps(json.loads(request("GET", path).read()), indent=2))
+
+elif args.command == "watch":
+    watch(args.job_id)
+
+elif args.command == "cancel":
+    print(json.loads(request("DELETE", f"/jobs/{args.job_id}").read()))
@@ -0,0 +1,93 @@
+# Distributed generation with a job queue
+
+# Spreads the work of 03generate_scenarios.py, 04generate_records.py and 06category_notes.py over
+# several processes and machines. The work items of a stage are stored in a job queue (SQLite on a
+# shared volume by default). Any number of workers lease items, write their results to shards and
+# acknowledge them. Items of a crashed worker are handed out again when its lease expires.
+# Finally the shards are merged into the same CSV files the stage scripts write.
+#
+# Usage:
+#   python job_queue.py enqueue --stage scenarios
+#   python job_queue.py worker --threads 4          (on as many machines/processes as you like)
+#   python job_queue.py merge --stage scenarios
+#   python job_queue.py status
+#
+# Records depend on the scenarios, so merge the scenarios stage before enqueueing records.
+
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+from jobs.job_queue import create_job_queue
+from jobs.worker import Worker, merge_shards
+from pipeline.work_items import build_work_items
+
+datapath = Path(__file__).resolve().parents[1] / "data"
+
+parser = argparse.ArgumentParser(description="Distributed generation with a job queue")
+parser.add_argument(
+    "--queue",
+    default=str(datapath / "queue.db"),
+    help="Job queue URL, e.g. sqlite:////mnt/shared/queue.db, or a SQLite database path",
+)
+parser.add_argument(
+    "--shards", default=str(datapath / "shards"), help="Directory for result shards"
+)
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+enqueue_parser = subparsers.add_parser("enqueue", help="Add the work items of a stage")
+enqueue_parser.add_argument(
+    "--stage", choices=["scenarios", "records", "notes"], required=True
+)
+enqueue_parser.add_argument("--num-notes", type=int, default=50)
+enqueue_parser.add_argument("--num-completions", type=int, default=1)
+enqueue_parser.add_argument(
+    "--wire-format", choices=["full", "compact"], default="full"
+)
+
+worker_parser = subparsers.add_parser(
+    "worker", help="Process jobs until the queue is empty"
+)
+worker_parser.add_argument("--threads", type=int, default=1)
+worker_parser.add_argument("--lease-seconds", type=float, default=300.0)
+worker_parser.add_argument(
+    "--wait", action="store_true", help="Keep polling when the queue is empty"
+)
+
+merge_parser = subparsers.add_parser("merge", help="Merge the shards of a stage")
+merge_parser.add_argument(
+    "--stage", choices=["scenarios", "records", "notes"], required=True
+)
+
+subparsers.add_parser("status", help="Show the number of jobs per status")
+
+args = parser.parse_args()
+
+queue = create_job_queue(args.queue)
+
+if args.command == "enqueue":
+    df_models = pd.read_csv(datapath / "llm_models.csv")
+    items = build_work_items(
+        args.stage,
+        df_models,
+        datapath,
+        num_notes=args.num_notes,
+        num_completions=args.num_completions,
+        wire_format=args.wire_format,
+    )
+    added = queue.enqueue(items)
+    print(f"{added} of {len(items)} {args.stage} jobs added to the queue.")
+
+elif args.command == "worker":
+    worker = Worker(
+        queue, args.shards, lease_seconds=args.lease_seconds, threads=args.threads
+    )
+    worker.run(exit_when_empty=not args.wait)
+
+elif args.command == "merge":
+    for path in merge_shards(Path(args.shards), args.stage, datapath):
+        print(f"Data saved to {path}.")
+
+elif args.command == "status":
+    print(queue.counts())
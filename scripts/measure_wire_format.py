@@ -0,0 +1,215 @@
+# Measure the output tokens saved by the compact wire format
+
+# Compares the output tokens of the full response models with the compact wire format (short JSON keys,
+# dates as day offset plus HH:MM) per model.
+# - By default the generated data (profiles, scenarios and records per model) is serialized in both
+#   formats and the tokens are estimated locally, see src/llm/tokens.py. No API calls are made.
+# - With --live N, N client weeks and N profile batches per model are sent in both formats and the output
+#   tokens reported by the API are compared. These include retries and differences in what the model writes.
+#   The profiles per completion are counted in the responses.
+#
+# The compact records express each note as a day offset (0-6) from the start of its scenario week. Notes outside
+# their week (see the date_outside_week rule of quality_gate.py) cannot be expressed and are counted separately
+# in the out_of_range column.
+#
+# The results are saved to data/wire_format_savings.csv.
+#
+# Usage:
+#   python measure_wire_format.py
+#   python measure_wire_format.py --profiles-per-completion 8
+#   python measure_wire_format.py --live 5
+
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+from llm.failover import FailoverRouter
+from llm.usage import token_usage
+from llm.wire_format import create_wire_completion, serialized_tokens
+from pipeline.profiles import WARD_TYPES
+from pipeline.quality import naive_datetimes, week_starts
+from pipeline.work_items import RESPONSE_MODELS, build_work_items, render_messages
+from prompts.generate_profiles_rm import ClientProfile, ClientProfiles
+from prompts.generate_records_rm import ClientRecord, NursesNote
+from prompts.generate_scenarios_rm import ClientScenario, ClientScenarios
+
+datapath = Path(__file__).resolve().parents[1] / "data"
+
+parser = argparse.ArgumentParser(description="Measure compact wire format savings")
+parser.add_argument(
+    "--live", type=int, default=0, help="Client weeks per model to send"
+)
+parser.add_argument(
+    "--profiles-per-completion",
+    type=int,
+    default=8,
+    help="Batch size the profiles were generated with (02generate_profiles.py)",
+)
+args = parser.parse_args()
+
+df_models = pd.read_csv(datapath / "llm_models.csv")
+profiles_per_completion = args.profiles_per_completion
+
+
+def estimate_offline(model: str) -> list:
+    """Serialize the generated data of a model in both formats."""
+    rows = []
+
+    fn_profiles = datapath / f"profiles_{model}.csv"
+    if fn_profiles.exists():
+        df = pd.read_csv(fn_profiles)
+        fields = list(ClientProfile.model_fields)
+        tokens = {"full": 0, "compact": 0}
+        batches = 0
+        for start in range(0, len(df), profiles_per_completion):
+            batch = df.iloc[start : start + profiles_per_completion]
+            profiles = ClientProfiles(
+                clients=[
+                    ClientProfile(**{field: str(row[field]) for field in fields})
+                    for _, row in batch.iterrows()
+                ]
+            )
+            for wire_format in tokens:
+                tokens[wire_format] += serialized_tokens(profiles, wire_format)
+            batches += 1
+        rows.append(("profiles", batches, tokens["full"], tokens["compact"], 0))
+
+    fn_scenarios = datapath / f"scenarios_{model}.csv"
+    if fn_scenarios.exists():
+        df = pd.read_csv(fn_scenarios)
+        tokens = {"full": 0, "compact": 0}
+        for _, df_client in df.groupby("client_id"):
+            scenarios = ClientScenarios(
+                scenario=[
+                    ClientScenario(
+                        week=row["week"], events_description=row["events_description"]
+                    )
+                    for _, row in df_client.iterrows()
+                ]
+            )
+            for wire_format in tokens:
+                tokens[wire_format] += serialized_tokens(scenarios, wire_format)
+        rows.append(
+            (
+                "scenarios",
+                df["client_id"].nunique(),
+                tokens["full"],
+                tokens["compact"],
+                0,
+            )
+        )
+
+    fn_records = datapath / f"records_{model}.csv"
+    if fn_records.exists() and fn_scenarios.exists():
+        df = pd.read_csv(fn_records)
+        # The week starts as passed to the records prompt, not the first note's date
+        df = df.merge(
+            week_starts(pd.read_csv(fn_scenarios), pd.read_csv(fn_profiles))[
+                ["scenario_id", "week_start"]
+            ],
+            on="scenario_id",
+            how="left",
+        )
+        df["date"] = naive_datetimes(df["date"])
+        in_week = (df["date"] >= df["week_start"]) & (
+            df["date"] < df["week_start"] + pd.Timedelta(days=7)
+        )
+        tokens = {"full": 0, "compact": 0}
+        for _, df_week in df[in_week].groupby("scenario_id"):
+            record = ClientRecord(
+                record=[
+                    NursesNote(date=row["date"], note=row["note"])
+                    for _, row in df_week.iterrows()
+                ]
+            )
+            start_date = df_week["week_start"].iloc[0].date()
+            for wire_format in tokens:
+                tokens[wire_format] += serialized_tokens(
+                    record, wire_format, start_date
+                )
+        rows.append(
+            (
+                "records",
+                df.loc[in_week, "scenario_id"].nunique(),
+                tokens["full"],
+                tokens["compact"],
+                int((~in_week).sum()),
+            )
+        )
+
+    return rows
+
+
+def measure_live(row_models: pd.Series, num_items: int) -> list:
+    """Send the first client weeks and profile batches of a model in both formats."""
+    df_model = row_models.to_frame().T
+    router = FailoverRouter(
+        provider=row_models["llm_provider"], model=row_models["llm_model"]
+    )
+    tokens = {}
+    for wire_format in ["full", "compact"]:
+        items = build_work_items("records", df_model, datapath, wire_format=wire_format)
+        tokens[wire_format] = 0
+        for item in items[:num_items]:
+            _, raw = create_wire_completion(
+                router,
+                response_model=RESPONSE_MODELS["records"],
+                messages=item["messages"],
+                wire_format=wire_format,
+                start_date=pd.to_datetime(item["start_date"]).date(),
+                model=item["model"],
+            )
+            tokens[wire_format] += token_usage(raw)[1]
+    rows = [
+        ("records", min(num_items, len(items)), tokens["full"], tokens["compact"], 0)
+    ]
+
+    # Profile batches, the profiles per completion are whatever the model returned
+    messages = render_messages("generate_profiles", avoid_names="", **WARD_TYPES["pg"])
+    tokens, profiles = {}, {}
+    for wire_format in ["full", "compact"]:
+        tokens[wire_format], profiles[wire_format] = 0, 0
+        for _ in range(num_items):
+            response_model, raw = create_wire_completion(
+                router,
+                response_model=ClientProfiles,
+                messages=messages,
+                wire_format=wire_format,
+                model=row_models["llm_model"],
+            )
+            tokens[wire_format] += token_usage(raw)[1]
+            profiles[wire_format] += len(response_model.clients)
+    # Compare per profile, the batches of both formats may differ in size
+    compact_tokens = tokens["compact"] * profiles["full"] / max(profiles["compact"], 1)
+    rows.append(("profiles", num_items, tokens["full"], round(compact_tokens), 0))
+    return rows
+
+
+results = []
+for _, row_models in df_models.iterrows():
+    model = row_models["llm_model"]
+    if args.live:
+        rows, method = measure_live(row_models, args.live), "api usage"
+    else:
+        rows, method = estimate_offline(model), "estimate"
+    for row in rows:
+        results.append((model, *row, method))
+
+df_results = pd.DataFrame(
+    results,
+    columns=[
+        "model",
+        "stage",
+        "completions",
+        "full_tokens",
+        "compact_tokens",
+        "out_of_range",
+        "method",
+    ],
+)
+df_results["saving_pct"] = (
+    100 * (1 - df_results["compact_tokens"] / df_results["full_tokens"])
+).round(1)
+df_results.to_csv(datapath / "wire_format_savings.csv", index=False)
+print(df_results.to_string(index=False))
@@ -0,0 +1,72 @@
+# Pre-flight planner for the scenarios and records stages
+
+# Estimates a run of 03generate_scenarios.py or 04generate_records.py before it is started: the number of
+# calls per model and ward, the input and output tokens (including the growing scenario history), the cost
+# and the wall time under each provider's rate limits and concurrency (rpm, tpm, concurrency and
+# model_prices in src/config/llm_config.py). Prompt sizes are estimated locally from the templates and the
+# data files, no API calls are made.
+#
+# The stage scripts run the models one after the other, so the run takes the sum of the per-model times.
+# Runs over --budget (USD) or --deadline (hours) are flagged.
+#
+# Usage:
+#   python plan_run.py --stage records --budget 25 --deadline 8
+#   python plan_run.py --stage records --concurrency 8    (e.g. with job_queue.py workers)
+
+import argparse
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+from pipeline.planner import plan_run
+
+datapath = Path(__file__).resolve().parents[1] / "data"
+
+parser = argparse.ArgumentParser(description="Estimate calls, tokens, cost and time")
+parser.add_argument("--stage", choices=["scenarios", "records"], default="records")
+parser.add_argument("--budget", type=float, help="Maximum cost of the run in USD")
+parser.add_argument(
+    "--deadline", type=float, help="Maximum wall time of the run in hours"
+)
+parser.add_argument(
+    "--concurrency", type=int, help="Calls in flight per model, overrides the settings"
+)
+args = parser.parse_args()
+
+df_models = pd.read_csv(datapath / "llm_models.csv")
+df_plan = plan_run(args.stage, df_models, datapath, args.concurrency)
+df_plan.to_csv(datapath / f"run_plan_{args.stage}.csv", index=False)
+
+if df_plan.empty:
+    print("No profiles found, nothing to plan.")
+    sys.exit()
+
+print(
+    df_plan.to_string(
+        index=False,
+        formatters={
+            "cost": "${:,.2f}".format,
+            "hours": "{:.1f}".format,
+            "throttled_hours": "{:.1f}".format,
+        },
+    )
+)
+total_cost = df_plan["cost"].sum()
+total_hours = df_plan["hours"].sum()
+print(
+    f"\nTotal: {df_plan['calls'].sum()} calls, {df_plan['input_tokens'].sum():,} input "
+    f"and {df_plan['output_tokens'].sum():,} output tokens, ${total_cost:,.2f}, "
+    f"{total_hours:.1f} hours"
+)
+
+unpriced = df_plan.loc[df_plan["cost"] == 0, "model"].unique()
+if len(unpriced):
+    print(f"No prices configured for {', '.join(unpriced)}, counted as free.")
+if args.budget is not None and total_cost > args.budget:
+    print(f"WARNING: the run exceeds the budget of ${args.budget:,.2f}.")
+if args.deadline is not None:
+    if total_hours > args.deadline:
+        print(f"WARNING: the run does not finish within {args.deadline} hours.")
+    for row in df_plan[df_plan["hours"] > args.deadline].itertuples():
+        print(f"WARNING: {row.model} ({row.ward}) alone takes {row.hours:.1f} hours.")
@@ -0,0 +1,102 @@
+# Quality gate for generated scenarios and records
+
+# Checks scenarios_<model>.csv and records_<model>.csv against the prompt contract: every week up to the
+# client's duration has a scenario, every week has 21 notes dated within the week, notes do not mention the
+# client's name and are not empty or duplicated. The defects are saved per work item to
+# data/defects_<model>.csv.
+# Only the failing work items (client weeks for records, clients with missing weeks for scenarios) are
+# regenerated through the job queue, and merged back into the data files in place.
+#
+# Usage:
+#   python quality_gate.py check
+#   python quality_gate.py requeue --run --threads 4    (or run job_queue.py workers on the repair queue)
+#   python quality_gate.py merge
+#
+# Scenario weeks that were added get their records in the next round: check again after merging.
+
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+from jobs.job_queue import create_job_queue
+from jobs.worker import Worker
+from pipeline.quality import (
+    DEFECT_COLUMNS,
+    check_model,
+    merge_regenerated,
+    regenerate_items,
+)
+
+datapath = Path(__file__).resolve().parents[1] / "data"
+
+parser = argparse.ArgumentParser(description="Quality gate for scenarios and records")
+parser.add_argument(
+    "--queue",
+    default=str(datapath / "repair_queue.db"),
+    help="Job queue URL or SQLite database path for the regenerated work items",
+)
+parser.add_argument(
+    "--shards",
+    default=str(datapath / "repair_shards"),
+    help="Directory for the shards of the regenerated work items",
+)
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+subparsers.add_parser("check", help="Check all models and save the defect reports")
+requeue_parser = subparsers.add_parser("requeue", help="Queue the failing work items")
+requeue_parser.add_argument(
+    "--run", action="store_true", help="Process the queued items in this process"
+)
+requeue_parser.add_argument("--threads", type=int, default=1)
+subparsers.add_parser("merge", help="Merge the regenerated work items in place")
+
+args = parser.parse_args()
+
+df_models = pd.read_csv(datapath / "llm_models.csv")
+
+
+def load_defects(model: str) -> pd.DataFrame:
+    fn_defects = datapath / f"defects_{model}.csv"
+    if not fn_defects.exists():
+        return pd.DataFrame(columns=DEFECT_COLUMNS)
+    return pd.read_csv(fn_defects)
+
+
+def save_defects(model: str) -> pd.DataFrame:
+    df_defects = check_model(model, datapath)
+    df_defects.to_csv(datapath / f"defects_{model}.csv", index=False)
+    if df_defects.empty:
+        print(f"{model}: no defects")
+    else:
+        summary = df_defects.groupby(["stage", "rule"])["key"].nunique()
+        print(f"{model}: work items with defects per rule")
+        print(summary.to_string())
+    return df_defects
+
+
+if args.command == "check":
+    for _, row_models in df_models.iterrows():
+        save_defects(row_models["llm_model"])
+
+elif args.command == "requeue":
+    queue = create_job_queue(args.queue)
+    for _, row_models in df_models.iterrows():
+        model = row_models["llm_model"]
+        items = regenerate_items(
+            load_defects(model), row_models, datapath, Path(args.shards)
+        )
+        # Items from an earlier round are done already, reset them with the new prompts
+        queue.requeue(items)
+        print(f"{model}: {len(items)} work items queued for regeneration.")
+    if args.run:
+        Worker(queue, args.shards, threads=args.threads).run()
+
+elif args.command == "merge":
+    for _, row_models in df_models.iterrows():
+        model = row_models["llm_model"]
+        merged = merge_regenerated(
+            load_defects(model), model, Path(args.shards), datapath
+        )
+        print(f"{model}: merged {merged}")
+        save_defects(model)
@@ -0,0 +1,86 @@
+# Scan generated notes for client names
+
+# The prompts ask to avoid the client's name, this script checks it. The first and last names of all profiles
+# (all models, the data directory and its ward subdirectories) are compiled into one multi-pattern automaton,
+# which scans records_<model>.csv, notes.csv and the combined MemoryLane/records.csv in chunks.
+# Every hit is saved to data/name_leaks.csv, with own = True if the name is the note's own client's.
+#
+# Leaks in the records of the data directory can be fixed in two ways:
+#   --defects  adds the names of other clients as name_leak defects to defects_<model>.csv (quality_gate.py check
+#              already reports the own client's names), run quality_gate.py requeue and merge next to regenerate
+#              those client weeks (after quality_gate.py check, which rewrites the file)
+#   --redact   replaces the names in the files in place by a placeholder (also for notes.csv)
+#
+# Usage:
+#   python scan_names.py
+#   python scan_names.py --defects
+#   python scan_names.py --redact --replacement client
+
+import argparse
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from pipeline.leaks import redact_file, scan_files
+from pipeline.quality import DEFECT_COLUMNS, leak_defects
+
+datapath = Path(__file__).resolve().parents[1] / "data"
+
+parser = argparse.ArgumentParser(description="Scan generated notes for client names")
+parser.add_argument(
+    "files", nargs="*", help="CSV files with a note column, defaults to all known files"
+)
+parser.add_argument("--chunksize", type=int, default=10_000)
+parser.add_argument(
+    "--defects", action="store_true", help="Add the leaks to the defect reports"
+)
+parser.add_argument(
+    "--redact", action="store_true", help="Replace the names in the files"
+)
+parser.add_argument("--replacement", default="client")
+args = parser.parse_args()
+
+if args.files:
+    paths = [Path(f) for f in args.files]
+else:
+    dirs = [datapath] + sorted(p for p in datapath.iterdir() if p.is_dir())
+    paths = [f for d in dirs for f in sorted(d.glob("records_*.csv"))]
+    paths += [
+        f
+        for f in [datapath / "notes.csv", datapath / "MemoryLane/records.csv"]
+        if f.exists()
+    ]
+
+start = time.perf_counter()
+df_hits = scan_files(paths, datapath, args.chunksize)
+df_hits.to_csv(datapath / "name_leaks.csv", index=False)
+print(f"Scanned {len(paths)} files in {time.perf_counter() - start:.1f}s")
+if not df_hits.empty:
+    summary = df_hits.groupby("file").agg(
+        notes=("row", "nunique"), hits=("row", "size"), own=("own", "sum")
+    )
+    print(summary.to_string())
+
+if args.defects:
+    df_models = pd.read_csv(datapath / "llm_models.csv")
+    for model in df_models["llm_model"]:
+        df_leaks = leak_defects(df_hits, model, datapath)
+        if df_leaks.empty:
+            continue
+        fn_defects = datapath / f"defects_{model}.csv"
+        df_defects = (
+            pd.read_csv(fn_defects)
+            if fn_defects.exists()
+            else pd.DataFrame(columns=DEFECT_COLUMNS)
+        )
+        df_defects = pd.concat([df_defects, df_leaks], ignore_index=True)
+        df_defects = df_defects.drop_duplicates(["key", "rule"])
+        df_defects.to_csv(fn_defects, index=False)
+        print(f"{model}: {len(df_leaks)} client weeks with name leaks added to defects")
+
+if args.redact:
+    for path in paths:
+        changed = redact_file(path, df_hits, args.replacement, args.chunksize)
+        if changed:
+            print(f"{path}: {changed} notes redacted")
@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
@@ -19,6 +19,25 @@ class LLMProviderSettings(BaseSettings):
     top_p: float = 0.7
     max_tokens: Optional[int] = None
     max_retries: int = 3
+    # Structured-output mode, an instructor.Mode value such as "tool_call", "json_schema_mode",
+    # "json_mode" or "markdown_json_mode". None uses the instructor default for the provider.
+    mode: Optional[str] = None
+    # Per-model overrides of the mode, e.g. {"gpt-4o-mini": "json_schema_mode"}
+    model_modes: Dict[str, str] = {}
+    # Multi-sample requests: samples per request on providers that support n, and
+    # concurrent requests (n-requests or single completions) per create_samples call
+    max_samples_per_request: int = 10
+    sample_concurrency: int = 4
+    # Rate limits and throughput, used by the run planner (scripts/plan_run.py). Set the
+    # limits to the quota of your account or deployment, None means no limit.
+    rpm: Optional[int] = None
+    tpm: Optional[int] = None
+    # Calls in flight per model, the stage scripts make one at a time
+    concurrency: int = 1
+    output_tokens_per_second: float = 60.0
+    request_overhead: float = 0.6  # Seconds per call before the first output token
+    # Prices per model in USD per million (input, output) tokens
+    model_prices: Dict[str, Tuple[float, float]] = {}
 
 
 class OpenAISettings(LLMProviderSettings):
@@ -26,6 +45,12 @@ class OpenAISettings(LLMProviderSettings):
 
     api_key: str = os.getenv("OPENAI_API_KEY")
     default_model: str = "gpt-4o-mini-2024-07-18"
+    rpm: Optional[int] = 500
+    tpm: Optional[int] = 200_000
+    model_prices: Dict[str, Tuple[float, float]] = {
+        "gpt-4o-mini-2024-07-18": (0.15, 0.60),
+        "gpt-4o-2024-08-06": (2.50, 10.00),
+    }
 
 
 class AzureOpenAISettings(LLMProviderSettings):
@@ -35,6 +60,12 @@ class AzureOpenAISettings(LLMProviderSettings):
     default_model: str = "gpt-4o-mini"
     api_version: str = "2024-02-01"
     azure_endpoint: str = os.getenv("AZURE_OPENAI_ENDPOINT")
+    rpm: Optional[int] = 1_200
+    tpm: Optional[int] = 200_000
+    model_prices: Dict[str, Tuple[float, float]] = {
+        "gpt-4o-mini": (0.165, 0.66),
+        "gpt-4o": (2.75, 11.00),
+    }
 
 
 class AnthropicSettings(LLMProviderSettings):
@@ -43,6 +74,11 @@ class AnthropicSettings(LLMProviderSettings):
     api_key: str = os.getenv("ANTHROPIC_API_KEY")
     default_model: str = "claude-3-5-sonnet-20240620"
     max_tokens: int = 4096
+    rpm: Optional[int] = 50
+    tpm: Optional[int] = 40_000
+    model_prices: Dict[str, Tuple[float, float]] = {
+        "claude-3-5-sonnet-20240620": (3.00, 15.00),
+    }
 
 
 class OllamaSettings(LLMProviderSettings):
@@ -50,7 +86,52 @@ class OllamaSettings(LLMProviderSettings):
 
     api_key: str = "key"  # required, but not used
     default_model: str = "phi4"
-    base_url: str = "http://localhost:11434/v1"
+    mode: Optional[str] = "json_mode"
+    base_url: str = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
+    output_tokens_per_second: float = 15.0  # Depends on the local hardware
+
+
+class HedgingSettings(BaseSettings):
+    """Settings for hedged requests (duplicate calls for slow completions)."""
+
+    enabled: bool = False
+    # Fire a duplicate once a call runs longer than this latency percentile
+    percentile: float = 95.0
+    # Number of observed latencies per (provider, model, response_model) before hedging starts
+    min_samples: int = 20
+    # Latencies kept per key to compute the percentile
+    window: int = 200
+    # Maximum fraction of calls in a run that may be hedged
+    budget: float = 0.05
+
+
+class FailoverSettings(BaseSettings):
+    """Settings for failover between equivalent endpoints."""
+
+    # Each group lists equivalent (provider, model) endpoints in order of preference.
+    # Traffic moves to the next healthy endpoint when a circuit opens.
+    groups: List[List[Tuple[str, str]]] = [
+        [("azureopenai", "gpt-4o-mini"), ("openai", "gpt-4o-mini-2024-07-18")],
+        [("azureopenai", "gpt-4o"), ("openai", "gpt-4o-2024-08-06")],
+    ]
+    # Consecutive throttling/server errors before the circuit of an endpoint opens
+    failure_threshold: int = 3
+    # Seconds an open circuit waits before a probe request is let through
+    recovery_time: float = 60.0
+
+
+class CascadeSettings(BaseSettings):
+    """Settings for routing quiet scenario weeks to a cheaper model (records stage)."""
+
+    # Cheaper (provider, model) per strong model. Weeks of models that are not listed
+    # always go to the strong model.
+    quiet_endpoints: Dict[str, Tuple[str, str]] = {
+        "gpt-4o": ("azureopenai", "gpt-4o-mini"),
+        "gpt-4o-2024-08-06": ("openai", "gpt-4o-mini-2024-07-18"),
+        "claude-3-5-sonnet-20240620": ("ollama", "phi4"),
+    }
+    # Weeks with a difficulty score up to this value are quiet
+    quiet_threshold: int = 0
 
 
 class LLMConfig(BaseSettings):
@@ -60,3 +141,6 @@ class LLMConfig(BaseSettings):
     azureopenai: AzureOpenAISettings = AzureOpenAISettings()
     anthropic: AnthropicSettings = AnthropicSettings()
     ollama: OllamaSettings = OllamaSettings()
+    hedging: HedgingSettings = HedgingSettings()
+    failover: FailoverSettings = FailoverSettings()
+    cascade: CascadeSettings = CascadeSettings()
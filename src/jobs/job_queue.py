@@ -0,0 +1,261 @@
+import json
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional
+
+"""
+Job Queue Module
+
+A job queue with lease semantics, so a generation run can be spread over several
+processes and machines. A worker leases a job for a limited time and extends the
+lease with heartbeats while it works. When a worker crashes its lease expires and the
+job is handed out again. Jobs are acknowledged once their result has been written.
+
+Backends are pluggable: create_job_queue picks the backend from the URL scheme, e.g.
+"sqlite:////mnt/shared/queue.db". The SQLite backend only needs a shared volume.
+"""
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class Job:
+    """A leased job."""
+
+    job_id: str
+    payload: Dict[str, Any]
+    attempts: int
+    lease_expires: float
+
+
+class JobQueue(ABC):
+    """Abstract base class for job queue backends."""
+
+    @abstractmethod
+    def enqueue(self, payloads: Iterable[Dict[str, Any]]) -> int:
+        """
+        Add jobs, keyed by payload["key"]. Existing keys are ignored.
+        Returns the number added.
+        """
+        pass
+
+    @abstractmethod
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Job]:
+        """Lease the next pending or expired job, None if there is nothing to do."""
+        pass
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """Extend a lease. Returns False if the worker no longer holds the lease."""
+        pass
+
+    @abstractmethod
+    def ack(self, job_id: str, worker_id: str) -> bool:
+        """
+        Mark a leased job as done. Returns False if the worker no longer holds the
+        lease.
+        """
+        pass
+
+    @abstractmethod
+    def fail(self, job_id: str, worker_id: str, error: str) -> None:
+        """Release a job after an error, it is retried until max_attempts is reached."""
+        pass
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status."""
+        pass
+
+    @abstractmethod
+    def requeue(self, payloads: Iterable[Dict[str, Any]]) -> int:
+        """
+        Add jobs or reset them to pending with a new payload, e.g. to regenerate their
+        results with a new prompt. Returns the number added or reset.
+        """
+        pass
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    SQLite implementation of the job queue.
+
+    Every operation runs in its own short transaction. Leasing uses BEGIN IMMEDIATE,
+    so two workers can never lease the same job.
+
+    Attributes:
+        path: Path to the SQLite database file
+        max_attempts: Number of leases after which a failing job is marked as failed
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3, timeout: float = 60.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    stage TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+                """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per operation keeps the queue usable from several threads
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+    def enqueue(self, payloads: Iterable[Dict[str, Any]]) -> int:
+        now = time.time()
+        rows = [
+            (p["key"], p.get("stage", ""), json.dumps(p, default=str), now, now)
+            for p in payloads
+        ]
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (job_id, stage, payload, created, updated) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            added = conn.total_changes - before
+            conn.execute("COMMIT")
+        return added
+
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Job]:
+        with closing(self._connect()) as conn:
+            while True:
+                now = time.time()
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT job_id, payload, attempts FROM jobs "
+                    "WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                    "ORDER BY created, job_id LIMIT 1",
+                    (PENDING, LEASED, now),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                job_id, payload, attempts = row
+                if attempts >= self.max_attempts:
+                    # The lease of the last attempt expired, the worker probably crashed
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, updated = ? "
+                        "WHERE job_id = ?",
+                        (FAILED, "lease expired on last attempt", now, job_id),
+                    )
+                    conn.execute("COMMIT")
+                    continue
+                expires = now + lease_seconds
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker_id = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated = ? WHERE job_id = ?",
+                    (LEASED, worker_id, expires, now, job_id),
+                )
+                conn.execute("COMMIT")
+                return Job(job_id, json.loads(payload), attempts + 1, expires)
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? "
+                "WHERE job_id = ? AND worker_id = ? AND status = ?",
+                (now + lease_seconds, now, job_id, worker_id, LEASED),
+            )
+        return cursor.rowcount == 1
+
+    def ack(self, job_id: str, worker_id: str) -> bool:
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, lease_expires = NULL, error = NULL, "
+                "updated = ? WHERE job_id = ? AND worker_id = ? AND status = ?",
+                (DONE, time.time(), job_id, worker_id, LEASED),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> None:
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "lease_expires = NULL, error = ?, updated = ? "
+                "WHERE job_id = ? AND worker_id = ? AND status = ?",
+                (
+                    self.max_attempts,
+                    FAILED,
+                    PENDING,
+                    error,
+                    time.time(),
+                    job_id,
+                    worker_id,
+                    LEASED,
+                ),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
+
+    def requeue(self, payloads: Iterable[Dict[str, Any]]) -> int:
+        now = time.time()
+        rows = [
+            (p["key"], p.get("stage", ""), json.dumps(p, default=str), now, now)
+            for p in payloads
+        ]
+        with closing(self._connect()) as conn:
+            # A job from an earlier round gets the new payload, not only a new status
+            cursor = conn.executemany(
+                "INSERT INTO jobs (job_id, stage, payload, created, updated) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(job_id) DO UPDATE SET "
+                "stage = excluded.stage, payload = excluded.payload, status = ?, "
+                "attempts = 0, worker_id = NULL, lease_expires = NULL, error = NULL, "
+                "updated = excluded.updated",
+                [row + (PENDING,) for row in rows],
+            )
+        return cursor.rowcount
+
+
+QUEUE_BACKENDS = {
+    "sqlite": SQLiteJobQueue,
+}
+
+
+def create_job_queue(url: str, **kwargs) -> JobQueue:
+    """
+    Create a job queue from a URL, e.g. "sqlite:///data/queue.db".
+
+    A plain path is treated as a SQLite database.
+
+    Raises:
+        ValueError: If the backend is not supported
+    """
+    scheme, sep, location = url.partition("://")
+    if not sep:
+        scheme, location = "sqlite", url
+    elif scheme == "sqlite":
+        # As in SQLAlchemy: sqlite:///relative/path.db and sqlite:////absolute/path.db
+        location = location[1:]
+    backend = QUEUE_BACKENDS.get(scheme)
+    if backend is None:
+        raise ValueError(f"Unsupported job queue backend: {scheme}")
+    return backend(location, **kwargs)
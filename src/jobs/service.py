@@ -0,0 +1,670 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, Future, as_completed
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from socketserver import ThreadingUnixStreamServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from llm.failover import FailoverRouter
+from llm.wire_format import create_wire_completion
+from pipeline.profiles import WARD_TYPES, ProfileEngine
+from pipeline.work_items import (
+    DATA_PATH,
+    RESPONSE_MODELS,
+    ROW_COLUMNS,
+    note_item,
+    record_item,
+    result_rows,
+    scenario_item,
+)
+from prompts.category_notes_data import input_data_list
+from tracing.spans import span
+
+"""
+Generation Service Module
+
+A long-running process for many small generation jobs: a few extra clients, the
+records of one client, one extra category of notes. The scripts pay for importing the
+SDKs, reading the model list and building clients on every run; the service does that
+once and keeps the routers (with their provider clients and circuit breakers), the
+compiled templates and the model list warm between jobs.
+
+A job runs one or more stages for one or all models:
+- profiles: num_profiles new profiles, appended to profiles_<model>.csv
+- scenarios: scenarios of the clients without scenarios (or of client_ids)
+- records: records of the scenario weeks without records (or of client_ids)
+- notes: notes for some or all categories, appended to notes.csv
+Stages run in order, so ["profiles", "scenarios", "records"] generates complete new
+clients. New rows get ids after the highest existing id.
+
+The calls of all jobs, including the profile batches, share one Scheduler: a fixed
+pool of threads that takes calls from the jobs round-robin, so a large job does not
+starve small ones, and limits the calls in flight per provider. Jobs running the same
+stage on the same model take turns, so they do not generate the same missing clients.
+Every job keeps a list of events (stage started, call done or failed, file written),
+which the API streams as JSON lines.
+
+The API is served over HTTP or a Unix socket:
+- POST /jobs: submit a job, returns its id
+- GET /jobs, GET /jobs/<id>: status of all jobs or one job
+- GET /jobs/<id>/events: the job's events as JSON lines, streamed until it ends
+- DELETE /jobs/<id>: cancel the job's pending calls; the job is "cancelling" until
+  its running calls are done and written, then "cancelled"
+- GET /health
+
+On shutdown the service drains: new jobs are refused and accepted jobs are finished.
+"""
+
+STAGES = ("profiles", "scenarios", "records", "notes")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLING = "cancelling"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class Scheduler:
+    """
+    Shared pool of threads that runs the calls of all jobs.
+
+    Calls are taken round-robin from the jobs with pending calls, skipping calls of a
+    provider that is at its limit.
+
+    Attributes:
+        threads: Number of calls in flight in total
+        limits: Maximum calls in flight per provider, unlimited if not listed
+    """
+
+    def __init__(self, threads: int = 8, limits: Optional[Dict[str, int]] = None):
+        self.threads = threads
+        self.limits = limits or {}
+        self.running: Dict[str, int] = {}
+        self._pending: Dict[str, List[Tuple[str, Callable, Future]]] = {}
+        self._turn = 0
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(threads)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, job_id: str, provider: str, fn: Callable, *args) -> Future:
+        """Queue a call of a job, returns its future."""
+        future: Future = Future()
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("The scheduler is stopped")
+            self._pending.setdefault(job_id, []).append(
+                (provider, lambda: fn(*args), future)
+            )
+            self._condition.notify()
+        return future
+
+    def cancel(self, job_id: str) -> int:
+        """Cancel the pending calls of a job, returns the number cancelled."""
+        with self._condition:
+            pending = self._pending.pop(job_id, [])
+        for _, _, future in pending:
+            # Notifying the waiters moves the future on from as_completed and wait
+            future.cancel()
+            future.set_running_or_notify_cancel()
+        return len(pending)
+
+    def _next(self) -> Optional[Tuple[str, Callable, Future]]:
+        job_ids = list(self._pending)
+        for offset in range(len(job_ids)):
+            job_id = job_ids[(self._turn + offset) % len(job_ids)]
+            calls = self._pending[job_id]
+            for index, (provider, _, _) in enumerate(calls):
+                if self.running.get(provider, 0) < self.limits.get(
+                    provider, self.threads
+                ):
+                    self._turn = (self._turn + offset + 1) % len(job_ids)
+                    call = calls.pop(index)
+                    if not calls:
+                        del self._pending[job_id]
+                    return call
+        return None
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                call = self._next()
+                while call is None:
+                    if self._stopped and not self._pending:
+                        return
+                    self._condition.wait()
+                    call = self._next()
+                provider, fn, future = call
+                self.running[provider] = self.running.get(provider, 0) + 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn())
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._condition:
+                    self.running[provider] -= 1
+                    self._condition.notify_all()
+
+    def pending(self) -> int:
+        with self._condition:
+            return sum(len(calls) for calls in self._pending.values())
+
+    def shutdown(self) -> None:
+        """Run the pending calls, then stop the threads."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+
+@dataclass
+class ServiceJob:
+    """A submitted job, its progress and its events."""
+
+    job_id: str
+    spec: Dict[str, Any]
+    status: str = QUEUED
+    stage: Optional[str] = None
+    calls: int = 0
+    done: int = 0
+    failed: int = 0
+    rows: Dict[str, int] = field(default_factory=dict)
+    error: Optional[str] = None
+    submitted: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    events: List[Dict[str, Any]] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            key: getattr(self, key)
+            for key in (
+                "job_id",
+                "spec",
+                "status",
+                "stage",
+                "calls",
+                "done",
+                "failed",
+                "rows",
+                "error",
+                "submitted",
+                "finished",
+            )
+        }
+
+
+class GenerationService:
+    """
+    Runs generation jobs on warm routers and a shared scheduler.
+
+    Attributes:
+        datapath: Directory with llm_models.csv and the data files
+        scheduler: The scheduler shared by all jobs
+        routers: Router per (provider, model), reused across jobs
+        jobs: All submitted jobs by id
+        accepting: False once the service drains
+    """
+
+    def __init__(
+        self,
+        datapath: Path = DATA_PATH,
+        threads: int = 8,
+        limits: Optional[Dict[str, int]] = None,
+    ):
+        self.datapath = Path(datapath)
+        self.scheduler = Scheduler(threads, limits)
+        self.routers: Dict[Tuple[str, str], FailoverRouter] = {}
+        self.jobs: Dict[str, ServiceJob] = {}
+        self.accepting = True
+        self._models: Tuple[float, pd.DataFrame] = (0.0, pd.DataFrame())
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._file_locks: Dict[Path, threading.Lock] = {}
+        self._stage_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._threads: List[threading.Thread] = []
+
+    def models(self) -> pd.DataFrame:
+        """llm_models.csv, read again only when the file changes."""
+        path = self.datapath / "llm_models.csv"
+        mtime = path.stat().st_mtime
+        with self._lock:
+            if mtime != self._models[0]:
+                self._models = (mtime, pd.read_csv(path))
+            return self._models[1]
+
+    def router(self, provider: str, model: str) -> FailoverRouter:
+        with self._lock:
+            if (provider, model) not in self.routers:
+                self.routers[(provider, model)] = FailoverRouter(
+                    provider=provider, model=model
+                )
+            return self.routers[(provider, model)]
+
+    def submit(self, spec: Dict[str, Any]) -> ServiceJob:
+        """
+        Validate and start a job.
+
+        Args:
+            spec: stages (list) or stage, and optionally model (all models by default),
+                num_profiles and ward_type (profiles), client_ids (scenarios, records),
+                categories, num_notes and num_completions (notes), wire_format
+
+        Raises:
+            ValueError: If the spec is invalid
+            RuntimeError: If the service is draining
+        """
+        if not self.accepting:
+            raise RuntimeError("The service is shutting down")
+        stages = spec.get("stages") or [spec.get("stage")]
+        unknown = [s for s in stages if s not in STAGES]
+        if unknown:
+            raise ValueError(f"Unknown stages: {unknown}, choose from {STAGES}")
+        if "profiles" in stages and spec.get("ward_type", "pg") not in WARD_TYPES:
+            raise ValueError(f"Unknown ward type: {spec['ward_type']}")
+        categories = {input_data["cat"] for input_data in input_data_list}
+        unknown = set(spec.get("categories") or []) - categories
+        if unknown:
+            raise ValueError(f"Unknown categories: {sorted(unknown)}")
+        models = self.models()
+        if spec.get("model") and spec["model"] not in set(models["llm_model"]):
+            raise ValueError(f"Unknown model: {spec['model']}")
+
+        job = ServiceJob(job_id=uuid.uuid4().hex[:12], spec={**spec, "stages": stages})
+        with self._lock:
+            self.jobs[job.job_id] = job
+        thread = threading.Thread(target=self._run, args=(job,), daemon=True)
+        self._threads.append(thread)
+        thread.start()
+        return job
+
+    def cancel(self, job_id: str) -> int:
+        job = self.jobs[job_id]
+        if job.status not in FINISHED:
+            # Calls already running still finish and are written, _run sets CANCELLED
+            job.status = CANCELLING
+        cancelled = self.scheduler.cancel(job_id)
+        self._event(job, "cancelled", calls=cancelled)
+        return cancelled
+
+    def _event(self, job: ServiceJob, event: str, **data) -> None:
+        with self._changed:
+            job.events.append({"event": event, "time": time.time(), **data})
+            self._changed.notify_all()
+
+    def events(self, job_id: str, start: int, timeout: float = 15.0):
+        """Events of a job from index start, waiting up to timeout for new ones."""
+        job = self.jobs[job_id]
+        with self._changed:
+            self._changed.wait_for(
+                lambda: len(job.events) > start or job.finished is not None, timeout
+            )
+            return job.events[start:], job.finished is not None
+
+    def _run(self, job: ServiceJob) -> None:
+        if job.status == QUEUED:
+            job.status = RUNNING
+        models = self.models()
+        if job.spec.get("model"):
+            models = models[models["llm_model"] == job.spec["model"]]
+        try:
+            for stage in job.spec["stages"]:
+                if job.status == CANCELLING:
+                    break
+                job.stage = stage
+                self._event(job, "stage", stage=stage)
+                for _, row_models in models.iterrows():
+                    if job.status == CANCELLING:
+                        break
+                    self._run_stage(job, stage, row_models)
+        except CancelledError:
+            job.status = CANCELLING
+        except Exception as e:
+            job.status = FAILED
+            job.error = repr(e)
+            self._event(job, "error", error=repr(e))
+        with self._changed:
+            # The event stream ends once finished is set, together with the last event
+            if job.status == CANCELLING:
+                job.status = CANCELLED
+            elif job.status == RUNNING:
+                job.status = DONE
+            job.finished = time.time()
+            self._event(job, "status", status=job.status)
+
+    def _run_stage(self, job: ServiceJob, stage: str, row_models: pd.Series) -> None:
+        provider, model = row_models["llm_provider"], row_models["llm_model"]
+        if stage == "notes":
+            self._run_calls(job, stage, provider, model)
+            return
+        # Jobs on the same model would both generate the clients still missing, so
+        # the rows of a stage are selected and written by one job at a time
+        with self._lock:
+            lock = self._stage_locks.setdefault((stage, model), threading.Lock())
+        with lock:
+            if job.status == CANCELLING:
+                return
+            if stage == "profiles":
+                df_profiles = self._profiles(job, provider, model)
+                if not df_profiles.empty:
+                    self._write(
+                        job, self.datapath / f"profiles_{model}.csv", df_profiles
+                    )
+            else:
+                self._run_calls(job, stage, provider, model)
+
+    def _run_calls(
+        self, job: ServiceJob, stage: str, provider: str, model: str
+    ) -> None:
+        """Run the work items of a stage on the scheduler and write their rows."""
+        items = self._items(job, stage, provider, model)
+        job.calls += len(items)
+        futures = {
+            self.scheduler.submit(job.job_id, provider, self._complete, item): item
+            for item in items
+        }
+        rows = []
+        for future in as_completed(futures):
+            key = futures[future]["key"]
+            if future.cancelled():
+                continue
+            try:
+                rows += future.result()
+            except Exception as e:
+                job.failed += 1
+                self._event(job, "failed", key=key, error=repr(e))
+                continue
+            job.done += 1
+            self._event(job, "done", key=key, done=job.done, calls=job.calls)
+        if rows:
+            fn_stage = "notes.csv" if stage == "notes" else f"{stage}_{model}.csv"
+            df = pd.DataFrame(rows, columns=ROW_COLUMNS[stage])
+            self._write(job, self.datapath / fn_stage, df)
+
+    def _profiles(self, job: ServiceJob, provider: str, model: str) -> pd.DataFrame:
+        """New profiles, with every batch request run as a call on the scheduler."""
+
+        def submit(fn: Callable, *args) -> Future:
+            if job.status == CANCELLING:
+                future: Future = Future()
+                future.cancel()
+                future.set_running_or_notify_cancel()
+                return future
+            job.calls += 1
+            future = self.scheduler.submit(job.job_id, provider, fn, *args)
+            future.add_done_callback(lambda f: self._profiles_done(job, model, f))
+            return future
+
+        engine = ProfileEngine(
+            provider=provider,
+            model=model,
+            wire_format=job.spec.get("wire_format", "full"),
+            router=self.router(provider, model),
+        )
+        fn_profiles = self.datapath / f"profiles_{model}.csv"
+        if fn_profiles.exists():
+            engine.add_existing(pd.read_csv(fn_profiles))
+        return engine.generate(
+            ward_type=job.spec.get("ward_type", "pg"),
+            num_profiles=int(job.spec.get("num_profiles", 1)),
+            submit=submit,
+        ).drop(columns="client_id")
+
+    def _profiles_done(self, job: ServiceJob, model: str, future: Future) -> None:
+        if future.cancelled():
+            return
+        key = f"profiles/{model}"
+        if future.exception() is not None:
+            job.failed += 1
+            self._event(job, "failed", key=key, error=repr(future.exception()))
+            return
+        job.done += 1
+        self._event(job, "done", key=key, done=job.done, calls=job.calls)
+
+    def _items(
+        self, job: ServiceJob, stage: str, provider: str, model: str
+    ) -> List[Dict[str, Any]]:
+        """Work items of a stage: the requested clients or those still missing."""
+        spec = job.spec
+        wire_format = spec.get("wire_format", "full")
+        if stage == "notes":
+            categories = spec.get("categories")
+            return [
+                note_item(provider, model, input_data, spec.get("num_notes", 50), i)
+                for input_data in input_data_list
+                if not categories or input_data["cat"] in categories
+                for i in range(spec.get("num_completions", 1))
+            ]
+
+        df_profiles = pd.read_csv(self.datapath / f"profiles_{model}.csv")
+        fn_scenarios = self.datapath / f"scenarios_{model}.csv"
+        df_scenarios = (
+            pd.read_csv(fn_scenarios)
+            if fn_scenarios.exists()
+            else pd.DataFrame(columns=["scenario_id"] + ROW_COLUMNS["scenarios"])
+        )
+        client_ids = spec.get("client_ids")
+        if stage == "scenarios":
+            if client_ids is None:
+                client_ids = set(df_profiles["client_id"]) - set(
+                    df_scenarios["client_id"]
+                )
+            selected = df_profiles[df_profiles["client_id"].isin(client_ids)]
+            return [
+                scenario_item(provider, model, row, wire_format)
+                for _, row in selected.iterrows()
+            ]
+
+        fn_records = self.datapath / f"records_{model}.csv"
+        if client_ids is None:
+            done = (
+                set(pd.read_csv(fn_records, usecols=["scenario_id"])["scenario_id"])
+                if fn_records.exists()
+                else set()
+            )
+            selected = df_scenarios[~df_scenarios["scenario_id"].isin(done)]
+        else:
+            selected = df_scenarios[df_scenarios["client_id"].isin(client_ids)]
+        items = []
+        for client_id, df_client in selected.groupby("client_id"):
+            row_profiles = df_profiles[df_profiles["client_id"] == client_id].iloc[0]
+            # The history in the prompt is built from all weeks of the client
+            df_history = df_scenarios[df_scenarios["client_id"] == client_id]
+            items += [
+                record_item(provider, model, row_profiles, df_history, row, wire_format)
+                for _, row in df_client.iterrows()
+            ]
+        return items
+
+    def _complete(self, item: Dict[str, Any]) -> List[tuple]:
+        router = self.router(item["provider"], item["model"])
+        response_model, _ = create_wire_completion(
+            router,
+            response_model=RESPONSE_MODELS[item["stage"]],
+            messages=item["messages"],
+            wire_format=item.get("wire_format", "full"),
+            start_date=(
+                pd.to_datetime(item["start_date"]).date()
+                if item["stage"] == "records"
+                else None
+            ),
+            model=item["model"],
+        )
+        return result_rows(item, response_model, router.last_endpoint)
+
+    def _write(self, job: ServiceJob, path: Path, df_new: pd.DataFrame) -> None:
+        """Append rows to a data file, with ids after the highest existing id."""
+        id_column = {
+            "profiles": "client_id",
+            "scenarios": "scenario_id",
+            "records": "note_id",
+        }.get(path.stem.split("_")[0])
+        with self._lock:
+            lock = self._file_locks.setdefault(path, threading.Lock())
+        with lock, span("persist", stage=job.stage, path=path.name):
+            df_old = pd.read_csv(path) if path.exists() else pd.DataFrame()
+            if id_column is not None:
+                first = int(df_old[id_column].max()) + 1 if not df_old.empty else 1
+                df_new.insert(0, id_column, range(first, first + len(df_new)))
+            df = pd.concat([df_old, df_new], ignore_index=True)
+            tmp_path = path.with_suffix(".tmp")
+            df.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        job.rows[path.name] = job.rows.get(path.name, 0) + len(df_new)
+        self._event(job, "written", file=path.name, rows=len(df_new))
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Refuse new jobs and wait for the accepted jobs to finish.
+
+        Returns:
+            True if all jobs finished within the timeout
+        """
+        self.accepting = False
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in list(self._threads):
+            thread.join(
+                None if deadline is None else max(deadline - time.monotonic(), 0)
+            )
+        finished = not any(t.is_alive() for t in self._threads)
+        if finished:
+            self.scheduler.shutdown()
+        return finished
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """The job API, over HTTP or a Unix socket."""
+
+    server: "ServiceServer"
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status: int, body: Any) -> None:
+        content = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _job_path(self) -> Tuple[Optional[str], str]:
+        parts = self.path.strip("/").split("/")
+        if parts[0] != "jobs":
+            return None, ""
+        return (parts[1] if len(parts) > 1 else None), "/".join(parts[2:])
+
+    def do_GET(self) -> None:
+        service = self.server.service
+        if self.path.rstrip("/") == "/health":
+            self._send(
+                200,
+                {
+                    "accepting": service.accepting,
+                    "jobs": len(service.jobs),
+                    "pending_calls": service.scheduler.pending(),
+                    "running_calls": service.scheduler.running,
+                },
+            )
+            return
+        job_id, rest = self._job_path()
+        if job_id is None:
+            if self.path.rstrip("/") == "/jobs":
+                self._send(200, [job.summary() for job in service.jobs.values()])
+            else:
+                self._send(404, {"error": f"Unknown path {self.path}"})
+        elif job_id not in service.jobs:
+            self._send(404, {"error": f"Unknown job {job_id}"})
+        elif rest == "events":
+            self._stream_events(job_id)
+        else:
+            self._send(200, service.jobs[job_id].summary())
+
+    def _stream_events(self, job_id: str) -> None:
+        # JSON lines until the job ends, the connection closes after the last event
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        start, finished = 0, False
+        while not finished:
+            events, finished = self.server.service.events(job_id, start)
+            start += len(events)
+            for event in events:
+                self.wfile.write(
+                    (json.dumps(event, default=str) + "\n").encode("utf-8")
+                )
+            self.wfile.flush()
+        self.close_connection = True
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != "/jobs":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            job = self.server.service.submit(
+                json.loads(self.rfile.read(length) or b"{}")
+            )
+        except (ValueError, KeyError) as e:
+            self._send(400, {"error": str(e)})
+        except RuntimeError as e:
+            self._send(503, {"error": str(e)})
+        else:
+            self._send(202, job.summary())
+
+    def do_DELETE(self) -> None:
+        job_id, _ = self._job_path()
+        if job_id not in self.server.service.jobs:
+            self._send(404, {"error": f"Unknown job {job_id}"})
+            return
+        cancelled = self.server.service.cancel(job_id)
+        self._send(200, {"job_id": job_id, "cancelled_calls": cancelled})
+
+
+class ServiceServer(ThreadingHTTPServer):
+    """HTTP server for the job API."""
+
+    daemon_threads = True
+
+    def __init__(self, address, service: GenerationService, verbose: bool = False):
+        super().__init__(address, ServiceHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+class UnixServiceServer(ThreadingUnixStreamServer):
+    """The job API on a Unix socket."""
+
+    daemon_threads = True
+
+    def __init__(self, path: str, service: GenerationService, verbose: bool = False):
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, ServiceHandler)
+        self.service = service
+        self.verbose = verbose
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
@@ -0,0 +1,230 @@
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from jobs.job_queue import Job, JobQueue
+from llm.failover import FailoverRouter
+from llm.wire_format import create_wire_completion
+from pipeline.work_items import RESPONSE_MODELS, ROW_COLUMNS, result_rows
+from tracing.spans import span
+
+"""
+Job Queue Worker Module
+
+A worker leases work items from the job queue, sends them to the LLM and writes the
+resulting rows to a shard: one CSV file per job in the shard directory. The lease is
+extended with a heartbeat while the call runs, and the job is acknowledged once its
+shard has been written. Shards are written to a temporary file first and renamed, so
+a crashed worker never leaves a partial shard behind.
+
+merge_shards combines the shards into the files the stage scripts would have written.
+"""
+
+# Columns added to every shard row to merge shards in a stable order
+SHARD_COLUMNS = ["job_key"]
+
+
+def shard_path(shard_dir: Path, payload: Dict) -> Path:
+    """Path of the shard for a job, unique per job key."""
+    digest = hashlib.sha1(payload["key"].encode("utf-8")).hexdigest()[:16]
+    return Path(shard_dir) / payload["stage"] / payload["model"] / f"{digest}.csv"
+
+
+class Worker:
+    """
+    Processes jobs from a job queue until it is empty.
+
+    Attributes:
+        queue: The job queue to lease jobs from
+        shard_dir: Directory to write result shards to
+        worker_id: Unique id of this worker, defaults to host, process and a random
+            suffix
+        lease_seconds: Duration of a lease, extended by heartbeats while a job runs
+        threads: Number of jobs processed concurrently by this worker
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        shard_dir: Path,
+        worker_id: Optional[str] = None,
+        lease_seconds: float = 300.0,
+        threads: int = 1,
+    ):
+        self.queue = queue
+        self.shard_dir = Path(shard_dir)
+        self.worker_id = worker_id or (
+            f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        )
+        self.lease_seconds = lease_seconds
+        self.threads = threads
+        self.routers: Dict[Tuple[str, str], FailoverRouter] = {}
+        self._routers_lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+
+    def _router(self, provider: str, model: str) -> FailoverRouter:
+        # Routers are reused across jobs, so provider clients stay warm
+        with self._routers_lock:
+            if (provider, model) not in self.routers:
+                self.routers[(provider, model)] = FailoverRouter(
+                    provider=provider, model=model
+                )
+            return self.routers[(provider, model)]
+
+    def _heartbeat(
+        self, job: Job, stop: threading.Event, lost: threading.Event
+    ) -> None:
+        while not stop.wait(self.lease_seconds / 3):
+            if not self.queue.heartbeat(job.job_id, self.worker_id, self.lease_seconds):
+                print(f"Lost lease on {job.job_id}")
+                lost.set()
+                return
+
+    def process(self, job: Job, lost: Optional[threading.Event] = None) -> bool:
+        """
+        Run a single job and write its shard.
+
+        Args:
+            job: The leased job
+            lost: Set by the heartbeat when the lease is lost, the job has then been
+                handed out again and the shard is left to the new lease holder
+
+        Returns:
+            True if the shard was written
+        """
+        payload = job.payload
+        router = self._router(payload["provider"], payload["model"])
+        response_model, _ = create_wire_completion(
+            router,
+            response_model=RESPONSE_MODELS[payload["stage"]],
+            messages=payload["messages"],
+            wire_format=payload.get("wire_format", "full"),
+            start_date=(
+                pd.to_datetime(payload["start_date"]).date()
+                if payload["stage"] == "records"
+                else None
+            ),
+            model=payload["model"],
+        )
+        rows = result_rows(payload, response_model, router.last_endpoint)
+        df = pd.DataFrame(rows, columns=ROW_COLUMNS[payload["stage"]])
+        df["job_key"] = payload["key"]
+        if lost is not None and lost.is_set():
+            return False
+
+        with span("persist", stage=payload["stage"], model=payload["model"]):
+            path = shard_path(self.shard_dir, payload)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{self.worker_id}.tmp")
+            df.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        return True
+
+    def _run_loop(self, poll_interval: float, exit_when_empty: bool) -> None:
+        while True:
+            job = self.queue.lease(self.worker_id, self.lease_seconds)
+            if job is None:
+                if exit_when_empty:
+                    return
+                time.sleep(poll_interval)
+                continue
+
+            stop, lost = threading.Event(), threading.Event()
+            heartbeat = threading.Thread(
+                target=self._heartbeat, args=(job, stop, lost), daemon=True
+            )
+            heartbeat.start()
+            try:
+                written = self.process(job, lost)
+            except Exception as e:
+                self.queue.fail(job.job_id, self.worker_id, repr(e))
+                self.failed += 1
+                print(f"Job {job.job_id} failed (attempt {job.attempts}): {e}")
+            else:
+                if not written:
+                    print(f"Job {job.job_id} skipped, its lease was lost")
+                elif self.queue.ack(job.job_id, self.worker_id):
+                    self.processed += 1
+                else:
+                    # The lease expired after the write, the new holder rewrites the
+                    # same shard and acks the job
+                    print(f"Job {job.job_id} not acknowledged, its lease was lost")
+            finally:
+                stop.set()
+                heartbeat.join()
+
+    def run(self, poll_interval: float = 5.0, exit_when_empty: bool = True) -> None:
+        """
+        Lease and process jobs.
+
+        Args:
+            poll_interval: Seconds to wait before polling an empty queue again
+            exit_when_empty: Stop when no job is available, otherwise keep polling
+        """
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            futures = [
+                executor.submit(self._run_loop, poll_interval, exit_when_empty)
+                for _ in range(self.threads)
+            ]
+            for future in futures:
+                future.result()
+        print(
+            f"Worker {self.worker_id} done: {self.processed} jobs processed, "
+            f"{self.failed} failed"
+        )
+
+
+def _merge_stage_shards(paths: Iterable[Path], stage: str) -> pd.DataFrame:
+    columns = ROW_COLUMNS[stage] + SHARD_COLUMNS
+    frames = [pd.read_csv(path) for path in paths]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def merge_shards(shard_dir: Path, stage: str, datapath: Path) -> List[Path]:
+    """
+    Merge the shards of a stage into the stage's output files.
+
+    scenarios and records are written per model, as scenarios_<model>.csv and
+    records_<model>.csv; notes of all models are written to notes.csv.
+
+    Returns:
+        The paths of the written files
+    """
+    stage_dir = Path(shard_dir) / stage
+    model_dirs = sorted(p for p in stage_dir.iterdir() if p.is_dir())
+    written = []
+
+    if stage == "notes":
+        df = pd.concat(
+            [_merge_stage_shards(sorted(d.glob("*.csv")), stage) for d in model_dirs],
+            ignore_index=True,
+        )
+        df = df.sort_values(["model", "job_key"], kind="stable")
+        path = datapath / "notes.csv"
+        df.drop(columns=SHARD_COLUMNS).to_csv(path, index=False)
+        return [path]
+
+    for model_dir in model_dirs:
+        df = _merge_stage_shards(sorted(model_dir.glob("*.csv")), stage)
+        if stage == "scenarios":
+            df = df.sort_values(["client_id", "week"], kind="stable")
+            df.insert(0, "scenario_id", range(1, len(df) + 1))
+            path = datapath / f"scenarios_{model_dir.name}.csv"
+        else:
+            df = df.sort_values(["client_id", "scenario_id", "date"], kind="stable")
+            df.insert(0, "note_id", range(1, len(df) + 1))
+            path = datapath / f"records_{model_dir.name}.csv"
+        df.drop(columns=SHARD_COLUMNS).to_csv(path, index=False)
+        written.append(path)
+    return written
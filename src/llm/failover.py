@@ -0,0 +1,244 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from config.settings import get_settings
+from llm.llm_factory import LLMFactory
+
+"""
+Failover Routing Module
+
+Routes completions over a group of equivalent endpoints, e.g. Azure gpt-4o-mini and
+OpenAI gpt-4o-mini-2024-07-18, as configured in llm_config. Every endpoint has a
+circuit breaker: after repeated throttling (429) or server errors (5xx) the circuit
+opens and traffic moves to the next healthy endpoint in the group. After a recovery
+period a probe request is sent to the endpoint again, and traffic drifts back to the
+preferred endpoint as soon as it succeeds.
+"""
+
+Endpoint = Tuple[str, str]  # (provider, model)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def is_endpoint_failure(error: BaseException) -> bool:
+    """
+    Check if an error means the endpoint is throttled or down.
+
+    Walks the exception chain, as instructor may wrap the error raised by the SDK.
+    Validation errors are not endpoint failures and are not routed elsewhere.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status_code = getattr(error, "status_code", None)
+        if status_code == 429 or (status_code is not None and status_code >= 500):
+            return True
+        if type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class NoHealthyEndpoint(Exception):
+    """Raised without a call when every endpoint of a group is open or unavailable."""
+
+    # Counts as an endpoint failure, callers that retry those retry this too
+    status_code = 503
+
+
+class CircuitBreaker:
+    """Circuit breaker for a single endpoint."""
+
+    def __init__(self, failure_threshold: int = 3, recovery_time: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if (
+                self.state == OPEN
+                and time.monotonic() - self.opened_at >= self.recovery_time
+            ):
+                # Let a single probe through, other requests keep failing over
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+_breakers: Dict[Endpoint, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint: Endpoint) -> CircuitBreaker:
+    """Get the circuit breaker for an endpoint, shared by all routers in this run."""
+    settings = get_settings().llm.failover
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker(
+                failure_threshold=settings.failure_threshold,
+                recovery_time=settings.recovery_time,
+            )
+        return _breakers[endpoint]
+
+
+def failover_group(provider: str, model: str) -> List[Endpoint]:
+    """
+    Get the endpoints that can serve requests for (provider, model).
+
+    The requested endpoint comes first, followed by the other endpoints of its
+    failover group in order of preference. Endpoints without a group only serve
+    themselves.
+    """
+    endpoint = (provider, model)
+    for group in get_settings().llm.failover.groups:
+        group = [tuple(e) for e in group]
+        if endpoint in group:
+            return [endpoint] + [e for e in group if e != endpoint]
+    return [endpoint]
+
+
+class FailoverRouter:
+    """
+    Drop-in replacement for LLMFactory that fails over between equivalent endpoints.
+
+    Attributes:
+        endpoints: The (provider, model) endpoints in order of preference
+        factories: LLMFactory instances per provider, created on first use
+    """
+
+    def __init__(self, provider: str, model: str):
+        self.endpoints = failover_group(provider, model)
+        self.factories: Dict[str, LLMFactory] = {}
+        self.unavailable: Dict[str, Exception] = {}
+        self._local = threading.local()
+
+    @property
+    def last_endpoint(self) -> Optional[Endpoint]:
+        """The (provider, model) that served the last completion in this thread."""
+        return getattr(self._local, "endpoint", None)
+
+    def _factory(self, provider: str) -> Optional[LLMFactory]:
+        """The factory for a provider, None if its client cannot be built."""
+        if provider in self.unavailable:
+            return None
+        if provider not in self.factories:
+            try:
+                self.factories[provider] = LLMFactory(provider=provider)
+            except Exception as e:
+                # Not configured (no key or endpoint), not a failover target
+                print(f"Provider {provider} is unavailable, skipping it: {e}")
+                self.unavailable[provider] = e
+                return None
+        return self.factories[provider]
+
+    def create_completion(
+        self, response_model: Type[BaseModel], messages: List[Dict[str, str]], **kwargs
+    ) -> Tuple[BaseModel, Any]:
+        """
+        Create a completion on the first healthy endpoint.
+
+        The model argument is set per endpoint, any model passed in kwargs is ignored.
+        Endpoints whose client cannot be built are skipped. If every circuit is open,
+        NoHealthyEndpoint is raised without a call.
+
+        Returns:
+            Tuple containing the parsed response model and raw completion
+        """
+        return self._route("create_completion", response_model, messages, **kwargs)
+
+    def create_samples(
+        self,
+        response_model: Type[BaseModel],
+        messages: List[Dict[str, str]],
+        n: int,
+        **kwargs,
+    ) -> List[Tuple[BaseModel, Any]]:
+        """
+        Create n samples for the same messages on the first healthy endpoint.
+
+        See LLMFactory.create_samples. All samples are served by one endpoint.
+
+        Returns:
+            List of n tuples of parsed response model and raw completion
+        """
+        return self._route("create_samples", response_model, messages, n=n, **kwargs)
+
+    def _route(
+        self,
+        method: str,
+        response_model: Type[BaseModel],
+        messages: List[Dict[str, str]],
+        **kwargs,
+    ) -> Any:
+        kwargs.pop("model", None)
+        last_error = None
+        for endpoint in self.endpoints:
+            factory = self._factory(endpoint[0])
+            if factory is None or not get_circuit_breaker(endpoint).allow_request():
+                continue
+            try:
+                return self._complete(
+                    factory, endpoint, method, response_model, messages, **kwargs
+                )
+            except Exception as e:
+                if not is_endpoint_failure(e):
+                    raise
+                last_error = e
+        if last_error is not None:
+            raise last_error
+        provider = self.endpoints[0][0]
+        if provider in self.unavailable and all(
+            p in self.unavailable for p, _ in self.endpoints
+        ):
+            raise self.unavailable[provider]
+        raise NoHealthyEndpoint(f"Every circuit of {self.endpoints} is open")
+
+    def _complete(
+        self,
+        factory: LLMFactory,
+        endpoint: Endpoint,
+        method: str,
+        response_model: Type[BaseModel],
+        messages: List[Dict[str, str]],
+        **kwargs,
+    ) -> Any:
+        provider, model = endpoint
+        breaker = get_circuit_breaker(endpoint)
+        try:
+            result = getattr(factory, method)(
+                response_model, messages, model=model, **kwargs
+            )
+        except Exception as e:
+            if is_endpoint_failure(e):
+                breaker.record_failure()
+                print(f"Endpoint {provider}/{model} failed, failing over: {e}")
+            else:
+                # The endpoint responded, the error is not a reason to fail over
+                breaker.record_success()
+            raise
+        breaker.record_success()
+        self._local.endpoint = endpoint
+        return result
@@ -0,0 +1,229 @@
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from config.settings import get_settings
+
+"""
+Hedged Requests Module
+
+A hedged request sends a duplicate of a call that is taking longer than usual and
+uses whichever copy finishes first. The threshold is the observed latency percentile
+for the same (provider, model, response_model), so only the slow tail is duplicated.
+A per-run budget caps the fraction of calls that may be hedged.
+
+The executor is shared by all calls, so a call can wait for a free thread first. The
+threshold is measured from the moment the primary call starts, not from its submission.
+
+The LLM clients are synchronous, so a running call cannot be interrupted. The losing
+call is cancelled if it has not started yet; otherwise it runs to completion, is paid
+for and its result is discarded. Such calls are counted as duplicates_paid.
+"""
+
+
+class LatencyTracker:
+    """Keeps a sliding window of observed latencies per key."""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._latencies: Dict[Hashable, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=self.window)
+        )
+        self._lock = threading.Lock()
+
+    def observe(self, key: Hashable, latency: float) -> None:
+        with self._lock:
+            self._latencies[key].append(latency)
+
+    def count(self, key: Hashable) -> int:
+        with self._lock:
+            return len(self._latencies[key])
+
+    def percentile(self, key: Hashable, q: float) -> Optional[float]:
+        with self._lock:
+            latencies = list(self._latencies[key])
+        if not latencies:
+            return None
+        return float(np.percentile(latencies, q))
+
+
+class HedgePolicy:
+    """
+    Runs calls with hedging and keeps track of the hedge rate and latency saved.
+
+    Attributes:
+        percentile: Latency percentile after which a duplicate call is fired
+        min_samples: Observations required for a key before hedging starts
+        budget: Maximum fraction of calls that may be hedged
+        tracker: The latency tracker used to determine the hedge threshold
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        min_samples: int = 20,
+        window: int = 200,
+        budget: float = 0.05,
+        max_workers: int = 32,
+    ):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget = budget
+        self.tracker = LatencyTracker(window=window)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hedge"
+        )
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.duplicates_paid = 0
+        self.latency_saved = 0.0
+
+    @classmethod
+    def from_settings(cls, settings) -> "HedgePolicy":
+        return cls(
+            percentile=settings.percentile,
+            min_samples=settings.min_samples,
+            window=settings.window,
+            budget=settings.budget,
+        )
+
+    def threshold(self, key: Hashable) -> Optional[float]:
+        """Latency after which a call for this key is hedged, None if unknown."""
+        if self.tracker.count(key) < self.min_samples:
+            return None
+        return self.tracker.percentile(key, self.percentile)
+
+    def _reserve_hedge(self) -> bool:
+        with self._lock:
+            if self.hedged + 1 > self.budget * self.calls:
+                return False
+            self.hedged += 1
+            return True
+
+    def run(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn, firing a duplicate if it exceeds the latency threshold for key.
+
+        Args:
+            key: Identifies comparable calls, e.g. (provider, model, response_model)
+            fn: Zero-argument callable performing the call
+
+        Returns:
+            The result of whichever call finished first without an error
+        """
+        with self._lock:
+            self.calls += 1
+
+        threshold = self.threshold(key)
+        primary, started = self._submit(fn)
+        # Only the primary call's latency is observed, also when it loses to the hedge;
+        # otherwise the slow tail is never recorded and the threshold drifts down.
+        primary.add_done_callback(lambda f: self._observe(key, f))
+        if threshold is not None:
+            # Time spent queued for a thread is not latency of the call itself
+            started.wait()
+            threshold = max(0.0, threshold - (time.perf_counter() - started.time))
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self._reserve_hedge():
+            return self._result(primary)
+
+        hedge, _ = self._submit(fn)
+        done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        winner = hedge if hedge in done and primary not in done else primary
+        loser = primary if winner is hedge else hedge
+
+        if winner.exception() is not None:
+            # The first call to finish failed, fall back on the other one
+            winner, loser = loser, winner
+            wait([winner])
+        if winner.exception() is not None:
+            raise primary.exception()
+
+        if not loser.cancel():
+            # Already running or finished, the duplicate is paid for either way
+            with self._lock:
+                self.duplicates_paid += 1
+        if winner is hedge:
+            with self._lock:
+                self.hedge_wins += 1
+            loser.add_done_callback(lambda f: self._record_saving(f, hedge.result()[2]))
+        return self._result(winner)
+
+    def _submit(self, fn: Callable[[], Any]) -> Tuple[Future, threading.Event]:
+        # The event is set, with its start time, once a thread picks up the call
+        started = threading.Event()
+
+        def timed():
+            started.time = time.perf_counter()
+            started.set()
+            result = fn()
+            return result, time.perf_counter() - started.time, time.perf_counter()
+
+        return self._executor.submit(timed), started
+
+    def _result(self, future: Future) -> Any:
+        return future.result()[0]
+
+    def _observe(self, key: Hashable, future: Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            return
+        _, latency, _ = future.result()
+        self.tracker.observe(key, latency)
+
+    def _record_saving(self, loser: Future, hedge_finished: float) -> None:
+        # Latency saved is the difference between the finish times of both calls,
+        # only known once the primary call has finished as well. That primary call ran
+        # to completion, so it is also counted in duplicates_paid.
+        if loser.cancelled() or loser.exception() is not None:
+            return
+        _, _, primary_finished = loser.result()
+        with self._lock:
+            self.latency_saved += max(0.0, primary_finished - hedge_finished)
+
+    def report(self) -> Dict[str, float]:
+        """Summary of hedging activity for this run."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "duplicates_paid": self.duplicates_paid,
+                "latency_saved_s": round(self.latency_saved, 2),
+            }
+
+    def format_report(self) -> str:
+        report = self.report()
+        return (
+            f"Hedging: {report['hedged']} of {report['calls']} calls hedged "
+            f"({report['hedge_rate']:.1%}), {report['hedge_wins']} won by the hedge, "
+            f"{report['latency_saved_s']}s latency saved, "
+            f"{report['duplicates_paid']} duplicate calls paid for"
+        )
+
+
+_hedge_policy: Optional[HedgePolicy] = None
+_hedge_policy_lock = threading.Lock()
+
+
+def get_hedge_policy() -> Optional[HedgePolicy]:
+    """
+    Get the hedge policy shared by all factories in this run.
+
+    Returns:
+        HedgePolicy: The shared policy, or None if hedging is disabled in the settings.
+    """
+    global _hedge_policy
+    settings = get_settings().llm.hedging
+    if not settings.enabled:
+        return None
+    with _hedge_policy_lock:
+        if _hedge_policy is None:
+            _hedge_policy = HedgePolicy.from_settings(settings)
+        return _hedge_policy
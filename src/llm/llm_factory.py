@@ -1,12 +1,17 @@
+import threading
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Tuple, Type
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Type
 
 import instructor
 from anthropic import Anthropic
+from instructor.function_calls import openai_schema
 from openai import AzureOpenAI, OpenAI
 from pydantic import BaseModel
 
 from config.settings import get_settings
+from llm.hedging import HedgePolicy, get_hedge_policy
+from tracing.spans import trace_client, traced_completion
 
 """
 LLM Provider Factory Module
@@ -17,14 +22,44 @@ supporting structured output using Pydantic models.
 """
 
 
+def _mode_kwargs(mode: Optional[instructor.Mode]) -> Dict[str, Any]:
+    # Without a mode, instructor uses its default for the provider
+    return {"mode": mode} if mode is not None else {}
+
+
 class LLMProvider(ABC):
     """Abstract base class for LLM providers."""
 
+    # Whether the API returns several choices per request with the n parameter
+    supports_n = False
+
     @abstractmethod
-    def _initialize_client(self) -> Any:
-        """Initialize the client for the LLM provider."""
+    def _initialize_client(self, mode: Optional[instructor.Mode] = None) -> Any:
+        """Initialize the client for the LLM provider, using the given structured-output mode."""
         pass
 
+    def _get_client(self, model: str, mode: Optional[str] = None) -> Any:
+        """
+        Get the client for a model, patched for its structured-output mode.
+
+        The mode is taken from the argument, the model_modes of the settings or the mode
+        of the settings, in that order. Clients for other modes are created on first use.
+        """
+        mode = mode or self.settings.model_modes.get(model) or self.settings.mode
+        if mode == self.settings.mode:
+            client = self.client
+        else:
+            # Providers are shared by the threads of a run, create each client once
+            with self._clients_lock:
+                if mode not in self._clients:
+                    self._clients[mode] = self._initialize_client(instructor.Mode(mode))
+                client = self._clients[mode]
+        trace_client(client)
+        return client
+
+    def _default_mode(self) -> Optional[instructor.Mode]:
+        return instructor.Mode(self.settings.mode) if self.settings.mode else None
+
     @abstractmethod
     def create_completion(
         self, response_model: Type[BaseModel], messages: List[Dict[str, str]], **kwargs
@@ -36,18 +71,28 @@ class LLMProvider(ABC):
 class OpenAIProvider(LLMProvider):
     """OpenAI provider implementation."""
 
-    def __init__(self, settings):
+    supports_n = True
+
+    def __init__(self, settings, **client_options):
         self.settings = settings
-        self.client = self._initialize_client()
+        self.client_options = client_options
+        self.client = self._initialize_client(self._default_mode())
+        self._clients: Dict[str, Any] = {}
+        self._clients_lock = threading.Lock()
 
-    def _initialize_client(self) -> Any:
-        return instructor.from_openai(OpenAI(api_key=self.settings.api_key))
+    def _initialize_client(self, mode: Optional[instructor.Mode] = None) -> Any:
+        return instructor.from_openai(
+            OpenAI(api_key=self.settings.api_key, **self.client_options),
+            **_mode_kwargs(mode),
+        )
 
     def create_completion(
         self, response_model: Type[BaseModel], messages: List[Dict[str, str]], **kwargs
     ) -> Tuple[BaseModel, Any]:
+        model = kwargs.get("model", self.settings.default_model)
+        client = self._get_client(model, kwargs.get("mode"))
         completion_params = {
-            "model": kwargs.get("model", self.settings.default_model),
+            "model": model,
             "temperature": kwargs.get("temperature", self.settings.temperature),
             "top_p": kwargs.get("top_p", self.settings.top_p),
             "max_retries": kwargs.get("max_retries", self.settings.max_retries),
@@ -55,30 +100,44 @@ class OpenAIProvider(LLMProvider):
             "response_model": response_model,
             "messages": messages,
         }
-        return self.client.chat.completions.create_with_completion(**completion_params)
+        if kwargs.get("n", 1) > 1:
+            completion_params["n"] = kwargs["n"]
+        return client.chat.completions.create_with_completion(**completion_params)
 
 
 class AzureOpenAIProvider(LLMProvider):
     """AzureOpenAI provider implementation."""
 
-    def __init__(self, settings):
-        self.settings = settings
-        self.client = self._initialize_client()
+    supports_n = True
 
-    def _initialize_client(self) -> Any:
+    def __init__(self, settings, **client_options):
+        self.settings = settings
+        self.client_options = client_options
+        self.client = self._initialize_client(self._default_mode())
+        self._clients: Dict[str, Any] = {}
+        self._clients_lock = threading.Lock()
+
+    def _initialize_client(self, mode: Optional[instructor.Mode] = None) -> Any:
+        client_params = {
+            "api_key": self.settings.api_key,
+            "api_version": self.settings.api_version,
+            "azure_endpoint": self.settings.azure_endpoint,
+            **self.client_options,
+        }
+        if "base_url" in self.client_options:
+            # base_url and azure_endpoint are mutually exclusive
+            client_params.pop("azure_endpoint")
         return instructor.from_openai(
-            AzureOpenAI(
-                api_key=self.settings.api_key,
-                api_version=self.settings.api_version,
-                azure_endpoint=self.settings.azure_endpoint,
-            )
+            AzureOpenAI(**client_params), **_mode_kwargs(mode)
         )
 
     def create_completion(
         self, response_model: Type[BaseModel], messages: List[Dict[str, str]], **kwargs
     ) -> Tuple[BaseModel, Any]:
+        model = kwargs.get("model", self.settings.default_model)
+        client = self._get_client(model, kwargs.get("mode"))
         completion_params = {
-            "model": kwargs.get("model", self.settings.default_model),
+            "model": model,
             "temperature": kwargs.get("temperature", self.settings.temperature),
             "top_p": kwargs.get("top_p", self.settings.top_p),
             "max_retries": kwargs.get("max_retries", self.settings.max_retries),
@@ -86,18 +145,26 @@ class AzureOpenAIProvider(LLMProvider):
             "response_model": response_model,
             "messages": messages,
         }
-        return self.client.chat.completions.create_with_completion(**completion_params)
+        if kwargs.get("n", 1) > 1:
+            completion_params["n"] = kwargs["n"]
+        return client.chat.completions.create_with_completion(**completion_params)
 
 
 class AnthropicProvider(LLMProvider):
     """Anthropic provider implementation."""
 
-    def __init__(self, settings):
+    def __init__(self, settings, **client_options):
         self.settings = settings
-        self.client = self._initialize_client()
-
-    def _initialize_client(self) -> Any:
-        return instructor.from_anthropic(Anthropic(api_key=self.settings.api_key))
+        self.client_options = client_options
+        self.client = self._initialize_client(self._default_mode())
+        self._clients: Dict[str, Any] = {}
+        self._clients_lock = threading.Lock()
+
+    def _initialize_client(self, mode: Optional[instructor.Mode] = None) -> Any:
+        return instructor.from_anthropic(
+            Anthropic(api_key=self.settings.api_key, **self.client_options),
+            **_mode_kwargs(mode),
+        )
 
     def create_completion(
         self, response_model: Type[BaseModel], messages: List[Dict[str, str]], **kwargs
@@ -107,8 +174,10 @@ class AnthropicProvider(LLMProvider):
         )
         user_messages = [m for m in messages if m["role"] != "system"]
 
+        model = kwargs.get("model", self.settings.default_model)
+        client = self._get_client(model, kwargs.get("mode"))
         completion_params = {
-            "model": kwargs.get("model", self.settings.default_model),
+            "model": model,
             "temperature": kwargs.get("temperature", self.settings.temperature),
             "top_p": kwargs.get("top_p", self.settings.top_p),
             "max_retries": kwargs.get("max_retries", self.settings.max_retries),
@@ -119,27 +188,34 @@ class AnthropicProvider(LLMProvider):
         if system_message:
             completion_params["system"] = system_message
 
-        return self.client.messages.create_with_completion(**completion_params)
+        return client.messages.create_with_completion(**completion_params)
 
 
 class OllamaProvider(LLMProvider):
     """Ollama provider implementation."""
 
-    def __init__(self, settings):
+    def __init__(self, settings, **client_options):
         self.settings = settings
-        self.client = self._initialize_client()
-
-    def _initialize_client(self) -> Any:
-        return instructor.from_openai(
-            OpenAI(base_url=self.settings.base_url, api_key=self.settings.api_key),
-            mode=instructor.Mode.JSON,
-        )
+        self.client_options = client_options
+        self.client = self._initialize_client(self._default_mode())
+        self._clients: Dict[str, Any] = {}
+        self._clients_lock = threading.Lock()
+
+    def _initialize_client(self, mode: Optional[instructor.Mode] = None) -> Any:
+        client_params = {
+            "base_url": self.settings.base_url,
+            "api_key": self.settings.api_key,
+            **self.client_options,
+        }
+        return instructor.from_openai(OpenAI(**client_params), **_mode_kwargs(mode))
 
     def create_completion(
         self, response_model: Type[BaseModel], messages: List[Dict[str, str]], **kwargs
     ) -> Any:
+        model = kwargs.get("model", self.settings.default_model)
+        client = self._get_client(model, kwargs.get("mode"))
         completion_params = {
-            "model": kwargs.get("model", self.settings.default_model),
+            "model": model,
             "temperature": kwargs.get("temperature", self.settings.temperature),
             "top_p": kwargs.get("top_p", self.settings.top_p),
             "max_retries": kwargs.get("max_retries", self.settings.max_retries),
@@ -147,7 +223,7 @@ class OllamaProvider(LLMProvider):
             "response_model": response_model,
             "messages": messages,
         }
-        return self.client.chat.completions.create_with_completion(**completion_params)
+        return client.chat.completions.create_with_completion(**completion_params)
 
 
 class LLMFactory:
@@ -162,13 +238,23 @@ class LLMFactory:
         provider: The name of the LLM provider to use
         settings: Configuration settings for the LLM provider
         llm_provider: The initialized LLM provider instance
+        hedge_policy: Optional policy for hedging slow requests. Defaults to the
+            shared policy when hedging is enabled in llm_config
+        client_options: Extra arguments for the SDK client, e.g. base_url or http_client
     """
 
-    def __init__(self, provider: str):
+    def __init__(
+        self,
+        provider: str,
+        hedge_policy: Optional[HedgePolicy] = None,
+        **client_options,
+    ):
         self.provider = provider
         settings = get_settings()
         self.settings = getattr(settings.llm, provider)
+        self.client_options = client_options
         self.llm_provider = self._create_provider()
+        self.hedge_policy = hedge_policy or get_hedge_policy()
 
     def _create_provider(self) -> LLMProvider:
         providers = {
@@ -179,7 +265,7 @@ class LLMFactory:
         }
         provider_class = providers.get(self.provider)
         if provider_class:
-            return provider_class(self.settings)
+            return provider_class(self.settings, **self.client_options)
         raise ValueError(f"Unsupported LLM provider: {self.provider}")
 
     def create_completion(
@@ -203,7 +289,123 @@ class LLMFactory:
         if not issubclass(response_model, BaseModel):
             raise TypeError("response_model must be a subclass of pydantic.BaseModel")
 
-        return self.llm_provider.create_completion(response_model, messages, **kwargs)
+        model = kwargs.get("model", self.settings.default_model)
+
+        def complete():
+            return traced_completion(
+                lambda: self.llm_provider.create_completion(
+                    response_model, messages, **kwargs
+                ),
+                provider=self.provider,
+                model=model,
+                response_model=response_model.__name__,
+            )
+
+        if self.hedge_policy is None:
+            return complete()
+
+        # Multi-sample requests take longer, so their latencies are tracked separately
+        key = (self.provider, model, response_model.__name__, kwargs.get("n", 1))
+        return self.hedge_policy.run(key, complete)
+
+    def create_samples(
+        self,
+        response_model: Type[BaseModel],
+        messages: List[Dict[str, str]],
+        n: int,
+        **kwargs,
+    ) -> List[Tuple[BaseModel, Any]]:
+        """
+        Create n independent samples for the same messages.
+
+        On providers that support the n parameter (OpenAI, Azure OpenAI) one request
+        returns up to max_samples_per_request choices, so the prompt is sent and billed
+        once per request instead of once per sample. Other providers fall back to
+        concurrent single completions. Choices that fail validation are replaced by
+        single completions.
+
+        Args:
+            response_model: Pydantic model class defining the expected response structure
+            messages: List of message dictionaries containing the conversation
+            n: Number of samples
+            **kwargs: Additional arguments to pass to the provider
+
+        Returns:
+            List of n tuples of parsed response model and raw completion, like
+            create_completion. Samples from one request share the raw completion.
+
+        Raises:
+            ValueError: If n is smaller than 1
+        """
+        if n < 1:
+            raise ValueError("n must be at least 1")
+        if not self.llm_provider.supports_n:
+            return self._single_samples(response_model, messages, n, **kwargs)
+
+        per_request = self.settings.max_samples_per_request
+        sizes = [min(per_request, n - start) for start in range(0, n, per_request)]
+        with ThreadPoolExecutor(
+            max_workers=min(len(sizes), self.settings.sample_concurrency)
+        ) as executor:
+            batches = list(
+                executor.map(
+                    lambda size: self._choice_samples(
+                        response_model, messages, size, **kwargs
+                    ),
+                    sizes,
+                )
+            )
+        samples = [sample for batch in batches for sample in batch]
+        if len(samples) < n:
+            samples += self._single_samples(
+                response_model, messages, n - len(samples), **kwargs
+            )
+        return samples
+
+    def _choice_samples(
+        self,
+        response_model: Type[BaseModel],
+        messages: List[Dict[str, str]],
+        n: int,
+        **kwargs,
+    ) -> List[Tuple[BaseModel, Any]]:
+        # instructor parses (and retries on) the first choice, the others are parsed here
+        first, raw = self.create_completion(response_model, messages, n=n, **kwargs)
+        samples = [(first, raw)]
+        if n == 1:
+            return samples
+
+        model = kwargs.get("model", self.settings.default_model)
+        mode = self.llm_provider._get_client(model, kwargs.get("mode")).mode
+        schema = openai_schema(response_model)
+        for choice in raw.choices[1:]:
+            try:
+                parsed = schema.from_response(
+                    raw.model_copy(update={"choices": [choice]}), mode=mode
+                )
+            except Exception as e:
+                print(f"Discarding invalid choice {choice.index} of {model}: {e}")
+                continue
+            samples.append((parsed, raw))
+        return samples
+
+    def _single_samples(
+        self,
+        response_model: Type[BaseModel],
+        messages: List[Dict[str, str]],
+        n: int,
+        **kwargs,
+    ) -> List[Tuple[BaseModel, Any]]:
+        with ThreadPoolExecutor(
+            max_workers=min(n, self.settings.sample_concurrency)
+        ) as executor:
+            futures = [
+                executor.submit(
+                    self.create_completion, response_model, messages, **kwargs
+                )
+                for _ in range(n)
+            ]
+            return [future.result() for future in futures]
 
 
 # Example usage of the LLMFactory
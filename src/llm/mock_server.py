@@ -0,0 +1,593 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from llm.tokens import estimate_tokens
+
+"""
+Mock LLM Server Module
+
+A local HTTP server that speaks the APIs used by the providers in llm_factory:
+- POST .../chat/completions: OpenAI, Ollama (/v1) and Azure OpenAI
+  (/openai/deployments/<deployment>/chat/completions)
+- POST .../messages: Anthropic
+- GET /stats: counts of the responses served, GET /health
+
+Response bodies are generated from the JSON schema in the request (tools,
+response_format or the schema instructor puts in the messages), so they validate against
+the response models. Records, scenarios, profiles and notes follow the prompt: 21 notes
+within the week, a scenario per week of the stay, the requested number of profiles and
+notes.
+
+A profile scripts latency and failures: 429 with Retry-After (at random or when the
+simulated rpm/tpm is exceeded), 500, malformed JSON and truncated output. See PROFILES,
+or pass a JSON file with the same keys. Point the providers at the server with
+OPENAI_BASE_URL, ANTHROPIC_BASE_URL, AZURE_OPENAI_ENDPOINT and OLLAMA_BASE_URL.
+
+Usage:
+    python -m llm.mock_server --port 8765 --profile flaky
+"""
+
+# Latency in seconds: base + per_output_token * tokens, with lognormal jitter (sigma).
+# Failure rates are probabilities per request. rpm/tpm are enforced per model.
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "fast": {"latency": {"base": 0.0, "per_output_token": 0.0, "sigma": 0.0}},
+    "realistic": {
+        "latency": {"base": 0.5, "per_output_token": 0.015, "sigma": 0.3},
+        "rpm": 500,
+        "tpm": 200_000,
+    },
+    "flaky": {
+        "latency": {"base": 0.3, "per_output_token": 0.005, "sigma": 0.5},
+        "failures": {"429": 0.05, "500": 0.03, "malformed": 0.03, "truncated": 0.02},
+    },
+    "throttled": {
+        "latency": {"base": 0.2, "per_output_token": 0.002, "sigma": 0.2},
+        "rpm": 30,
+        "tpm": 40_000,
+    },
+}
+DEFAULT_PROFILE: Dict[str, Any] = {
+    "latency": {"base": 0.0, "per_output_token": 0.0, "sigma": 0.0},
+    "failures": {},
+    "retry_after": 1.0,
+    "rpm": None,
+    "tpm": None,
+    # Deterministic outcomes for the first requests, e.g. ["429", "ok", "malformed"]
+    "script": [],
+    # Overrides per model, e.g. {"gpt-4o": {"latency": {"base": 2.0}}}
+    "models": {},
+}
+FAILURES = ("429", "500", "malformed", "truncated")
+
+NOTE_TEXTS = [
+    "{dhr_mw} heeft goed geslapen en is vanochtend zelf naar de huiskamer gelopen.",
+    "{dhr_mw} at de helft van het ontbijt, drinken gaat goed.",
+    "Bij de ADL geholpen, {dhr_mw} werkte goed mee.",
+    "{dhr_mw} was in de middag wat onrustig en liep veel over de gang.",
+    "Medicatie zonder problemen ingenomen.",
+    "{dhr_mw} had bezoek van de dochter, daarna rustig in de stoel.",
+    "Huid gecontroleerd, geen roodheid op de stuit.",
+    "{dhr_mw} klaagt over pijn in de knie, paracetamol gegeven.",
+]
+NOTE_DETAILS = [
+    "Verder geen bijzonderheden.",
+    "Stemming is goed.",
+    "Gewicht stabiel.",
+    "Familie is op de hoogte.",
+    "Blijft aandachtspunt voor de komende dagen.",
+    "Rapportage overgedragen aan de volgende dienst.",
+    "Vochtinname voldoende.",
+    "Reageert goed op benadering.",
+]
+FIRST_NAMES = ["Aleida", "Bartholomeus", "Cornelia", "Dirkje", "Evert", "Fenna"]
+LAST_NAMES = ["Brouwer", "Hoekstra", "Kuipers", "Mulder", "Visser", "Zwart"]
+
+
+def load_profile(name_or_path: str) -> Dict[str, Any]:
+    """A named profile from PROFILES or a JSON file, on top of DEFAULT_PROFILE."""
+    if name_or_path in PROFILES:
+        overrides = PROFILES[name_or_path]
+    else:
+        overrides = json.loads(Path(name_or_path).read_text(encoding="utf-8"))
+    return _merge(DEFAULT_PROFILE, overrides)
+
+
+def _merge(base: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merged[key] = _merge(base[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _message_text(messages: List[Dict[str, Any]], system: Any = None) -> str:
+    parts = [system] if system else []
+    parts += [m.get("content") for m in messages]
+    texts = []
+    for part in parts:
+        if isinstance(part, str):
+            texts.append(part)
+        elif isinstance(part, list):
+            texts += [
+                block.get("text", "") for block in part if isinstance(block, dict)
+            ]
+    return "\n".join(texts)
+
+
+def _schema_from_text(text: str) -> Optional[Dict[str, Any]]:
+    """The JSON schema that instructor's JSON modes put in the messages."""
+    position = text.find("json_schema")
+    if position < 0:
+        return None
+    start = text.find("{", position)
+    try:
+        schema, _ = json.JSONDecoder().raw_decode(text[start:])
+    except ValueError:
+        return None
+    return schema
+
+
+class BodyGenerator:
+    """Generates JSON values that validate against a schema and follow the prompt."""
+
+    def __init__(self, rng: random.Random, prompt: str):
+        self.rng = rng
+        self.prompt = prompt
+        self.dhr_mw = "Dhr." if "gebruik dhr." in prompt.lower() else "Mw."
+
+    def _prompt_number(self, pattern: str, default: int) -> int:
+        match = re.search(pattern, self.prompt)
+        return int(match.group(1)) if match else default
+
+    def _start_date(self) -> date:
+        match = re.search(
+            r"startdatum van deze week is \*\*(\d{4}-\d{2}-\d{2})", self.prompt
+        )
+        return date.fromisoformat(match.group(1)) if match else date(2024, 1, 1)
+
+    def _note(self) -> str:
+        return self._notes(1)[0]
+
+    def _notes(self, count: int) -> List[str]:
+        """Distinct notes as long as there are combinations left, as a model writes."""
+        pairs = [(text, detail) for text in NOTE_TEXTS for detail in NOTE_DETAILS]
+        picked = self.rng.sample(pairs, min(count, len(pairs)))
+        picked += [self.rng.choice(pairs) for _ in range(count - len(picked))]
+        return [
+            f"{text} {detail}".format(dhr_mw=self.dhr_mw) for text, detail in picked
+        ]
+
+    def generate(self, schema: Dict[str, Any], name: Optional[str] = None) -> Any:
+        """Top-level object, with the domain rules for the response model name."""
+        value = self.value(schema, schema)
+        title = schema.get("title") or name or ""
+        if title in ("ClientRecord", "CompactClientRecord"):
+            key = "record" if title == "ClientRecord" else "r"
+            value[key] = self._record(compact=title != "ClientRecord")
+        elif title in ("ClientScenarios", "CompactClientScenarios"):
+            num_weeks = self._prompt_number(r"periode van (\d+) weken", 4)
+            key = "scenario" if title == "ClientScenarios" else "s"
+            value[key] = [
+                {
+                    ("week" if key == "scenario" else "w"): week,
+                    ("events_description" if key == "scenario" else "e"): (
+                        f"Week {week}: {self._note()}"
+                    ),
+                }
+                for week in range(1, num_weeks + 1)
+            ]
+        elif title in ("ClientProfiles", "CompactClientProfiles"):
+            count = self._prompt_number(r"Schrijf (\d+) profielen", 8)
+            key = "clients" if title == "ClientProfiles" else "c"
+            item_schema = self._resolve(schema["properties"][key]["items"], schema)
+            value[key] = [self._profile(item_schema, schema) for _ in range(count)]
+        elif title == "Note":
+            count = self._prompt_number(r"Schrijf (\d+) fictieve", 10)
+            value["note"] = self._notes(count)
+        return value
+
+    def _record(self, compact: bool) -> List[Dict[str, Any]]:
+        start = datetime.combine(self._start_date(), datetime.min.time())
+        texts = iter(self._notes(21))
+        notes = []
+        for day in range(7):
+            for hour in (7, 14, 22):
+                minute = self.rng.choice([0, 15, 30, 45])
+                if compact:
+                    notes.append(
+                        {"d": day, "t": f"{hour:02d}:{minute:02d}", "n": next(texts)}
+                    )
+                else:
+                    moment = start + timedelta(days=day, hours=hour, minutes=minute)
+                    notes.append({"date": moment.isoformat(), "note": next(texts)})
+        return notes
+
+    def _profile(
+        self, item_schema: Dict[str, Any], root: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        profile = self.value(item_schema, root)
+        names = {
+            "voornaam": self.rng.choice(FIRST_NAMES) + str(self.rng.randint(1, 999)),
+            "achternaam": self.rng.choice(LAST_NAMES) + str(self.rng.randint(1, 999)),
+            "geslacht": self.rng.choice("mv"),
+        }
+        for full, short in (
+            ("voornaam", "vn"),
+            ("achternaam", "an"),
+            ("geslacht", "g"),
+        ):
+            key = full if full in profile else short
+            if key in profile:
+                profile[key] = names[full]
+        return profile
+
+    def _resolve(self, schema: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+        while "$ref" in schema:
+            name = schema["$ref"].split("/")[-1]
+            schema = root.get("$defs", root.get("definitions", {}))[name]
+        if "anyOf" in schema:
+            options = [s for s in schema["anyOf"] if s.get("type") != "null"]
+            schema = self._resolve(options[0], root) if options else {"type": "null"}
+        return schema
+
+    def value(self, schema: Dict[str, Any], root: Dict[str, Any]) -> Any:
+        """A value for any JSON schema node."""
+        schema = self._resolve(schema, root)
+        kind = schema.get("type", "object" if "properties" in schema else "string")
+        if "enum" in schema:
+            return self.rng.choice(schema["enum"])
+        if kind == "object":
+            return {
+                name: self.value(prop, root)
+                for name, prop in schema.get("properties", {}).items()
+            }
+        if kind == "array":
+            count = max(schema.get("minItems", 1), min(3, schema.get("maxItems", 3)))
+            return [self.value(schema.get("items", {}), root) for _ in range(count)]
+        if kind == "integer":
+            return self.rng.randint(schema.get("minimum", 0), schema.get("maximum", 10))
+        if kind == "number":
+            return round(
+                self.rng.uniform(schema.get("minimum", 0), schema.get("maximum", 10)), 2
+            )
+        if kind == "boolean":
+            return self.rng.random() < 0.5
+        if kind == "null":
+            return None
+        if schema.get("format") == "date-time":
+            return datetime.combine(self._start_date(), datetime.min.time()).isoformat()
+        if "pattern" in schema and ":" in schema["pattern"]:
+            return f"{self.rng.randint(7, 22):02d}:{self.rng.choice([0, 30]):02d}"
+        return self._note()
+
+
+class MockState:
+    """Outcome scripting, rate limits and statistics shared by all request handlers."""
+
+    def __init__(self, profile: Dict[str, Any], seed: Optional[int] = None):
+        self.profile = profile
+        self.rng = random.Random(seed)
+        self.script = deque(profile.get("script", []))
+        self.stats: Counter = Counter()
+        self.windows: Dict[str, deque] = defaultdict(deque)
+        self.lock = threading.Lock()
+
+    def model_profile(self, model: str) -> Dict[str, Any]:
+        return _merge(self.profile, self.profile.get("models", {}).get(model, {}))
+
+    def outcome(self, profile: Dict[str, Any]) -> str:
+        with self.lock:
+            if self.script:
+                return self.script.popleft()
+            draw = self.rng.random()
+        for failure in FAILURES:
+            rate = profile.get("failures", {}).get(failure, 0.0)
+            if draw < rate:
+                return failure
+            draw -= rate
+        return "ok"
+
+    def throttle(
+        self, model: str, tokens: int, profile: Dict[str, Any]
+    ) -> Optional[float]:
+        """Seconds until the request fits within rpm/tpm, None if it is admitted."""
+        rpm, tpm = profile.get("rpm"), profile.get("tpm")
+        if rpm is None and tpm is None:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows[model]
+            while window and window[0][0] + 60 <= now:
+                window.popleft()
+            used = sum(t for _, t in window)
+            if (rpm is not None and len(window) >= rpm) or (
+                tpm is not None and window and used + tokens > tpm
+            ):
+                return max(window[0][0] + 60 - now, 0.1)
+            window.append((now, tokens))
+        return None
+
+    def latency(self, profile: Dict[str, Any], output_tokens: int) -> float:
+        latency = profile["latency"]
+        seconds = (
+            latency.get("base", 0) + latency.get("per_output_token", 0) * output_tokens
+        )
+        sigma = latency.get("sigma", 0)
+        with self.lock:
+            jitter = self.rng.lognormvariate(0, sigma) if sigma else 1.0
+        return seconds * jitter
+
+    def count(self, outcome: str) -> None:
+        with self.lock:
+            self.stats[outcome] += 1
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Handles the chat-completions and messages endpoints."""
+
+    server: "MockLLMServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status: int, body: Any, headers: Optional[Dict] = None) -> None:
+        content = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/stats":
+            self._send(200, dict(self.server.state.stats))
+        else:
+            self._send(200, {"status": "ok"})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            api = "openai"
+            model = (
+                request.get("model") or path.split("/deployments/")[-1].split("/")[0]
+            )
+        elif path.endswith("/messages"):
+            api = "anthropic"
+            model = request.get("model", "")
+        else:
+            self._send(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+            return
+        self._respond(api, model, request)
+
+    def _respond(self, api: str, model: str, request: Dict[str, Any]) -> None:
+        state = self.server.state
+        profile = state.model_profile(model)
+        prompt = _message_text(request.get("messages", []), request.get("system"))
+        schema, tool_name = self._schema(api, request, prompt)
+        generator = BodyGenerator(state.rng, prompt)
+        samples = max(int(request.get("n", 1)), 1) if api == "openai" else 1
+        outputs = [
+            json.dumps(generator.generate(schema, tool_name), ensure_ascii=False)
+            for _ in range(samples)
+        ]
+        input_tokens = estimate_tokens(prompt)
+        output_tokens = sum(estimate_tokens(o) for o in outputs)
+
+        outcome = state.outcome(profile)
+        wait = state.throttle(model, input_tokens + output_tokens, profile)
+        if wait is not None or outcome == "429":
+            retry_after = wait if wait is not None else profile["retry_after"]
+            state.count("429")
+            self._send(
+                429,
+                {
+                    "error": {
+                        "type": "rate_limit_error",
+                        "message": "Rate limit exceeded",
+                    }
+                },
+                {"Retry-After": str(max(1, round(retry_after)))},
+            )
+            return
+        if outcome == "500":
+            state.count("500")
+            self._send(500, {"error": {"type": "api_error", "message": "Mock failure"}})
+            return
+
+        time.sleep(state.latency(profile, output_tokens))
+        finish = "length" if outcome == "truncated" else None
+        if outcome in ("malformed", "truncated"):
+            # Cut the JSON halfway, as a model that runs out of tokens would
+            outputs = [o[: len(o) // 2] for o in outputs]
+        state.count(outcome)
+        builder = self._openai_body if api == "openai" else self._anthropic_body
+        self._send(
+            200,
+            builder(
+                model, request, outputs, tool_name, finish, input_tokens, output_tokens
+            ),
+        )
+
+    @staticmethod
+    def _schema(
+        api: str, request: Dict[str, Any], prompt: str
+    ) -> Tuple[Dict[str, Any], Optional[str]]:
+        tools = request.get("tools") or []
+        if tools:
+            tool = tools[0]
+            if api == "openai":
+                return tool["function"].get("parameters", {}), tool["function"]["name"]
+            return tool.get("input_schema", {}), tool["name"]
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            json_schema = response_format["json_schema"]
+            return json_schema.get("schema", {}), None
+        return _schema_from_text(prompt) or {"type": "object", "properties": {}}, None
+
+    @staticmethod
+    def _openai_body(
+        model, request, outputs, tool_name, finish, input_tokens, output_tokens
+    ):
+        choices = []
+        for index, output in enumerate(outputs):
+            if tool_name:
+                message = {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [
+                        {
+                            "id": f"call_{uuid.uuid4().hex[:12]}",
+                            "type": "function",
+                            "function": {"name": tool_name, "arguments": output},
+                        }
+                    ],
+                }
+            else:
+                message = {"role": "assistant", "content": output}
+            choices.append(
+                {
+                    "index": index,
+                    "message": message,
+                    "finish_reason": finish or ("tool_calls" if tool_name else "stop"),
+                }
+            )
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": choices,
+            "usage": {
+                "prompt_tokens": input_tokens,
+                "completion_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        }
+
+    @staticmethod
+    def _anthropic_body(
+        model, request, outputs, tool_name, finish, input_tokens, output_tokens
+    ):
+        output = outputs[0]
+        if tool_name:
+            try:
+                tool_input = json.loads(output)
+            except ValueError:
+                # A tool_use block always holds an object, send the broken JSON as text
+                tool_input = None
+            content = (
+                [
+                    {
+                        "type": "tool_use",
+                        "id": f"toolu_{uuid.uuid4().hex[:12]}",
+                        "name": tool_name,
+                        "input": tool_input,
+                    }
+                ]
+                if tool_input is not None
+                else [{"type": "text", "text": output}]
+            )
+        else:
+            content = [{"type": "text", "text": output}]
+        return {
+            "id": f"msg_{uuid.uuid4().hex[:12]}",
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": content,
+            "stop_reason": (
+                "max_tokens" if finish else ("tool_use" if tool_name else "end_turn")
+            ),
+            "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+        }
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """
+    Threaded mock server, usable in-process as a context manager.
+
+    Attributes:
+        state: Profile, scripted outcomes, rate limits and statistics
+        verbose: Log every request
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        profile: Optional[Dict[str, Any]] = None,
+        seed: Optional[int] = None,
+        verbose: bool = False,
+    ):
+        super().__init__((host, port), MockHandler)
+        self.state = MockState(profile or load_profile("fast"), seed)
+        self.verbose = verbose
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self) -> Dict[str, str]:
+        """Environment variables that point all providers at this server."""
+        return {
+            "OPENAI_BASE_URL": f"{self.url}/v1",
+            "ANTHROPIC_BASE_URL": self.url,
+            "AZURE_OPENAI_ENDPOINT": self.url,
+            "OLLAMA_BASE_URL": f"{self.url}/v1",
+        }
+
+    def __enter__(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI/Anthropic API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--profile",
+        default="realistic",
+        help=f"One of {', '.join(PROFILES)} or a JSON file with the same keys",
+    )
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = MockLLMServer(
+        args.host, args.port, load_profile(args.profile), args.seed, args.verbose
+    )
+    for name, value in server.environment().items():
+        print(f"export {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Served: {dict(server.state.stats)}")
@@ -0,0 +1,268 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Type
+
+import httpx
+import pandas as pd
+from pydantic import BaseModel
+
+from llm.llm_factory import LLMFactory
+from llm.usage import token_usage
+from pipeline.work_items import format_client_profile, render_messages
+from prompts.generate_profiles_rm import ClientProfiles
+from prompts.generate_records_rm import ClientRecord
+from prompts.generate_scenarios_rm import ClientScenarios
+
+"""
+Structured-Output Mode Benchmark
+
+Compares instructor modes (tools, JSON schema, JSON, markdown JSON) per provider and
+model on the response models of the pipeline: validity, attempts (retries), output
+tokens and latency. The benchmark runs against:
+- a live provider, optionally recording every HTTP response to a JSONL file
+- a local OpenAI-compatible stand-in, by passing its base_url
+- recorded responses, replayed by an httpx transport without network access
+
+recommend() picks the fastest mode that produced valid output for every response model,
+to be set in model_modes in llm_config.
+"""
+
+MODES_PER_PROVIDER: Dict[str, List[str]] = {
+    "openai": ["tool_call", "json_schema_mode", "json_mode", "markdown_json_mode"],
+    "azureopenai": ["tool_call", "json_schema_mode", "json_mode", "markdown_json_mode"],
+    "ollama": ["json_mode", "markdown_json_mode", "tool_call", "json_schema_mode"],
+    "anthropic": ["anthropic_tools", "anthropic_json"],
+}
+
+SAMPLE_PROFILE = pd.Series(
+    {
+        "geslacht": "v",
+        "voornaam": "Hendrika",
+        "achternaam": "Brouwer",
+        "diagnose": "Ziekte van Alzheimer",
+        "somatiek": "Artrose in beide knieën, hypertensie",
+        "adl": "Volledige hulp bij wassen en aankleden, eet zelfstandig met aansporing",
+        "mobiliteit": "Loopt kleine stukjes met rollator, valgevaar",
+        "gedrag": "Vergeetachtig, 's middags onrustig en zoekend naar haar man",
+    }
+)
+
+SAMPLE_SCENARIO = (
+    "Mw. is deze week wat onrustiger in de middag en eet minder. "
+    "Familie meldt dat ze tijdens het bezoek snel vermoeid is."
+)
+
+
+def benchmark_messages() -> Dict[Type[BaseModel], List[Dict[str, str]]]:
+    """Representative prompts for the response models of the pipeline."""
+    profile = format_client_profile(SAMPLE_PROFILE)
+    return {
+        ClientProfiles: render_messages(
+            "generate_profiles",
+            num_profiles=4,
+            profile_type="psychogeriatrische afdeling",
+            description="mensen met een gevorderde dementie met een hoge zorgzwaarte",
+        ),
+        ClientScenarios: render_messages(
+            "generate_scenarios",
+            client_profile=profile,
+            num_weeks=6,
+            zijn_haar="haar",
+            complications="delier, valpartij",
+            dhr_mw="mw.",
+        ),
+        ClientRecord: render_messages(
+            "generate_records",
+            client_profile=profile,
+            weekno=2,
+            events_description="Mw. is gewend op de afdeling.\nMw. at goed.",
+            scenario=SAMPLE_SCENARIO,
+            start_date="2024-03-04",
+            dhr_mw="mw.",
+        ),
+    }
+
+
+class RecordingTransport(httpx.BaseTransport):
+    """httpx transport that writes every response body to a JSONL file."""
+
+    def __init__(self, path: Path, context: Dict[str, Any]):
+        self.path = Path(path)
+        self.context = context
+        self._inner = httpx.HTTPTransport()
+        self._lock = threading.Lock()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        response = self._inner.handle_request(request)
+        content = response.read()
+        latency = time.perf_counter() - start
+        entry = {
+            **self.context,
+            "status": response.status_code,
+            "latency": latency,
+            "body": None,
+        }
+        try:
+            entry["body"] = json.loads(content) if content else None
+        except ValueError:
+            # Error pages and event streams are not JSON, keep them as text
+            entry["text"] = content.decode("utf-8", errors="replace")
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        return httpx.Response(
+            response.status_code, headers=response.headers, content=content
+        )
+
+
+class ReplayTransport(httpx.BaseTransport):
+    """httpx transport that serves recorded response bodies in order, with their latency."""
+
+    def __init__(self, entries: List[Dict[str, Any]], replay_latency: bool = True):
+        self.entries = list(entries)
+        self.replay_latency = replay_latency
+        self._position = 0
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self._position >= len(self.entries):
+            return httpx.Response(500, json={"error": "no recorded response left"})
+        entry = self.entries[self._position]
+        self._position += 1
+        if self.replay_latency:
+            time.sleep(entry["latency"])
+        if "text" in entry:
+            return httpx.Response(entry["status"], text=entry["text"])
+        return httpx.Response(entry["status"], json=entry["body"])
+
+
+def load_recording(path: Path) -> Dict[tuple, List[Dict[str, Any]]]:
+    """Recorded responses per (provider, model, mode, response_model)."""
+    recording = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            key = (
+                entry["provider"],
+                entry["model"],
+                entry["mode"],
+                entry["response_model"],
+            )
+            recording[key].append(entry)
+    return recording
+
+
+def run_benchmark(
+    provider: str,
+    model: str,
+    modes: Optional[List[str]] = None,
+    repeats: int = 3,
+    base_url: Optional[str] = None,
+    record_path: Optional[Path] = None,
+    replay_path: Optional[Path] = None,
+) -> pd.DataFrame:
+    """
+    Run every response model repeats times per mode.
+
+    Args:
+        provider: Provider name as used by LLMFactory
+        model: Model name
+        modes: instructor mode values, defaults to MODES_PER_PROVIDER[provider]
+        repeats: Number of calls per mode and response model
+        base_url: Base URL of an OpenAI-compatible stand-in
+        record_path: JSONL file to record the responses to
+        replay_path: JSONL file with recorded responses to replay instead of calling the API
+
+    Returns:
+        DataFrame with one row per call: mode, response_model, valid, attempts,
+        input_tokens, output_tokens and latency
+    """
+    modes = modes or MODES_PER_PROVIDER[provider]
+    recording = load_recording(replay_path) if replay_path else None
+    results = []
+
+    for response_model, messages in benchmark_messages().items():
+        for mode in modes:
+            context = {
+                "provider": provider,
+                "model": model,
+                "mode": mode,
+                "response_model": response_model.__name__,
+            }
+            client_options = {}
+            if base_url:
+                client_options["base_url"] = base_url
+            if recording is not None:
+                transport = ReplayTransport(recording[tuple(context.values())])
+                client_options["base_url"] = "http://replay.local/v1"
+                client_options["http_client"] = httpx.Client(transport=transport)
+            elif record_path:
+                transport = RecordingTransport(record_path, context)
+                client_options["http_client"] = httpx.Client(transport=transport)
+
+            factory = LLMFactory(provider=provider, **client_options)
+            attempts = []  # One entry per request, retries included
+            client = factory.llm_provider._get_client(model, mode)
+            client.on("completion:kwargs", lambda *args, **kwargs: attempts.append(1))
+
+            for _ in range(repeats):
+                attempts.clear()
+                start = time.perf_counter()
+                try:
+                    _, raw = factory.create_completion(
+                        response_model=response_model,
+                        messages=messages,
+                        model=model,
+                        mode=mode,
+                    )
+                    valid = True
+                except Exception as e:
+                    raw, valid = None, False
+                    print(f"{mode} / {response_model.__name__} failed: {e}")
+                input_tokens, output_tokens = token_usage(raw)
+                results.append(
+                    {
+                        **context,
+                        "valid": valid,
+                        "attempts": len(attempts),
+                        "input_tokens": input_tokens,
+                        "output_tokens": output_tokens,
+                        "latency": time.perf_counter() - start,
+                    }
+                )
+    return pd.DataFrame(results)
+
+
+def summarize(df_results: pd.DataFrame) -> pd.DataFrame:
+    """Validity, mean attempts and median tokens and latency per mode and response model."""
+    return (
+        df_results.groupby(["mode", "response_model"])
+        .agg(
+            valid_rate=("valid", "mean"),
+            attempts=("attempts", "mean"),
+            output_tokens=("output_tokens", "median"),
+            latency=("latency", "median"),
+        )
+        .reset_index()
+    )
+
+
+def recommend(df_summary: pd.DataFrame) -> Optional[str]:
+    """
+    Recommend the mode with the lowest total median latency among the modes that
+    produced valid output for every call of every response model.
+
+    Returns:
+        The recommended mode, or None if no mode was always valid
+    """
+    per_mode = df_summary.groupby("mode").agg(
+        valid_rate=("valid_rate", "min"),
+        latency=("latency", "sum"),
+        output_tokens=("output_tokens", "sum"),
+    )
+    valid = per_mode[per_mode["valid_rate"] == 1.0]
+    if valid.empty:
+        return None
+    return valid.sort_values(["latency", "output_tokens"]).index[0]
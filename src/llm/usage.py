@@ -0,0 +1,40 @@
+from typing import Any, Tuple
+
+from config.settings import get_settings
+
+"""
+Token usage of raw completions.
+
+OpenAI-compatible completions report prompt_tokens/completion_tokens, Anthropic messages
+report input_tokens/output_tokens. When instructor retries, it accumulates the usage of
+all attempts on the last completion. Costs are based on the model_prices in the provider
+settings.
+"""
+
+
+def token_usage(raw_completion: Any) -> Tuple[int, int]:
+    """
+    Get the input and output tokens of a raw completion.
+
+    Returns:
+        Tuple of (input tokens, output tokens), zeros if the usage is not reported
+    """
+    usage = getattr(raw_completion, "usage", None)
+    if usage is None:
+        return 0, 0
+    input_tokens = getattr(usage, "prompt_tokens", None)
+    if input_tokens is None:
+        input_tokens = getattr(usage, "input_tokens", 0)
+    output_tokens = getattr(usage, "completion_tokens", None)
+    if output_tokens is None:
+        output_tokens = getattr(usage, "output_tokens", 0)
+    return int(input_tokens or 0), int(output_tokens or 0)
+
+
+def completion_cost(
+    provider: str, model: str, input_tokens: int, output_tokens: int
+) -> float:
+    """Cost in USD of a completion, zero for models without configured prices."""
+    settings = getattr(get_settings().llm, provider)
+    input_price, output_price = settings.model_prices.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1e6
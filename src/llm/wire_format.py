@@ -0,0 +1,82 @@
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from llm.tokens import estimate_tokens
+from prompts.compact_rm import COMPACT_MODELS
+
+"""
+Wire Format Module
+
+Completions can be requested in the regular response models ("full") or in their
+compact wire format ("compact"), with short JSON keys and, for records, dates as a day
+offset plus HH:MM relative to the start of the week. Compact responses are expanded
+into the regular response models, so callers handle both formats the same way.
+serialized_tokens estimates the output tokens of a completion in either format.
+"""
+
+WIRE_FORMATS = ("full", "compact")
+
+
+def create_wire_completion(
+    factory: Any,
+    response_model: Type[BaseModel],
+    messages: List[Dict[str, str]],
+    wire_format: str = "full",
+    start_date: Optional[date] = None,
+    **kwargs,
+) -> Tuple[BaseModel, Any]:
+    """
+    Create a completion in the given wire format.
+
+    Args:
+        factory: LLMFactory or FailoverRouter
+        response_model: The regular response model
+        messages: List of message dictionaries
+        wire_format: "full" or "compact"
+        start_date: Start of the week, required to expand a compact ClientRecord
+        **kwargs: Additional arguments for create_completion
+
+    Returns:
+        Tuple containing the parsed regular response model and raw completion
+
+    Raises:
+        ValueError: If the wire format is unknown
+    """
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(f"Unsupported wire format: {wire_format}")
+    if wire_format == "full":
+        return factory.create_completion(
+            response_model=response_model, messages=messages, **kwargs
+        )
+
+    compact, raw = factory.create_completion(
+        response_model=COMPACT_MODELS[response_model], messages=messages, **kwargs
+    )
+    expand_kwargs = {"start_date": start_date} if start_date is not None else {}
+    return compact.expand(**expand_kwargs), raw
+
+
+def serialized_tokens(
+    response_model: BaseModel, wire_format: str, start_date: Optional[date] = None
+) -> int:
+    """
+    Estimated output tokens of a parsed completion when serialized in a wire format.
+
+    Args:
+        response_model: Parsed regular response model, e.g. a ClientRecord
+        wire_format: "full" or "compact"
+        start_date: Start of the week, required for a ClientRecord in compact format
+
+    Returns:
+        Estimated number of tokens of the JSON the model would have written
+    """
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(f"Unsupported wire format: {wire_format}")
+    if wire_format == "full":
+        return estimate_tokens(response_model.model_dump_json())
+    compact_model = COMPACT_MODELS[type(response_model)]
+    from_full_kwargs = {"start_date": start_date} if start_date is not None else {}
+    compact = compact_model.from_full(response_model, **from_full_kwargs)
+    return estimate_tokens(compact.model_dump_json(by_alias=True))
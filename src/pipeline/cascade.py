@@ -0,0 +1,221 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+import pandas as pd
+from pydantic import BaseModel
+
+from config.settings import get_settings
+from llm.failover import Endpoint, FailoverRouter
+from llm.usage import completion_cost, token_usage
+
+"""
+Model Cascade Module
+
+Routes the records of quiet scenario weeks to a cheaper model. Most weeks are
+uneventful ("meestal gebeurt er in een week niets nieuws"), and their notes do not need
+the strong model. Each week gets a difficulty score from cheap heuristics on its
+events_description and the client's complications:
+- +1 per event term (fall, infection, hospital, doctor, deterioration, ...)
+- +2 if the week mentions one of the client's complications
+- +1 for the admission week and for long descriptions
+- -1 per quiet term ("rustig", "stabiel", "geen bijzonderheden", ...)
+
+Weeks scoring up to quiet_threshold go to the quiet endpoint of the model in the
+cascade settings, the others to the strong model. ModelCascade records the route, the
+token usage and the latency per call and reports the cost and time saved.
+"""
+
+QUIET, EVENTFUL = "quiet", "eventful"
+
+EVENT_TERMS = (
+    r"\bval(?:t|len|partij)?\b|gevallen|ziekenhuis|opname|koorts|infectie|ontsteking"
+    r"|huisarts|\barts\b|specialist|spoed|pijn|wond|verslechter|achteruit|agressie"
+    r"|verward|delier|benauwd|overl|palliati|sterven|medicatiewijziging|crisis"
+    r"|familiegesprek|ongerust"
+)
+QUIET_TERMS = (
+    r"rustig|stabiel|geen bijzonderheden|niets nieuws|zoals gebruikelijk|onveranderd"
+    r"|gewone week|vertrouwde|hetzelfde"
+)
+
+# How each complication in the profiles shows up in a scenario week
+COMPLICATION_TERMS: Dict[str, str] = {
+    "gewichtsverlies": r"gewicht|afgevallen|eet (?:weinig|slecht|minder)|eetlust",
+    "algehele achteruitgang": r"achteruit|zwakker|vermoeid",
+    "decubitus": r"decubitus|doorlig|drukplek|roodheid|wond",
+    "urineweginfectie": r"urineweg|blaasontsteking|\buwi\b|plas",
+    "pneumonie": r"pneumonie|longontsteking|hoest|benauwd|koorts",
+    "delier": r"delier|verward|onrustig|hallucin",
+    "verergering van onderliggende lichamelijke klachten": r"verergering|verslechter|toename",
+    "verbetering van de klachten": r"verbeter|opknap|herstel",
+    "overlijden": r"overl|sterven|palliati|terminale",
+    "valpartij": r"\bval(?:t|len|partij)?\b|gevallen",
+}
+LONG_DESCRIPTION = 300  # Characters, longer descriptions usually mean more happens
+
+
+def difficulty_scores(
+    df_scenarios: pd.DataFrame, df_profiles: pd.DataFrame
+) -> pd.Series:
+    """Difficulty score per scenario week, indexed like df_scenarios."""
+    df = df_scenarios[["client_id", "week", "events_description"]].merge(
+        df_profiles[["client_id", "complications"]], on="client_id", how="left"
+    )
+    df.index = df_scenarios.index
+    text = df["events_description"].fillna("").astype(str).str.lower()
+    complications = df["complications"].fillna("").astype(str).str.lower()
+
+    mentions_complication = pd.Series(False, index=df.index)
+    for complication, terms in COMPLICATION_TERMS.items():
+        mentions_complication |= complications.str.contains(
+            complication, regex=False
+        ) & text.str.contains(terms, regex=True)
+
+    return (
+        text.str.count(EVENT_TERMS)
+        + 2 * mentions_complication.astype(int)
+        + (df["week"] == 1).astype(int)
+        + (text.str.len() > LONG_DESCRIPTION).astype(int)
+        - text.str.count(QUIET_TERMS)
+    )
+
+
+def classify_weeks(
+    df_scenarios: pd.DataFrame,
+    df_profiles: pd.DataFrame,
+    quiet_threshold: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Classify scenario weeks as quiet or eventful.
+
+    Returns:
+        DataFrame with scenario_id, difficulty and route per scenario week
+    """
+    if quiet_threshold is None:
+        quiet_threshold = get_settings().llm.cascade.quiet_threshold
+    scores = difficulty_scores(df_scenarios, df_profiles)
+    return pd.DataFrame(
+        {
+            "scenario_id": df_scenarios["scenario_id"],
+            "difficulty": scores,
+            "route": scores.le(quiet_threshold).map({True: QUIET, False: EVENTFUL}),
+        }
+    )
+
+
+class ModelCascade:
+    """
+    Sends quiet weeks to a cheaper model and eventful weeks to the strong model.
+
+    Drop-in replacement for FailoverRouter with an extra route argument.
+
+    Attributes:
+        strong: The (provider, model) endpoint for eventful weeks
+        quiet: The (provider, model) endpoint for quiet weeks, None if the model has no
+            cheaper endpoint configured, in which case every week goes to the strong model
+        routers: FailoverRouter per route
+        calls: Route, served endpoint, tokens and latency of every call
+    """
+
+    def __init__(self, provider: str, model: str):
+        self.strong: Endpoint = (provider, model)
+        quiet_endpoints = get_settings().llm.cascade.quiet_endpoints
+        self.quiet: Optional[Endpoint] = quiet_endpoints.get(model)
+        self.routers = {EVENTFUL: FailoverRouter(provider=provider, model=model)}
+        if self.quiet is not None:
+            self.routers[QUIET] = FailoverRouter(*self.quiet)
+        self.calls: List[Tuple[str, Endpoint, int, int, float]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def classify(
+        self, df_scenarios: pd.DataFrame, df_profiles: pd.DataFrame
+    ) -> pd.Series:
+        """Route per scenario_id, all eventful if the model has no quiet endpoint."""
+        df_routes = classify_weeks(df_scenarios, df_profiles)
+        if self.quiet is None:
+            df_routes["route"] = EVENTFUL
+        return df_routes.set_index("scenario_id")["route"]
+
+    @property
+    def last_endpoint(self) -> Optional[Endpoint]:
+        """The (provider, model) that served the last completion in this thread."""
+        return getattr(self._local, "endpoint", None)
+
+    def create_completion(
+        self,
+        response_model: Type[BaseModel],
+        messages: List[Dict[str, str]],
+        route: str = EVENTFUL,
+        **kwargs,
+    ) -> Tuple[BaseModel, Any]:
+        """
+        Create a completion on the endpoint of the route.
+
+        Args:
+            response_model: Pydantic model class defining the expected response structure
+            messages: List of message dictionaries
+            route: QUIET or EVENTFUL
+            **kwargs: Additional arguments, the model is set by the route
+
+        Returns:
+            Tuple containing the parsed response model and raw completion
+        """
+        router = self.routers.get(route, self.routers[EVENTFUL])
+        kwargs.pop("model", None)
+        start = time.perf_counter()
+        result = router.create_completion(response_model, messages, **kwargs)
+        latency = time.perf_counter() - start
+
+        endpoint = router.last_endpoint
+        input_tokens, output_tokens = token_usage(result[1])
+        with self._lock:
+            self.calls.append((route, endpoint, input_tokens, output_tokens, latency))
+        self._local.endpoint = endpoint
+        return result
+
+    def report(self) -> pd.DataFrame:
+        """Calls, tokens, cost and latency per route."""
+        df = pd.DataFrame(
+            self.calls,
+            columns=["route", "endpoint", "input_tokens", "output_tokens", "latency"],
+        )
+        df["cost"] = [
+            completion_cost(*endpoint, i, o)
+            for endpoint, i, o in df[
+                ["endpoint", "input_tokens", "output_tokens"]
+            ].itertuples(index=False)
+        ]
+        # What the calls would have cost on the strong model, with the same token counts
+        df["strong_cost"] = [
+            completion_cost(*self.strong, i, o)
+            for i, o in df[["input_tokens", "output_tokens"]].itertuples(index=False)
+        ]
+        return df.groupby("route").agg(
+            calls=("route", "size"),
+            input_tokens=("input_tokens", "sum"),
+            output_tokens=("output_tokens", "sum"),
+            cost=("cost", "sum"),
+            strong_cost=("strong_cost", "sum"),
+            latency=("latency", "sum"),
+        )
+
+    def format_report(self) -> str:
+        """Summary of the routing and the cost and time saved, for printing."""
+        if not self.calls:
+            return f"Cascade {self.strong[1]}: no calls"
+        df = self.report()
+        lines = [f"Cascade {self.strong[1]} -> quiet weeks on {self.quiet}"]
+        lines.append(df.round(4).to_string())
+        saved_cost = df["strong_cost"].sum() - df["cost"].sum()
+        lines.append(f"Cost saved: ${saved_cost:,.4f}")
+        if QUIET in df.index and EVENTFUL in df.index:
+            # Latency of the strong model per output token, measured on eventful weeks
+            per_token = df.loc[EVENTFUL, "latency"] / max(
+                df.loc[EVENTFUL, "output_tokens"], 1
+            )
+            strong_latency = per_token * df.loc[QUIET, "output_tokens"]
+            saved = strong_latency - df.loc[QUIET, "latency"]
+            lines.append(f"Estimated call time saved: {saved:,.0f}s")
+        return "\n".join(lines)
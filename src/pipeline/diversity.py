@@ -0,0 +1,301 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+"""
+Diversity Metrics Module
+
+Compares the lexical diversity of the generated notes per ward and model (records) and
+per model and category (category notes), in time linear in the number of words:
+- length distribution in words and characters
+- distinct-n: unique n-grams / all n-grams for n = 1, 2, 3, on hashed n-grams counted
+  with numpy instead of Python tuples
+- self-BLEU: BLEU-4 of a sample of notes against a disjoint sample of references from
+  the same group, with clipped counts against the maximum count in the references
+- duplicates: exact duplicate notes, and near duplicates found with MinHash signatures
+  of word 3-grams and locality-sensitive hashing (bands of rows equal in two notes)
+- mean similarity: the mean Jaccard similarity of random pairs of notes, estimated from
+  their MinHash signatures
+- vocabulary overlap between groups: Jaccard similarity of their sets of word hashes
+
+Words are hashed with pandas' stable hash, so hashes agree between processes. Groups are
+computed in parallel in separate processes.
+"""
+
+NGRAM_SIZES = (1, 2, 3)
+SHINGLE_SIZE = 3  # Words per shingle for MinHash
+NUM_PERM = 64  # MinHash permutations
+BANDS = 8  # LSH bands of NUM_PERM // BANDS rows, near duplicates from Jaccard ~0.77
+SAMPLE_SIZE = 500  # Hypotheses and references for self-BLEU
+SIMILARITY_PAIRS = 20_000  # Random pairs for the mean similarity
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def tokenize(notes: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lower-cased words of all notes as one array.
+
+    Returns:
+        Tuple of (word hashes, index of the note of each word)
+    """
+    words = notes.fillna("").astype(str).str.lower().str.findall(r"\w+")
+    lengths = words.str.len().to_numpy()
+    flat = words.explode().dropna()
+    hashes = pd.util.hash_array(flat.to_numpy(dtype=object))
+    return hashes, np.repeat(np.arange(len(words)), lengths)
+
+
+def ngram_hashes(
+    hashes: np.ndarray, note_index: np.ndarray, n: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Hashes of the n-grams within notes, and the note of each n-gram."""
+    if n == 1:
+        return hashes, note_index
+    count = max(len(hashes) - n + 1, 0)
+    combined = hashes[:count].copy()
+    for offset in range(1, n):
+        # Overflow wraps around, which is fine for hashing
+        combined = combined * _MIX ^ hashes[offset : offset + count]
+    within = note_index[:count] == note_index[n - 1 : n - 1 + count]
+    return combined[within], note_index[:count][within]
+
+
+def minhash_signatures(
+    shingles: np.ndarray, shingle_note: np.ndarray, num_notes: int, seed: int = 0
+) -> np.ndarray:
+    """
+    MinHash signature per note, one permutation at a time to bound the memory.
+
+    Returns:
+        Array of (num_notes, NUM_PERM); notes without shingles have the maximum value
+    """
+    signatures = np.full((num_notes, NUM_PERM), np.iinfo(np.uint64).max, np.uint64)
+    if len(shingles) == 0:
+        return signatures
+    order = np.argsort(shingle_note, kind="stable")
+    shingles, shingle_note = shingles[order], shingle_note[order]
+    notes, starts = np.unique(shingle_note, return_index=True)
+    seeds = (
+        np.random.default_rng(seed)
+        .integers(1, np.iinfo(np.int64).max, NUM_PERM, dtype=np.int64)
+        .astype(np.uint64)
+    )
+    for k, salt in enumerate(seeds):
+        permuted = (shingles ^ salt) * _MIX
+        permuted ^= permuted >> np.uint64(29)
+        signatures[notes, k] = np.minimum.reduceat(permuted, starts)
+    return signatures
+
+
+def near_duplicates(signatures: np.ndarray, has_shingles: np.ndarray) -> np.ndarray:
+    """Mask of notes that share at least one LSH band with another note."""
+    rows = NUM_PERM // BANDS
+    found = np.zeros(len(signatures), dtype=bool)
+    for band in range(BANDS):
+        keys = signatures[:, band * rows].copy()
+        for k in range(band * rows + 1, (band + 1) * rows):
+            keys = keys * _MIX ^ signatures[:, k]
+        # Notes without shingles share the empty signature, they are left out
+        found[has_shingles] |= (
+            pd.Series(keys[has_shingles]).duplicated(keep=False).to_numpy()
+        )
+    return found
+
+
+def self_bleu(
+    hashes: np.ndarray,
+    note_index: np.ndarray,
+    num_notes: int,
+    rng: np.random.Generator,
+    sample_size: int = SAMPLE_SIZE,
+) -> float:
+    """
+    Sampled self-BLEU-4, higher means the notes of the group are more alike.
+
+    Hypotheses and references are disjoint samples, so a note is never compared with
+    itself and the maximum reference counts are computed once.
+    """
+    if num_notes < 4:
+        return np.nan
+    sample = rng.permutation(num_notes)[: 2 * sample_size]
+    half = len(sample) // 2
+    hypotheses, references = sample[:half], sample[half:]
+    starts = np.searchsorted(note_index, np.arange(num_notes + 1))
+
+    def words(i: int) -> Tuple[int, ...]:
+        return tuple(hashes[starts[i] : starts[i + 1]].tolist())
+
+    max_counts: List[Counter] = [Counter() for _ in range(4)]
+    reference_lengths = []
+    for i in references:
+        ref = words(i)
+        reference_lengths.append(len(ref))
+        for n in range(4):
+            for gram, count in Counter(zip(*[ref[k:] for k in range(n + 1)])).items():
+                if count > max_counts[n][gram]:
+                    max_counts[n][gram] = count
+    reference_lengths = np.sort(reference_lengths)
+
+    scores = []
+    for i in hypotheses:
+        hyp = words(i)
+        if not hyp:
+            continue
+        log_precision = 0.0
+        for n in range(4):
+            grams = Counter(zip(*[hyp[k:] for k in range(n + 1)]))
+            total = max(len(hyp) - n, 0)
+            clipped = sum(min(c, max_counts[n][g]) for g, c in grams.items())
+            # Smoothing as in nltk's method 1 for n-grams without matches
+            log_precision += np.log(max(clipped, 0.1) / max(total, 1)) / 4
+        # Closest reference length, the shorter one on a tie
+        position = np.searchsorted(reference_lengths, len(hyp))
+        nearby = reference_lengths[max(position - 1, 0) : position + 1]
+        closest = nearby[np.argmin(np.abs(nearby - len(hyp)))]
+        brevity = min(1.0, np.exp(1 - closest / len(hyp)))
+        scores.append(brevity * np.exp(log_precision))
+    return float(np.mean(scores)) if scores else np.nan
+
+
+def group_metrics(
+    notes: pd.Series, seed: int = 0
+) -> Tuple[Dict[str, float], np.ndarray]:
+    """
+    Diversity metrics of one group of notes.
+
+    Returns:
+        Tuple of the metrics and the sorted unique word hashes (the vocabulary)
+    """
+    rng = np.random.default_rng(seed)
+    notes = notes.reset_index(drop=True)
+    num_notes = len(notes)
+    hashes, note_index = tokenize(notes)
+    word_counts = np.bincount(note_index, minlength=num_notes)
+    char_counts = notes.fillna("").astype(str).str.len().to_numpy()
+
+    metrics: Dict[str, float] = {
+        "notes": num_notes,
+        "words_mean": word_counts.mean() if num_notes else np.nan,
+        "words_p10": np.percentile(word_counts, 10) if num_notes else np.nan,
+        "words_p50": np.percentile(word_counts, 50) if num_notes else np.nan,
+        "words_p90": np.percentile(word_counts, 90) if num_notes else np.nan,
+        "chars_mean": char_counts.mean() if num_notes else np.nan,
+    }
+    vocabulary = np.unique(hashes)
+    metrics["vocabulary"] = len(vocabulary)
+    shingles, shingle_note = hashes[:0], note_index[:0]
+    for n in NGRAM_SIZES:
+        grams, gram_note = ngram_hashes(hashes, note_index, n)
+        metrics[f"distinct_{n}"] = (
+            len(np.unique(grams)) / len(grams) if len(grams) else np.nan
+        )
+        if n == SHINGLE_SIZE:
+            shingles, shingle_note = grams, gram_note
+    metrics["self_bleu"] = self_bleu(hashes, note_index, num_notes, rng)
+
+    metrics["exact_duplicates"] = (
+        notes.duplicated(keep=False).mean() if num_notes else np.nan
+    )
+    signatures = minhash_signatures(shingles, shingle_note, num_notes, seed)
+    has_shingles = np.bincount(shingle_note, minlength=num_notes) > 0
+    metrics["near_duplicates"] = (
+        near_duplicates(signatures, has_shingles).mean() if num_notes else np.nan
+    )
+    candidates = np.flatnonzero(has_shingles)
+    if len(candidates) > 1:
+        a = rng.choice(candidates, SIMILARITY_PAIRS)
+        b = rng.choice(candidates, SIMILARITY_PAIRS)
+        distinct = a != b
+        metrics["mean_similarity"] = (
+            signatures[a[distinct]] == signatures[b[distinct]]
+        ).mean()
+    else:
+        metrics["mean_similarity"] = np.nan
+    return metrics, vocabulary
+
+
+def load_notes(datapath: Path) -> pd.DataFrame:
+    """
+    All notes with their source, ward, model and category.
+
+    Records come from the records_<model>.csv files of the data directory and its ward
+    subdirectories, the ward is the directory name. The combined dataset is not used,
+    its client ids repeat across models.
+    """
+    frames = []
+    dirs = [datapath] + sorted(p for p in datapath.iterdir() if p.is_dir())
+    for fn_records in (f for d in dirs for f in sorted(d.glob("records_*.csv"))):
+        df_records = pd.read_csv(fn_records, usecols=["note"])
+        frames.append(
+            df_records.assign(
+                ward=fn_records.parent.name,
+                model=fn_records.stem.removeprefix("records_"),
+            )
+        )
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    df = df.reindex(columns=["ward", "model", "note"]).assign(
+        source="records", category="all"
+    )
+
+    fn_notes = datapath / "notes.csv"
+    if fn_notes.exists():
+        df_notes = pd.read_csv(fn_notes, usecols=["category", "note", "model"])
+        df = pd.concat(
+            [
+                df,
+                df_notes.assign(source="notes", ward="all"),
+                df_notes.assign(source="notes", ward="all", category="all"),
+            ],
+            ignore_index=True,
+        )
+    return df[["source", "ward", "model", "category", "note"]]
+
+
+def _group_task(args: Tuple[Tuple[str, ...], pd.Series, int]):
+    key, notes, seed = args
+    metrics, vocabulary = group_metrics(notes, seed)
+    return key, metrics, vocabulary
+
+
+def diversity_report(
+    df_notes: pd.DataFrame, workers: Optional[int] = None, seed: int = 0
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Metrics per group of notes and the vocabulary overlap between the groups.
+
+    Args:
+        df_notes: Notes with source, ward, model and category, see load_notes
+        workers: Processes computing groups in parallel, defaults to the CPU count
+        seed: Seed of the samples and MinHash permutations
+
+    Returns:
+        Tuple of the report (one row per group) and the pairwise vocabulary overlap
+    """
+    group_columns = ["source", "ward", "model", "category"]
+    tasks = [
+        (key, df_group["note"], seed)
+        for key, df_group in df_notes.groupby(group_columns, sort=True, dropna=False)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_group_task, tasks))
+
+    df_report = pd.DataFrame(
+        [dict(zip(group_columns, key), **metrics) for key, metrics, _ in results]
+    )
+    overlap = []
+    for i, (key_a, _, vocabulary_a) in enumerate(results):
+        for key_b, _, vocabulary_b in results[i + 1 :]:
+            if key_a[0] != key_b[0] or key_a[3] != key_b[3]:
+                continue  # Same source and category, other ward or model
+            shared = len(np.intersect1d(vocabulary_a, vocabulary_b, assume_unique=True))
+            union = len(vocabulary_a) + len(vocabulary_b) - shared
+            overlap.append(
+                ("/".join(map(str, key_a)), "/".join(map(str, key_b)), shared / union)
+            )
+    df_overlap = pd.DataFrame(overlap, columns=["group_a", "group_b", "jaccard"])
+    return df_report, df_overlap
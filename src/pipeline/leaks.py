@@ -0,0 +1,266 @@
+import os
+import re
+import unicodedata
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import pandas as pd
+
+from pipeline.versions import HASH_COLUMNS, row_hashes
+
+"""
+Name Leak Scanner Module
+
+Finds client names in generated notes. The prompts ask to avoid the name ("Vermijd het
+noemen van de naam"), and a note may also mention another client of the ward. All first
+and last names of all profiles, across models and wards, are compiled into one
+Aho-Corasick automaton. Its alphabet is words instead of characters: notes and names
+are split into case- and accent-folded words, so matches are always whole words
+("Jan" does not match "januari") and multi-word names ("van den Berg") are one pattern.
+A scan is linear in the number of words of a note, regardless of the number of names.
+
+Files are scanned in chunks of rows, so the combined dataset never has to fit in memory.
+The quality gate uses the same scanner for its name_leak rule. Hits of other clients'
+names in records_<model>.csv can be added as defects with quality.leak_defects, which
+regenerates the client weeks; notes can also be redacted in place.
+"""
+
+MIN_NAME_LENGTH = 3  # Shorter names give too many false name leaks
+
+# Prefixes of Dutch surnames, a surname is also matched without them ("Berg")
+TUSSENVOEGSELS = {"van", "de", "den", "der", "het", "ter", "ten", "te", "in", "op"}
+
+LEAK_COLUMNS = ["file", "row", "note_id", "client_id", "name", "start", "end", "own"]
+
+_WORDS = re.compile(r"\w+")
+
+
+def _fold(text: str) -> str:
+    """Lower case without accents, "Renée" and "renee" are the same word."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _words(text: str) -> List[Tuple[str, int, int]]:
+    """Folded words of a text with their character offsets."""
+    return [(_fold(m.group()), m.start(), m.end()) for m in _WORDS.finditer(text)]
+
+
+def name_variants(voornaam: str, achternaam: str) -> List[str]:
+    """The names to look for: first name, surname and surname without prefixes."""
+    variants = [str(voornaam).strip(), str(achternaam).strip()]
+    words = str(achternaam).split()
+    while words and words[0].lower() in TUSSENVOEGSELS:
+        words = words[1:]
+    variants.append(" ".join(words))
+    return [v for v in dict.fromkeys(variants) if len(v) >= MIN_NAME_LENGTH]
+
+
+class NameScanner:
+    """
+    Aho-Corasick automaton over words.
+
+    Attributes:
+        names: The pattern names, in the order they were added
+        lengths: Number of words per pattern
+        goto: Transitions per state, from folded word to state
+        fail: Fallback state per state, the longest proper suffix that is a prefix
+        output: Pattern indices that end in each state, including via fail links
+    """
+
+    def __init__(self, names: Iterable[str]):
+        self.names: List[str] = []
+        self.goto: List[Dict[str, int]] = [{}]
+        self.output: List[List[int]] = [[]]
+        lengths: List[int] = []
+        for name in dict.fromkeys(names):
+            words = [w for w, _, _ in _words(name)]
+            if not words:
+                continue
+            state = 0
+            for word in words:
+                if word not in self.goto[state]:
+                    self.goto.append({})
+                    self.output.append([])
+                    self.goto[state][word] = len(self.goto) - 1
+                state = self.goto[state][word]
+            self.output[state].append(len(self.names))
+            self.names.append(name)
+            lengths.append(len(words))
+        self.lengths = lengths
+        self.fail = self._build_fail()
+
+    def _build_fail(self) -> List[int]:
+        fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, child in self.goto[state].items():
+                queue.append(child)
+                fallback = fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = fail[fallback]
+                fail[child] = self.goto[fallback].get(word, 0)
+                if fail[child] == child:
+                    fail[child] = 0
+                self.output[child] = self.output[child] + self.output[fail[child]]
+        return fail
+
+    def scan(self, text: str) -> List[Tuple[int, int, str]]:
+        """All name matches in a text as (start, end, name), overlapping included."""
+        hits = []
+        words = _words(text)
+        state = 0
+        for position, (word, _, end) in enumerate(words):
+            while state and word not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(word, 0)
+            for pattern in self.output[state]:
+                start = words[position - self.lengths[pattern] + 1][1]
+                hits.append((start, end, self.names[pattern]))
+        return hits
+
+
+def profile_files(datapath: Path) -> List[Path]:
+    """The profiles of all models in the data directory and its ward subdirectories."""
+    dirs = [datapath] + sorted(p for p in datapath.iterdir() if p.is_dir())
+    return [f for d in dirs for f in sorted(d.glob("profiles_*.csv"))]
+
+
+def load_names(datapath: Path) -> pd.DataFrame:
+    """
+    All name variants of all profiles.
+
+    Returns:
+        DataFrame with name, ward (directory name), model and client_id
+    """
+    rows = []
+    for fn_profiles in profile_files(datapath):
+        model = fn_profiles.stem.removeprefix("profiles_")
+        df_profiles = pd.read_csv(fn_profiles)
+        for client_id, voornaam, achternaam in df_profiles[
+            ["client_id", "voornaam", "achternaam"]
+        ].itertuples(index=False):
+            for name in name_variants(voornaam, achternaam):
+                rows.append((name, fn_profiles.parent.name, model, client_id))
+    return pd.DataFrame(rows, columns=["name", "ward", "model", "client_id"])
+
+
+def _owner_keys(df_names: pd.DataFrame) -> Dict[str, set]:
+    """Per folded name, the (ward, model, client_id) of the clients with that name."""
+    owners: Dict[str, set] = {}
+    for name, ward, model, client_id in df_names.itertuples(index=False):
+        owners.setdefault(_fold(name), set()).add((ward, model, client_id))
+    return owners
+
+
+def scan_file(
+    path: Path,
+    scanner: NameScanner,
+    df_names: pd.DataFrame,
+    chunksize: int = 10_000,
+) -> Iterator[pd.DataFrame]:
+    """
+    Scan the note column of a CSV file in chunks.
+
+    For records_<model>.csv, own tells whether the name belongs to the note's client;
+    for other files (notes.csv, the combined dataset) own is False.
+
+    Yields:
+        DataFrame with LEAK_COLUMNS per chunk, one row per hit
+    """
+    match = re.fullmatch(r"records_(.+)", path.stem)
+    owners = _owner_keys(df_names)
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        rows = []
+        notes = chunk["note"].fillna("").astype(str)
+        note_ids = (
+            chunk["note_id"] if "note_id" in chunk else pd.Series(pd.NA, chunk.index)
+        )
+        client_ids = (
+            chunk["client_id"]
+            if "client_id" in chunk
+            else pd.Series(pd.NA, chunk.index)
+        )
+        for row, note, note_id, client_id in zip(
+            chunk.index, notes, note_ids, client_ids
+        ):
+            for start, end, name in scanner.scan(note):
+                own = bool(match) and (
+                    (path.parent.name, match.group(1), client_id)
+                    in owners.get(_fold(name), ())
+                )
+                rows.append((str(path), row, note_id, client_id, name, start, end, own))
+        yield pd.DataFrame(rows, columns=LEAK_COLUMNS)
+
+
+def scan_files(
+    paths: List[Path], datapath: Path, chunksize: int = 10_000
+) -> pd.DataFrame:
+    """Scan files against the names of all profiles in datapath, all hits at once."""
+    df_names = load_names(datapath)
+    scanner = NameScanner(df_names["name"])
+    frames = [
+        df_hits
+        for path in paths
+        for df_hits in scan_file(path, scanner, df_names, chunksize)
+        if not df_hits.empty
+    ]
+    return (
+        pd.concat(frames, ignore_index=True)
+        if frames
+        else pd.DataFrame(columns=LEAK_COLUMNS)
+    )
+
+
+def redact_file(
+    path: Path,
+    df_hits: pd.DataFrame,
+    replacement: str = "client",
+    chunksize: int = 10_000,
+) -> int:
+    """
+    Replace the names found in a file by a placeholder, streaming chunk by chunk.
+
+    Returns:
+        Number of notes changed
+    """
+    hits: Dict[int, List[Tuple[int, int]]] = {}
+    for row, start, end in df_hits.loc[
+        df_hits["file"] == str(path), ["row", "start", "end"]
+    ].itertuples(index=False):
+        hits.setdefault(int(row), []).append((int(start), int(end)))
+
+    if not hits:
+        return 0
+
+    changed = 0
+    tmp_path = path.with_suffix(".redacting")
+    chunks = pd.read_csv(path, chunksize=chunksize, dtype={"row_hash": str})
+    for i, chunk in enumerate(chunks):
+        rows = chunk.index.intersection(list(hits))
+        for row in rows:
+            chunk.at[row, "note"] = _redact(
+                str(chunk.at[row, "note"]), hits[row], replacement
+            )
+            changed += 1
+        if "row_hash" in chunk.columns and path.stem in HASH_COLUMNS:
+            # The combined MemoryLane/records.csv, keep its row hashes current
+            chunk.loc[rows, "row_hash"] = row_hashes(chunk.loc[rows], path.stem)
+        chunk.to_csv(tmp_path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    os.replace(tmp_path, path)
+    return changed
+
+
+def _redact(note: str, spans: List[Tuple[int, int]], replacement: str) -> str:
+    # Longest span first at each position, and from the end so offsets stay valid
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(spans, key=lambda s: (s[0], -s[1])):
+        if merged and start < merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    for start, end in reversed(merged):
+        note = note[:start] + replacement + note[end:]
+    return note
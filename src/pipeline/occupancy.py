@@ -0,0 +1,143 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+"""
+Ward Occupancy Module
+
+Simulates the stays on wards with a fixed number of beds, to give the generated clients
+realistic admission dates, lengths of stay and outcomes. Each bed is a renewal process:
+a stay of whole weeks (gamma distributed, at least one week), ending in a discharge or a
+death, followed by an empty bed until the next admission (exponential turnover in days).
+A bed holds one client at a time, so a ward is never over capacity and beds are refilled
+after every discharge.
+
+All beds of all wards are simulated at once as NumPy arrays, a block of stays per bed at
+a time, until every bed is past the end of the period. The simulation starts with a
+warm-up before from_date, so the ward is in its steady state at the start of the period
+and clients admitted before it are included.
+"""
+
+DISCHARGE, DEATH = "ontslag", "overlijden"
+
+STAY_COLUMNS = [
+    "ward",
+    "bed",
+    "start_date",
+    "discharge_date",
+    "duration",
+    "outcome",
+]
+
+
+def simulate_occupancy(
+    num_wards: int,
+    beds: int,
+    from_date: str,
+    to_date: str,
+    rng: np.random.Generator,
+    mean_stay_weeks: float = 10,
+    stay_shape: float = 1.5,
+    mean_turnover_days: float = 4,
+    death_rate: float = 0.6,
+    warmup_weeks: Optional[int] = None,
+    block: int = 16,
+) -> pd.DataFrame:
+    """
+    Simulate the stays on num_wards wards with a fixed number of beds.
+
+    Args:
+        num_wards: Number of wards
+        beds: Beds per ward
+        from_date: Start of the period
+        to_date: End of the period (exclusive)
+        rng: Seeded numpy Generator
+        mean_stay_weeks: Mean length of stay in weeks
+        stay_shape: Shape of the gamma distribution of the length of stay, lower
+            values give more short stays and a longer tail
+        mean_turnover_days: Mean number of days a bed is empty between clients
+        death_rate: Share of stays that end with the death of the client
+        warmup_weeks: Simulated weeks before from_date, defaults to four mean stays
+        block: Stays drawn per bed in each vectorized step
+
+    Returns:
+        DataFrame with STAY_COLUMNS, one row per stay that overlaps the period, sorted
+        by ward and start_date. Stays that continue after to_date have no
+        discharge_date and outcome, and their duration runs up to to_date.
+    """
+    start = np.datetime64(from_date, "D")
+    end = np.datetime64(to_date, "D")
+    if warmup_weeks is None:
+        warmup_weeks = int(np.ceil(4 * mean_stay_weeks))
+    origin = start - np.timedelta64(7 * warmup_weeks, "D")
+    horizon = (end - origin).astype(np.int64)
+
+    n = num_wards * beds
+    # Day of the next admission per bed, relative to origin
+    clock = np.rint(rng.exponential(mean_turnover_days, n)).astype(np.int64)
+    admissions, stays = [], []
+    while (clock < horizon).any():
+        weeks = np.maximum(
+            np.rint(rng.gamma(stay_shape, mean_stay_weeks / stay_shape, (n, block))), 1
+        ).astype(np.int64)
+        turnover = np.rint(rng.exponential(mean_turnover_days, (n, block))).astype(
+            np.int64
+        )
+        cycle = 7 * weeks + turnover
+        offsets = np.cumsum(cycle, axis=1) - cycle
+        admissions.append(clock[:, None] + offsets)
+        stays.append(weeks)
+        clock = clock + cycle.sum(axis=1)
+
+    admission = np.concatenate(admissions, axis=1)
+    weeks = np.concatenate(stays, axis=1)
+    discharge = admission + 7 * weeks
+    first_day = (start - origin).astype(np.int64)
+    overlaps = (discharge > first_day) & (admission < horizon)
+    bed_index = np.broadcast_to(np.arange(n)[:, None], admission.shape)[overlaps]
+    admission = admission[overlaps]
+    weeks = weeks[overlaps]
+    discharge = discharge[overlaps]
+
+    ongoing = discharge > horizon
+    duration = np.where(ongoing, -(-(horizon - admission) // 7), weeks)
+    deaths = rng.random(len(admission)) < death_rate
+    outcome = np.where(ongoing, None, np.where(deaths, DEATH, DISCHARGE))
+    discharge_date = pd.Series(origin + discharge.astype("timedelta64[D]"))
+    discharge_date[ongoing] = pd.NaT
+
+    df_stays = pd.DataFrame(
+        {
+            "ward": bed_index // beds + 1,
+            "bed": bed_index % beds + 1,
+            "start_date": pd.to_datetime(origin + admission.astype("timedelta64[D]")),
+            "discharge_date": pd.to_datetime(discharge_date),
+            "duration": duration,
+            "outcome": outcome,
+        },
+        columns=STAY_COLUMNS,
+    )
+    return df_stays.sort_values(["ward", "start_date", "bed"]).reset_index(drop=True)
+
+
+def daily_occupancy(
+    df_stays: pd.DataFrame, from_date: str, to_date: str
+) -> pd.DataFrame:
+    """
+    Occupied beds per day and ward.
+
+    Returns:
+        DataFrame indexed by date with a column per ward
+    """
+    days = pd.date_range(from_date, to_date, inclusive="left")
+    wards = np.sort(df_stays["ward"].unique())
+    column = np.searchsorted(wards, df_stays["ward"].to_numpy())
+
+    # Stays are [start, start + duration weeks), censored at to_date
+    first = (df_stays["start_date"] - days[0]).dt.days.to_numpy()
+    last = first + 7 * df_stays["duration"].to_numpy()
+    changes = np.zeros((len(days) + 1, len(wards)), dtype=np.int64)
+    np.add.at(changes, (np.clip(first, 0, len(days)), column), 1)
+    np.add.at(changes, (np.clip(last, 0, len(days)), column), -1)
+    return pd.DataFrame(np.cumsum(changes, axis=0)[:-1], index=days, columns=wards)
@@ -0,0 +1,259 @@
+import heapq
+import json
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config.settings import get_settings
+from llm.tokens import estimate_tokens
+from llm.usage import completion_cost
+from pipeline.quality import NOTES_PER_WEEK
+from pipeline.work_items import (
+    RESPONSE_MODELS,
+    build_work_items,
+    format_client_profile,
+    render_messages,
+)
+
+"""
+Run Planner Module
+
+Estimates a generation run before it is started: the number of calls, the input and
+output tokens, the cost and the wall time under the rate limits and concurrency of each
+provider (see the planner fields of LLMProviderSettings).
+
+Prompts are rendered from the templates and the data files, and their tokens estimated
+locally with llm.tokens. When the scenarios of a model have not been generated yet,
+the records prompts are rendered without history and the history is added as
+ASSUMED_SCENARIO_TOKENS per past week. Output tokens are measured from existing data
+where possible, otherwise assumed. Retries by instructor are not included.
+
+The schedule is simulated per model: calls start in order as soon as a slot is free
+and the requests and tokens of the last minute stay within rpm and tpm.
+"""
+
+ASSUMED_SCENARIO_TOKENS = 60  # Tokens of one week of scenario text
+ASSUMED_NOTE_TOKENS = 55  # Output tokens of one note, including its JSON and date
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators per message
+
+PLAN_COLUMNS = [
+    "ward",
+    "provider",
+    "model",
+    "calls",
+    "input_tokens",
+    "output_tokens",
+    "max_input_tokens",
+    "cost",
+    "hours",
+    "throttled_hours",
+]
+
+
+def prompt_tokens(messages: List[Dict[str, str]], schema_tokens: int = 0) -> int:
+    """Estimated input tokens of a call, including the response model schema."""
+    return schema_tokens + sum(
+        estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages
+    )
+
+
+def schema_tokens(stage: str) -> int:
+    """Estimated tokens of the schema that instructor sends with a stage's calls."""
+    return estimate_tokens(json.dumps(RESPONSE_MODELS[stage].model_json_schema()))
+
+
+def _output_tokens_per_week(stage: str, model: str, ward_dir: Path) -> float:
+    """Mean output tokens per client week, measured from existing data if available."""
+    if stage == "scenarios":
+        fn_scenarios = ward_dir / f"scenarios_{model}.csv"
+        if fn_scenarios.exists():
+            text = pd.read_csv(fn_scenarios)["events_description"].astype(str)
+            return text.map(estimate_tokens).mean() + 10
+        return ASSUMED_SCENARIO_TOKENS + 10
+
+    fn_records = ward_dir / f"records_{model}.csv"
+    if fn_records.exists():
+        df_records = pd.read_csv(fn_records)
+        # Note text plus the keys and the ISO date of each note
+        tokens = df_records["note"].astype(str).map(estimate_tokens) + 20
+        return tokens.groupby(df_records["scenario_id"]).sum().mean()
+    return NOTES_PER_WEEK * ASSUMED_NOTE_TOKENS
+
+
+def estimate_calls(stage: str, row_models: pd.Series, ward_dir: Path) -> pd.DataFrame:
+    """
+    Estimate the input and output tokens of every call of a stage for one model.
+
+    Args:
+        stage: "scenarios" or "records"
+        row_models: The model's row in llm_models.csv
+        ward_dir: Directory with the model's profiles (and scenarios) files
+
+    Returns:
+        DataFrame with input_tokens and output_tokens per call, in run order
+    """
+    model = row_models["llm_model"]
+    schema = schema_tokens(stage)
+    per_week = _output_tokens_per_week(stage, model, ward_dir)
+    df_model = row_models.to_frame().T
+
+    if stage == "scenarios":
+        items = build_work_items("scenarios", df_model, ward_dir)
+        durations = pd.read_csv(ward_dir / f"profiles_{model}.csv")["duration"]
+        return pd.DataFrame(
+            {
+                "input_tokens": [prompt_tokens(i["messages"], schema) for i in items],
+                "output_tokens": durations.to_numpy() * per_week,
+            }
+        )
+
+    if (ward_dir / f"scenarios_{model}.csv").exists():
+        items = build_work_items("records", df_model, ward_dir)
+        input_tokens = np.array([prompt_tokens(i["messages"], schema) for i in items])
+    else:
+        # One call per week up to the duration, the history grows by a week per call
+        df_profiles = pd.read_csv(ward_dir / f"profiles_{model}.csv")
+        durations = df_profiles["duration"].astype(int).to_numpy()
+        base = np.array(
+            [
+                prompt_tokens(
+                    render_messages(
+                        "generate_records",
+                        client_profile=format_client_profile(row),
+                        weekno=0,
+                        events_description="",
+                        scenario="",
+                        start_date="2024-01-01",
+                        dhr_mw="mw." if row["geslacht"] == "v" else "dhr.",
+                    ),
+                    schema,
+                )
+                for _, row in df_profiles.iterrows()
+            ]
+        )
+        weeks = np.arange(durations.sum()) - np.repeat(
+            np.cumsum(durations) - durations, durations
+        )
+        history = (weeks + 1) * ASSUMED_SCENARIO_TOKENS
+        input_tokens = np.repeat(base, durations) + history
+    return pd.DataFrame(
+        {
+            "input_tokens": input_tokens,
+            "output_tokens": np.full(len(input_tokens), per_week),
+        }
+    )
+
+
+def simulate_schedule(
+    calls: pd.DataFrame,
+    concurrency: int = 1,
+    rpm: Optional[int] = None,
+    tpm: Optional[int] = None,
+    output_tokens_per_second: float = 60.0,
+    request_overhead: float = 0.6,
+) -> Tuple[float, float]:
+    """
+    Simulate running the calls in order under a concurrency and rate limits.
+
+    Args:
+        calls: DataFrame with input_tokens and output_tokens per call
+        concurrency: Calls in flight at the same time
+        rpm: Requests per minute, None for no limit
+        tpm: Input plus output tokens per minute, None for no limit
+        output_tokens_per_second: Generation speed of the model
+        request_overhead: Seconds per call before the first output token
+
+    Returns:
+        Tuple of (wall time, time spent waiting for the rate limits) in seconds
+    """
+    slots = [0.0] * concurrency
+    window = deque()  # (start time, tokens) of the calls of the last minute
+    window_tokens = 0.0
+    start = 0.0
+    throttled = 0.0
+    for input_tokens, output_tokens in calls[
+        ["input_tokens", "output_tokens"]
+    ].itertuples(index=False):
+        free = max(heapq.heappop(slots), start)
+        start = free
+        tokens = input_tokens + output_tokens
+        while True:
+            while window and window[0][0] + 60 <= start:
+                window_tokens -= window.popleft()[1]
+            within_rpm = rpm is None or len(window) < rpm
+            within_tpm = tpm is None or window_tokens + tokens <= tpm or not window
+            if within_rpm and within_tpm:
+                break
+            start = window[0][0] + 60
+        throttled += start - free
+        window.append((start, tokens))
+        window_tokens += tokens
+        duration = request_overhead + output_tokens / output_tokens_per_second
+        heapq.heappush(slots, start + duration)
+    return max(slots), throttled
+
+
+def ward_dirs(datapath: Path, model: str) -> List[Tuple[str, Path]]:
+    """The data directory and ward subdirectories that hold profiles of a model."""
+    dirs = [datapath] + sorted(p for p in datapath.iterdir() if p.is_dir())
+    return [(d.name, d) for d in dirs if (d / f"profiles_{model}.csv").exists()]
+
+
+def plan_run(
+    stage: str,
+    df_models: pd.DataFrame,
+    datapath: Path,
+    concurrency: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Estimate a run of a stage for every model and ward.
+
+    Args:
+        stage: "scenarios" or "records"
+        df_models: The LLM models, as stored in llm_models.csv
+        datapath: The data directory, ward subdirectories are included
+        concurrency: Calls in flight per model, defaults to the provider settings
+
+    Returns:
+        DataFrame with PLAN_COLUMNS, one row per ward and model
+    """
+    if stage not in ("scenarios", "records"):
+        raise ValueError(f"The planner supports scenarios and records, not {stage}")
+    llm_settings = get_settings().llm
+
+    rows = []
+    for _, row_models in df_models.iterrows():
+        provider = row_models["llm_provider"]
+        model = row_models["llm_model"]
+        settings = getattr(llm_settings, provider)
+
+        for ward, ward_dir in ward_dirs(datapath, model):
+            calls = estimate_calls(stage, row_models, ward_dir)
+            seconds, throttled = simulate_schedule(
+                calls,
+                concurrency=concurrency or settings.concurrency,
+                rpm=settings.rpm,
+                tpm=settings.tpm,
+                output_tokens_per_second=settings.output_tokens_per_second,
+                request_overhead=settings.request_overhead,
+            )
+            input_tokens = calls["input_tokens"].sum()
+            output_tokens = calls["output_tokens"].sum()
+            rows.append(
+                (
+                    ward,
+                    provider,
+                    model,
+                    len(calls),
+                    int(input_tokens),
+                    int(output_tokens),
+                    int(calls["input_tokens"].max()) if len(calls) else 0,
+                    completion_cost(provider, model, input_tokens, output_tokens),
+                    seconds / 3600,
+                    throttled / 3600,
+                )
+            )
+    return pd.DataFrame(rows, columns=PLAN_COLUMNS)
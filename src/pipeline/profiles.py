@@ -0,0 +1,338 @@
+import hashlib
+import re
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+import numpy as np
+import pandas as pd
+
+from llm.failover import FailoverRouter
+from llm.wire_format import create_wire_completion
+from pipeline.occupancy import DEATH
+from pipeline.work_items import render_messages
+from prompts.generate_profiles_rm import ClientProfile, ClientProfiles
+
+"""
+Profile Generation Module
+
+Generates client profiles in bulk: a target number of profiles per ward type, requested
+in parallel batches. Profiles with a name or clinical picture that was generated before
+are rejected, based on hashes of the normalized fields. The start date, duration and
+complications of all accepted profiles are drawn in one vectorized pass with a seeded
+numpy Generator, so a run is reproducible apart from the LLM output itself. With
+simulated stays (see pipeline.occupancy) the start date, duration and outcome come from
+the ward simulation instead, one profile per stay.
+"""
+
+WARD_TYPES: Dict[str, Dict[str, str]] = {
+    "som": {
+        "profile_type": "somatische afdeling",
+        "description": "mensen met een hoge zorgzwaarte ten gevolge van een somatische aandoening",
+    },
+    "pg": {
+        "profile_type": "psychogeriatrische afdeling",
+        "description": "mensen met een gevorderde dementie met een hoge zorgzwaarte",
+    },
+}
+
+COMPLICATIONS_LIBRARY = [
+    "gewichtsverlies",
+    "algehele achteruitgang",
+    "decubitus",
+    "urineweginfectie",
+    "pneumonie",
+    "delier",
+    "verergering van onderliggende lichamelijke klachten",
+    "verbetering van de klachten",
+    "overlijden",
+    "valpartij",
+]
+
+PROFILE_COLUMNS = list(ClientProfile.model_fields)
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", str(text)).strip().casefold()
+
+
+def _hash(*fields: str) -> int:
+    digest = hashlib.blake2b(
+        "\x1f".join(_normalize(f) for f in fields).encode("utf-8"), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "little")
+
+
+def name_hash(profile: Dict[str, str]) -> int:
+    return _hash(profile["voornaam"], profile["achternaam"])
+
+
+def clinical_hash(profile: Dict[str, str]) -> int:
+    return _hash(profile["diagnose"], profile["somatiek"], profile["gedrag"])
+
+
+def draw_profile_attributes(
+    n: int,
+    rng: np.random.Generator,
+    from_date: str = "2024-01-01",
+    to_date: str = "2025-01-01",
+    mean_duration: float = 10,
+    std_duration: float = 4,
+    complications_library: Sequence[str] = COMPLICATIONS_LIBRARY,
+    min_complications: int = 1,
+    max_complications: int = 3,
+) -> pd.DataFrame:
+    """
+    Draw start date, duration and complications for n profiles at once.
+
+    Durations are rounded to whole weeks and are at least one week. Complications
+    are sampled without replacement per profile.
+
+    Returns:
+        DataFrame with the columns start_date, duration and complications
+    """
+    start = np.datetime64(from_date, "s")
+    span = (np.datetime64(to_date, "s") - start).astype(np.int64)
+    start_dates = start + (rng.random(n) * span).astype(np.int64).astype(
+        "timedelta64[s]"
+    )
+
+    durations = np.maximum(
+        np.rint(rng.normal(mean_duration, std_duration, n)), 1
+    ).astype(int)
+
+    return pd.DataFrame(
+        {
+            "start_date": pd.to_datetime(start_dates),
+            "duration": durations,
+            "complications": draw_complications(
+                n, rng, complications_library, min_complications, max_complications
+            ),
+        }
+    )
+
+
+def draw_complications(
+    n: int,
+    rng: np.random.Generator,
+    complications_library: Sequence[str] = COMPLICATIONS_LIBRARY,
+    min_complications: int = 1,
+    max_complications: int = 3,
+) -> List[str]:
+    """Comma-separated complications for n profiles, without replacement per profile."""
+    # Sampling without replacement: the first k columns of a random permutation per row
+    library = np.asarray(complications_library, dtype=object)
+    counts = rng.integers(min_complications, max_complications + 1, n)
+    order = rng.random((n, len(library))).argsort(axis=1)[:, :max_complications]
+    picked = library[order]
+    return [
+        ", ".join(row[:count]) for row, count in zip(picked.tolist(), counts.tolist())
+    ]
+
+
+def stay_attributes(df_stays: pd.DataFrame, rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Profile attributes from simulated stays, see pipeline.occupancy.
+
+    Start date, duration and outcome come from the stay. Death is decided by the
+    simulation: "overlijden" is added to the complications of clients who die and is not
+    drawn for the others.
+
+    Returns:
+        DataFrame with the columns start_date, duration, complications, bed,
+        discharge_date and outcome
+    """
+    library = [c for c in COMPLICATIONS_LIBRARY if c != DEATH]
+    complications = pd.Series(
+        draw_complications(len(df_stays), rng, library), index=df_stays.index
+    )
+    deaths = df_stays["outcome"] == DEATH
+    complications[deaths] = complications[deaths] + f", {DEATH}"
+    return pd.DataFrame(
+        {
+            "start_date": df_stays["start_date"],
+            "duration": df_stays["duration"],
+            "complications": complications,
+            "bed": df_stays["bed"],
+            "discharge_date": df_stays["discharge_date"],
+            "outcome": df_stays["outcome"],
+        }
+    ).reset_index(drop=True)
+
+
+class ProfileEngine:
+    """
+    Generates distinct client profiles in parallel batches.
+
+    Attributes:
+        router: Router used for the completions
+        batch_size: Number of profiles requested per completion
+        concurrency: Number of completions running in parallel
+        rng: Seeded generator for the numeric attributes and the prompt variation
+        avoid_names: Number of already used names listed in the prompt to steer the
+            model away from repeating them
+        wire_format: "full" or "compact" (short JSON keys)
+
+    A router can be passed in to share its warm clients and circuit breakers.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        batch_size: int = 8,
+        concurrency: int = 4,
+        seed: Optional[int] = None,
+        avoid_names: int = 30,
+        wire_format: str = "full",
+        router: Optional[FailoverRouter] = None,
+    ):
+        self.model = model
+        self.router = router or FailoverRouter(provider=provider, model=model)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rng = np.random.default_rng(seed)
+        self.avoid_names = avoid_names
+        self.wire_format = wire_format
+        self.name_hashes: Set[int] = set()
+        self.clinical_hashes: Set[int] = set()
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def add_existing(self, df_profiles: pd.DataFrame) -> None:
+        """Register existing profiles, so new profiles do not duplicate them."""
+        for profile in df_profiles[PROFILE_COLUMNS].to_dict("records"):
+            self.name_hashes.add(name_hash(profile))
+            self.clinical_hashes.add(clinical_hash(profile))
+
+    def _accept(self, profile: Dict[str, str]) -> bool:
+        names, clinical = name_hash(profile), clinical_hash(profile)
+        with self._lock:
+            if names in self.name_hashes or clinical in self.clinical_hashes:
+                self.rejected += 1
+                return False
+            self.name_hashes.add(names)
+            self.clinical_hashes.add(clinical)
+            return True
+
+    def _request_batch(self, ward_type: str, used_names: List[str]) -> List[Dict]:
+        messages = render_messages(
+            "generate_profiles",
+            num_profiles=self.batch_size,
+            avoid_names=", ".join(used_names),
+            **WARD_TYPES[ward_type],
+        )
+        response_model, _ = create_wire_completion(
+            self.router,
+            response_model=ClientProfiles,
+            messages=messages,
+            wire_format=self.wire_format,
+            model=self.model,
+        )
+        served_provider, served_model = self.router.last_endpoint
+        return [
+            {
+                **profile.model_dump(),
+                "served_provider": served_provider,
+                "served_model": served_model,
+            }
+            for profile in response_model.clients
+        ]
+
+    def generate(
+        self,
+        ward_type: str,
+        num_profiles: Optional[int] = None,
+        max_batches: Optional[int] = None,
+        df_stays: Optional[pd.DataFrame] = None,
+        submit: Optional[Callable[..., Future]] = None,
+    ) -> pd.DataFrame:
+        """
+        Generate num_profiles distinct profiles for a ward type.
+
+        Args:
+            ward_type: Key of WARD_TYPES, "som" or "pg"
+            num_profiles: Target number of profiles, defaults to the number of stays
+            max_batches: Maximum number of completions, defaults to three times the
+                number needed without rejections
+            df_stays: Simulated stays of the ward (see pipeline.occupancy), one profile
+                per stay. Without stays the attributes are drawn independently.
+            submit: Runs a batch request, as submit(fn, *args) returning a Future;
+                defaults to a pool of concurrency threads. A cancelled batch stops the
+                generation.
+
+        Returns:
+            DataFrame with client_id, the profile fields, start_date, duration and
+            complications, plus bed, discharge_date and outcome for simulated stays.
+            Fewer than num_profiles rows if max_batches is exhausted.
+        """
+        if ward_type not in WARD_TYPES:
+            raise ValueError(f"Unknown ward type: {ward_type}")
+        if num_profiles is None:
+            if df_stays is None:
+                raise ValueError("Either num_profiles or df_stays is required")
+            num_profiles = len(df_stays)
+        if max_batches is None:
+            max_batches = 3 * -(-num_profiles // self.batch_size)
+
+        accepted: List[Dict] = []
+        used_names: List[str] = []
+        batches = 0
+        cancelled = False
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            submit = submit or executor.submit
+            while (
+                len(accepted) < num_profiles and batches < max_batches and not cancelled
+            ):
+                missing = -(-(num_profiles - len(accepted)) // self.batch_size)
+                round_size = min(self.concurrency, missing, max_batches - batches)
+                batches += round_size
+                futures = [
+                    submit(
+                        self._request_batch, ward_type, self._sample_names(used_names)
+                    )
+                    for _ in range(round_size)
+                ]
+                for future in futures:
+                    try:
+                        profiles = future.result()
+                    except CancelledError:
+                        cancelled = True
+                        continue
+                    except Exception as e:
+                        print(f"Error with model {self.model}:", e)
+                        continue
+                    for profile in profiles:
+                        if len(accepted) < num_profiles and self._accept(profile):
+                            accepted.append(profile)
+                            used_names.append(
+                                f"{profile['voornaam']} {profile['achternaam']}"
+                            )
+                print(
+                    f"{self.model}: {len(accepted)}/{num_profiles} profiles, "
+                    f"{self.rejected} duplicates rejected"
+                )
+
+        df_accepted = pd.DataFrame(
+            accepted, columns=PROFILE_COLUMNS + ["served_provider", "served_model"]
+        )
+        if df_stays is None:
+            attributes = draw_profile_attributes(len(df_accepted), self.rng)
+        else:
+            attributes = stay_attributes(df_stays.iloc[: len(df_accepted)], self.rng)
+        df_profiles = pd.concat(
+            [
+                df_accepted[PROFILE_COLUMNS],
+                attributes,
+                df_accepted[["served_provider", "served_model"]],
+            ],
+            axis=1,
+        )
+        df_profiles.insert(0, "client_id", range(1, len(df_profiles) + 1))
+        return df_profiles
+
+    def _sample_names(self, used_names: List[str]) -> List[str]:
+        if len(used_names) <= self.avoid_names:
+            return list(used_names)
+        idx = self.rng.choice(len(used_names), self.avoid_names, replace=False)
+        return [used_names[i] for i in idx]
@@ -0,0 +1,446 @@
+import os
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from jobs.worker import shard_path
+from pipeline.leaks import NameScanner, name_variants
+from pipeline.work_items import DATA_PATH, build_work_items, scenario_item
+
+"""
+Quality Gate Module
+
+Checks generated scenarios and records against the prompt contract with vectorized
+rules, and reports the defects per work item:
+- scenarios (per client): missing_week, week_out_of_range, duplicate_week,
+  empty_description
+- records (per client week): note_count, unparseable_date, date_outside_week,
+  name_leak, empty_note, duplicate_note
+
+Work items with defects that regeneration can fix are re-queued. merge_regenerated
+puts their new results back in place: records of a failing week are replaced, missing
+scenario weeks are generated with the existing weeks as context and added. Ids of rows
+that were not regenerated do not change.
+"""
+
+NOTES_PER_WEEK = 21  # 7 days, 3 notes per day, as asked in generate_records_u.jinja
+MIN_TEXT_LENGTH = 10  # Shorter notes and scenario descriptions count as empty
+
+# Rules whose defects are fixed by regenerating the work item. Duplicated scenario weeks,
+# weeks out of range and empty descriptions are only reported: records refer to them.
+REGENERATE_RULES: Dict[str, List[str]] = {
+    "scenarios": ["missing_week"],
+    "records": [
+        "note_count",
+        "unparseable_date",
+        "date_outside_week",
+        "name_leak",
+        "empty_note",
+        "duplicate_note",
+    ],
+}
+
+DEFECT_COLUMNS = [
+    "key",
+    "stage",
+    "model",
+    "client_id",
+    "scenario_id",
+    "week",
+    "rule",
+    "count",
+    "detail",
+]
+_FLAGGED_COLUMNS = ["client_id", "scenario_id", "week", "rule", "detail"]
+
+
+def _is_empty(text: pd.Series) -> pd.Series:
+    return text.fillna("").astype(str).str.strip().str.len() < MIN_TEXT_LENGTH
+
+
+def _flag(
+    df: pd.DataFrame, mask: pd.Series, rule: str, detail: pd.Series
+) -> pd.DataFrame:
+    rows = df.loc[mask, ["client_id", "scenario_id", "week"]]
+    return rows.assign(rule=rule, detail=detail[mask].astype(str))
+
+
+def _defects(
+    flagged: List[pd.DataFrame], stage: str, model: str, group: List[str]
+) -> pd.DataFrame:
+    """One defect row per work item and rule, with the number of rows and an example."""
+    flagged = [f for f in flagged if not f.empty]
+    if not flagged:
+        return pd.DataFrame(columns=DEFECT_COLUMNS)
+    df = (
+        pd.concat(flagged, ignore_index=True)
+        .groupby(group + ["rule"], sort=False, dropna=False)
+        .agg(count=("detail", "size"), detail=("detail", "first"))
+        .reset_index()
+    )
+    df["stage"] = stage
+    df["model"] = model
+    item_id = "client_id" if stage == "scenarios" else "scenario_id"
+    df["key"] = f"{stage}/{model}/" + df[item_id].astype(int).astype(str)
+    df = df.reindex(columns=DEFECT_COLUMNS)
+    return df.astype({"client_id": "Int64", "scenario_id": "Int64", "week": "Int64"})
+
+
+def expected_weeks(df_profiles: pd.DataFrame) -> pd.DataFrame:
+    """All (client_id, week) pairs from week 1 up to each client's duration."""
+    durations = df_profiles["duration"].fillna(0).clip(lower=0).astype(int).to_numpy()
+    offsets = np.repeat(np.cumsum(durations) - durations, durations)
+    return pd.DataFrame(
+        {
+            "client_id": np.repeat(df_profiles["client_id"].to_numpy(), durations),
+            "week": np.arange(durations.sum()) - offsets + 1,
+        }
+    )
+
+
+def naive_datetimes(values: pd.Series) -> pd.Series:
+    """
+    Parse datetimes as local wall-clock time.
+
+    A UTC offset is dropped rather than converted, so a mix of offset-aware and naive
+    values compares as the times written in the notes.
+    """
+    text = values.astype("string").str.strip()
+    text = text.str.replace(r"(?:Z|[+-]\d{2}:?\d{2})$", "", regex=True)
+    return pd.to_datetime(text, errors="coerce", format="mixed")
+
+
+def week_starts(df_scenarios: pd.DataFrame, df_profiles: pd.DataFrame) -> pd.DataFrame:
+    """Start date of each scenario week, as passed to the records prompt."""
+    df = df_scenarios[["scenario_id", "client_id", "week"]].merge(
+        df_profiles[["client_id", "start_date"]], on="client_id", how="left"
+    )
+    admission = naive_datetimes(df["start_date"]).dt.normalize()
+    df["week_start"] = admission + pd.to_timedelta((df["week"] - 1) * 7, unit="D")
+    return df.drop(columns="start_date")
+
+
+def check_scenarios(
+    df_scenarios: pd.DataFrame, df_profiles: pd.DataFrame, model: str
+) -> pd.DataFrame:
+    """
+    Check the scenarios of a model against the durations in the profiles.
+
+    Returns:
+        Defects, one row per client and rule, with DEFECT_COLUMNS
+    """
+    missing = expected_weeks(df_profiles).merge(
+        df_scenarios[["client_id", "week"]].drop_duplicates(),
+        on=["client_id", "week"],
+        how="left",
+        indicator=True,
+    )
+    missing = missing[missing["_merge"] == "left_only"]
+    flagged = [
+        missing.assign(
+            scenario_id=np.nan,
+            rule="missing_week",
+            detail="week " + missing["week"].astype(str),
+        )[_FLAGGED_COLUMNS]
+    ]
+
+    df = df_scenarios.merge(
+        df_profiles[["client_id", "duration"]], on="client_id", how="left"
+    )
+    week = "week " + df["week"].astype(str)
+    flagged += [
+        _flag(
+            df,
+            (df["week"] < 1) | (df["week"] > df["duration"]),
+            "week_out_of_range",
+            week,
+        ),
+        _flag(df, df.duplicated(["client_id", "week"]), "duplicate_week", week),
+        _flag(df, _is_empty(df["events_description"]), "empty_description", week),
+    ]
+    defects = _defects(flagged, "scenarios", model, ["client_id"])
+    # A scenario work item covers all weeks of a client
+    defects["scenario_id"] = pd.NA
+    defects["week"] = pd.NA
+    return defects
+
+
+def check_records(
+    df_records: pd.DataFrame,
+    df_scenarios: pd.DataFrame,
+    df_profiles: pd.DataFrame,
+    model: str,
+) -> pd.DataFrame:
+    """
+    Check the records of a model against the scenarios and profiles.
+
+    Returns:
+        Defects, one row per client week and rule, with DEFECT_COLUMNS
+    """
+    weeks = week_starts(df_scenarios, df_profiles)
+
+    # Weeks without exactly NOTES_PER_WEEK notes, including weeks without any notes
+    weeks["notes"] = (
+        df_records["scenario_id"]
+        .value_counts()
+        .reindex(weeks["scenario_id"], fill_value=0)
+        .to_numpy()
+    )
+    flagged = [
+        _flag(
+            weeks,
+            weeks["notes"] != NOTES_PER_WEEK,
+            "note_count",
+            weeks["notes"].astype(str) + f" notes, expected {NOTES_PER_WEEK}",
+        )
+    ]
+
+    df = df_records.merge(
+        weeks[["scenario_id", "week", "week_start"]], on="scenario_id", how="inner"
+    ).merge(
+        df_profiles[["client_id", "voornaam", "achternaam"]], on="client_id", how="left"
+    )
+    dates = naive_datetimes(df["date"])
+    outside = (dates < df["week_start"]) | (
+        dates >= df["week_start"] + pd.Timedelta(days=7)
+    )
+
+    # Whole-word search with the scanner of scan_names.py. The automaton makes one pass
+    # per note; the hits are then joined on (client_id, name) with the names of the
+    # note's own client, and the first own name per note is reported.
+    df_own = pd.DataFrame(
+        [
+            (client_id, name)
+            for client_id, voornaam, achternaam in df_profiles[
+                ["client_id", "voornaam", "achternaam"]
+            ].itertuples(index=False)
+            for name in name_variants(voornaam, achternaam)
+        ],
+        columns=["client_id", "name"],
+    )
+    scanner = NameScanner(df_own["name"])
+    df_hits = pd.DataFrame(
+        [
+            (row, name)
+            for row, note in df["note"].fillna("").astype(str).items()
+            for _, _, name in scanner.scan(note)
+        ],
+        columns=["row", "name"],
+    )
+    df_hits["client_id"] = df["client_id"].reindex(df_hits["row"]).to_numpy()
+    own_hits = df_hits.merge(df_own, on=["client_id", "name"]).drop_duplicates("row")
+    leaked = (
+        own_hits.set_index("row")["name"].reindex(df.index, fill_value="").fillna("")
+    )
+
+    note = df["note"].astype(str)
+    flagged += [
+        _flag(df, dates.isna(), "unparseable_date", df["date"]),
+        _flag(df, dates.notna() & outside, "date_outside_week", df["date"]),
+        _flag(df, leaked != "", "name_leak", leaked),
+        _flag(df, _is_empty(df["note"]), "empty_note", note),
+        _flag(df, df.duplicated(["scenario_id", "note"]), "duplicate_note", note),
+    ]
+    return _defects(flagged, "records", model, ["client_id", "scenario_id", "week"])
+
+
+def check_model(model: str, datapath: Path = DATA_PATH) -> pd.DataFrame:
+    """
+    Check the scenarios and records of a model, as far as they have been generated.
+
+    Returns:
+        Defects of both stages, with DEFECT_COLUMNS
+    """
+    fn_scenarios = datapath / f"scenarios_{model}.csv"
+    if not fn_scenarios.exists():
+        return pd.DataFrame(columns=DEFECT_COLUMNS)
+    df_profiles = pd.read_csv(datapath / f"profiles_{model}.csv")
+    df_scenarios = pd.read_csv(fn_scenarios)
+    defects = [check_scenarios(df_scenarios, df_profiles, model)]
+
+    fn_records = datapath / f"records_{model}.csv"
+    if fn_records.exists():
+        df_records = pd.read_csv(fn_records)
+        defects.append(check_records(df_records, df_scenarios, df_profiles, model))
+    return pd.concat([d for d in defects if not d.empty] or defects, ignore_index=True)
+
+
+def leak_defects(df_hits: pd.DataFrame, model: str, records_dir: Path) -> pd.DataFrame:
+    """
+    The hits in records_<model>.csv of records_dir as name_leak defects per client week.
+
+    Only names of other clients are reported, check_records already flags the names of
+    the note's own client.
+
+    Returns:
+        Defects with DEFECT_COLUMNS, to be regenerated by the quality gate
+    """
+    fn_records = records_dir / f"records_{model}.csv"
+    df_hits = df_hits[(df_hits["file"] == str(fn_records)) & ~df_hits["own"]]
+    if df_hits.empty:
+        return pd.DataFrame(columns=DEFECT_COLUMNS)
+    df_notes = pd.read_csv(fn_records, usecols=["note_id", "scenario_id"])
+    df = df_hits.merge(df_notes, on="note_id", how="left")
+    df = (
+        df.groupby(["client_id", "scenario_id"], sort=False)
+        .agg(count=("name", "size"), detail=("name", "first"))
+        .reset_index()
+    )
+    df["key"] = f"records/{model}/" + df["scenario_id"].astype(int).astype(str)
+    df["stage"] = "records"
+    df["model"] = model
+    df["week"] = pd.NA
+    df["rule"] = "name_leak"
+    df = df.reindex(columns=DEFECT_COLUMNS)
+    return df.astype({"client_id": "Int64", "scenario_id": "Int64", "week": "Int64"})
+
+
+def regenerate_keys(df_defects: pd.DataFrame, stage: str) -> List[str]:
+    """Keys of the work items of a stage with defects that regeneration can fix."""
+    mask = (df_defects["stage"] == stage) & df_defects["rule"].isin(
+        REGENERATE_RULES[stage]
+    )
+    return df_defects.loc[mask, "key"].drop_duplicates().tolist()
+
+
+def regenerate_items(
+    df_defects: pd.DataFrame,
+    row_models: pd.Series,
+    datapath: Path = DATA_PATH,
+    shard_dir: Path = None,
+) -> List[Dict[str, Any]]:
+    """
+    Work items to regenerate for a model, with the shards of earlier attempts removed.
+
+    Args:
+        df_defects: Defects of the model
+        row_models: The model's row in llm_models.csv
+        datapath: Directory with the data files
+        shard_dir: Shard directory of the workers that regenerate the items
+
+    Returns:
+        List of work items
+    """
+    items = []
+    for stage in REGENERATE_RULES:
+        keys = set(regenerate_keys(df_defects, stage))
+        if not keys:
+            continue
+        if stage == "scenarios":
+            items += _missing_week_items(row_models, keys, datapath)
+            continue
+        stage_items = build_work_items(stage, row_models.to_frame().T, datapath)
+        items += [item for item in stage_items if item["key"] in keys]
+    if shard_dir is not None:
+        # Never merge a result from before this round
+        for item in items:
+            path = shard_path(shard_dir, item)
+            if path.exists():
+                os.remove(path)
+    return items
+
+
+def _missing_week_items(
+    row_models: pd.Series, keys: set, datapath: Path
+) -> List[Dict[str, Any]]:
+    """Scenario items for only the missing weeks, with the existing weeks as context."""
+    provider, model = row_models["llm_provider"], row_models["llm_model"]
+    df_profiles = pd.read_csv(datapath / f"profiles_{model}.csv")
+    df_scenarios = pd.read_csv(datapath / f"scenarios_{model}.csv")
+    missing = expected_weeks(df_profiles).merge(
+        df_scenarios[["client_id", "week"]].drop_duplicates(),
+        on=["client_id", "week"],
+        how="left",
+        indicator=True,
+    )
+    missing = missing[missing["_merge"] == "left_only"]
+    items = []
+    for _, row_profiles in df_profiles.iterrows():
+        client_id = row_profiles["client_id"]
+        weeks = missing.loc[missing["client_id"] == client_id, "week"].tolist()
+        if not weeks or f"scenarios/{model}/{client_id}" not in keys:
+            continue
+        items.append(
+            scenario_item(
+                provider,
+                model,
+                row_profiles,
+                df_client_scenarios=df_scenarios[
+                    df_scenarios["client_id"] == client_id
+                ],
+                missing_weeks=weeks,
+            )
+        )
+    return items
+
+
+def _next_ids(ids: pd.Series, n: int) -> np.ndarray:
+    start = int(ids.max()) + 1 if not ids.empty else 1
+    return start + np.arange(n)
+
+
+def _read_shards(
+    shard_dir: Path, stage: str, model: str, keys: List[str]
+) -> pd.DataFrame:
+    paths = [
+        shard_path(shard_dir, {"key": key, "stage": stage, "model": model})
+        for key in keys
+    ]
+    frames = [pd.read_csv(path) for path in paths if path.exists()]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True).drop(columns="job_key")
+
+
+def merge_regenerated(
+    df_defects: pd.DataFrame,
+    model: str,
+    shard_dir: Path,
+    datapath: Path = DATA_PATH,
+) -> Dict[str, int]:
+    """
+    Merge the regenerated work items of a model back into its data files.
+
+    Records of a regenerated client week replace the old ones, with new note_ids after
+    the highest existing one. Missing scenario weeks are added with new scenario_ids;
+    existing weeks are kept, because records refer to them. Only the missing weeks are
+    asked for, but any other weeks in the response are dropped as well.
+
+    Returns:
+        Number of work items merged per stage
+    """
+    merged = {}
+
+    keys = regenerate_keys(df_defects, "scenarios")
+    df_new = _read_shards(shard_dir, "scenarios", model, keys)
+    if not df_new.empty:
+        fn_scenarios = datapath / f"scenarios_{model}.csv"
+        df_scenarios = pd.read_csv(fn_scenarios)
+        df_profiles = pd.read_csv(datapath / f"profiles_{model}.csv")
+        missing = expected_weeks(df_profiles).merge(
+            df_scenarios[["client_id", "week"]], how="left", indicator=True
+        )
+        missing = missing.loc[missing["_merge"] == "left_only", ["client_id", "week"]]
+        df_new = df_new.drop_duplicates(["client_id", "week"]).merge(missing)
+        df_new.insert(
+            0, "scenario_id", _next_ids(df_scenarios["scenario_id"], len(df_new))
+        )
+        df_scenarios = pd.concat([df_scenarios, df_new], ignore_index=True)
+        df_scenarios = df_scenarios.sort_values(["client_id", "week"], kind="stable")
+        df_scenarios.to_csv(fn_scenarios, index=False)
+        merged["scenarios"] = df_new["client_id"].nunique()
+
+    keys = regenerate_keys(df_defects, "records")
+    df_new = _read_shards(shard_dir, "records", model, keys)
+    if not df_new.empty:
+        fn_records = datapath / f"records_{model}.csv"
+        df_records = pd.read_csv(fn_records)
+        df_records = df_records[~df_records["scenario_id"].isin(df_new["scenario_id"])]
+        df_new.insert(0, "note_id", _next_ids(df_records["note_id"], len(df_new)))
+        df_records = pd.concat([df_records, df_new], ignore_index=True)
+        df_records = df_records.sort_values(["client_id", "scenario_id"], kind="stable")
+        df_records.to_csv(fn_records, index=False)
+        merged["records"] = df_new["scenario_id"].nunique()
+    return merged
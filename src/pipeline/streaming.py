@@ -0,0 +1,213 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from llm.failover import FailoverRouter
+from llm.wire_format import create_wire_completion
+from pipeline.work_items import (
+    RESPONSE_MODELS,
+    ROW_COLUMNS,
+    record_item,
+    result_rows,
+    scenario_item,
+)
+from tracing.spans import span
+
+"""
+Streaming Pipeline Module
+
+Runs the scenarios and records stages per client instead of stage by stage: as soon as
+the scenario of a client is generated, the records of its weeks are queued, while the
+scenarios of other clients are still being generated. Each stage has its own pool of
+threads, so its concurrency can be limited separately.
+
+Records of a week only depend on the scenario of that client, so the run takes about
+the critical path of a client (its scenario, then its slowest week) plus the time the
+stage pools are saturated, instead of the sum of both stages.
+
+The results are written in the same format as 03generate_scenarios.py and
+04generate_records.py. Each completion is appended to its file as soon as it resolves,
+with the next scenario_id or note_id, so an interrupted run loses only the calls in
+flight. A restart skips the clients that have a scenario and the weeks that have
+records.
+"""
+
+
+class StreamingPipeline:
+    """
+    Generates scenarios and records of one model, streaming clients between stages.
+
+    Attributes:
+        provider: The provider of the model
+        model: The model name
+        router: Router used for the completions of both stages
+        scenario_concurrency: Scenario completions running in parallel
+        record_concurrency: Record completions running in parallel
+        wire_format: "full" or "compact", see llm.wire_format
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        scenario_concurrency: int = 2,
+        record_concurrency: int = 6,
+        wire_format: str = "full",
+    ):
+        self.provider = provider
+        self.model = model
+        self.router = FailoverRouter(provider=provider, model=model)
+        self.scenario_concurrency = scenario_concurrency
+        self.record_concurrency = record_concurrency
+        self.wire_format = wire_format
+
+    def _complete(self, item: Dict) -> Tuple[List[tuple], float]:
+        """Run a work item, returns its rows and the latency of the call."""
+        start = time.perf_counter()
+        response_model, _ = create_wire_completion(
+            self.router,
+            response_model=RESPONSE_MODELS[item["stage"]],
+            messages=item["messages"],
+            wire_format=self.wire_format,
+            start_date=(
+                pd.to_datetime(item["start_date"]).date()
+                if item["stage"] == "records"
+                else None
+            ),
+            model=self.model,
+        )
+        rows = result_rows(item, response_model, self.router.last_endpoint)
+        return rows, time.perf_counter() - start
+
+    @staticmethod
+    def _append(fn: Path, df: pd.DataFrame) -> None:
+        """Append rows to a CSV file, with a header if the file is new."""
+        with span("persist", stage=fn.stem):
+            df.to_csv(fn, mode="a", header=not fn.exists(), index=False)
+
+    @staticmethod
+    def _read(fn: Path, id_column: str, stage: str) -> pd.DataFrame:
+        if not fn.exists():
+            return pd.DataFrame(columns=[id_column] + ROW_COLUMNS[stage])
+        return pd.read_csv(fn)
+
+    def run(
+        self, df_profiles: pd.DataFrame, fn_scenarios: Path, fn_records: Path
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Generate the scenarios and records of all clients, appending them to their files.
+
+        Clients that already have a scenario in fn_scenarios and weeks that already have
+        records in fn_records are not generated again. A client whose scenario fails is
+        skipped; a week whose records fail has no records. Both are reported and are
+        generated by the next run, or can be regenerated with the quality gate.
+
+        Args:
+            df_profiles: The client profiles, as stored in profiles_<model>.csv
+            fn_scenarios: The scenarios file, scenarios_<model>.csv
+            fn_records: The records file, records_<model>.csv
+
+        Returns:
+            Tuple of the scenarios and records DataFrames, as saved
+        """
+        df_scenarios = self._read(fn_scenarios, "scenario_id", "scenarios")
+        df_records = self._read(fn_records, "note_id", "records")
+        next_ids = {
+            "scenarios": (
+                int(df_scenarios["scenario_id"].max()) + 1
+                if not df_scenarios.empty
+                else 1
+            ),
+            "records": (
+                int(df_records["note_id"].max()) + 1 if not df_records.empty else 1
+            ),
+        }
+        done_weeks = set(df_records["scenario_id"])
+        profiles = {row["client_id"]: row for _, row in df_profiles.iterrows()}
+        notes = 0
+        critical_paths: Dict[int, float] = {}
+        slowest_week: Dict[int, float] = {}
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(
+            max_workers=self.scenario_concurrency
+        ) as scenario_pool, ThreadPoolExecutor(
+            max_workers=self.record_concurrency
+        ) as record_pool:
+            pending: Dict[Future, Tuple[str, int]] = {}
+
+            def queue_records(client_id: int, df_client: pd.DataFrame) -> None:
+                for _, row_scenario in df_client.iterrows():
+                    if row_scenario["scenario_id"] in done_weeks:
+                        continue
+                    item = record_item(
+                        self.provider,
+                        self.model,
+                        profiles[client_id],
+                        df_client,
+                        row_scenario,
+                        self.wire_format,
+                    )
+                    future = record_pool.submit(self._complete, item)
+                    pending[future] = ("records", client_id)
+
+            for client_id, row in profiles.items():
+                df_client = df_scenarios[df_scenarios["client_id"] == client_id]
+                if not df_client.empty:
+                    # Generated by an earlier run, only its missing weeks are queued
+                    queue_records(client_id, df_client)
+                    continue
+                item = scenario_item(self.provider, self.model, row, self.wire_format)
+                pending[scenario_pool.submit(self._complete, item)] = (
+                    "scenarios",
+                    client_id,
+                )
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, client_id = pending.pop(future)
+                    try:
+                        rows, latency = future.result()
+                    except Exception as e:
+                        print(
+                            f"{stage.capitalize()} of client {client_id} failed "
+                            f"({self.model}): {e}"
+                        )
+                        continue
+
+                    id_column = "scenario_id" if stage == "scenarios" else "note_id"
+                    df_rows = pd.DataFrame(rows, columns=ROW_COLUMNS[stage])
+                    first = next_ids[stage]
+                    next_ids[stage] += len(df_rows)
+                    df_rows.insert(0, id_column, range(first, first + len(df_rows)))
+                    self._append(
+                        fn_scenarios if stage == "scenarios" else fn_records, df_rows
+                    )
+
+                    if stage == "scenarios":
+                        critical_paths[client_id] = latency
+                        # Queue the records of this client right away
+                        queue_records(client_id, df_rows)
+                    else:
+                        notes += len(df_rows)
+                        slowest_week[client_id] = max(
+                            slowest_week.get(client_id, 0), latency
+                        )
+
+        wall_time = time.perf_counter() - start
+        critical_path = max(
+            (critical_paths[c] + slowest_week.get(c, 0) for c in critical_paths),
+            default=0,
+        )
+        print(
+            f"{self.model}: {notes} notes for {len(critical_paths)} new clients in "
+            f"{wall_time:.0f}s, critical path of one client {critical_path:.0f}s"
+        )
+        return (
+            self._read(fn_scenarios, "scenario_id", "scenarios"),
+            self._read(fn_records, "note_id", "records"),
+        )
@@ -0,0 +1,361 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+"""
+Dataset Versions Module
+
+Versions of the combined dataset (profiles, scenarios, records) as a base plus deltas.
+Every combined row gets a row_hash, a fingerprint of its content: a fixed set of
+columns per table, each formatted the same way whatever dtype it was read with, so a
+new provenance column or an int column read as float does not change every hash. A new
+version is compared with the previous one by joining on the row key (model and id) and
+comparing the hashes, so only the changed rows are written:
+
+    versions/v0001/manifest.json        version, parent, base, row counts and digests
+    versions/v0001/<table>_full.csv     the complete table, only in base versions
+    versions/v0002/<table>.csv          rows added or changed, with a change column
+    versions/v0002/<table>_removed.csv  keys of the rows removed
+
+A version is loaded from the last base before it and the deltas after that base. A
+consumer that has version N upserts and deletes the rows of changes_since(N).
+"""
+
+TABLE_KEYS = {
+    "profiles": ["model", "client_id"],
+    "scenarios": ["model", "scenario_id"],
+    "records": ["model", "note_id"],
+}
+
+# Content columns of the row_hash; columns missing from a table hash as empty
+HASH_COLUMNS = {
+    "profiles": [
+        "model",
+        "ward",
+        "client_id",
+        "geslacht",
+        "voornaam",
+        "achternaam",
+        "diagnose",
+        "somatiek",
+        "adl",
+        "mobiliteit",
+        "gedrag",
+        "start_date",
+        "duration",
+        "complications",
+        "bed",
+        "discharge_date",
+        "outcome",
+    ],
+    "scenarios": [
+        "model",
+        "scenario_id",
+        "client_id",
+        "week",
+        "date_start_of_week",
+        "events_description",
+    ],
+    "records": ["model", "note_id", "client_id", "scenario_id", "date", "note"],
+}
+
+ADDED, CHANGED, REMOVED = "added", "changed", "removed"
+
+
+def _hash_text(values: pd.Series) -> pd.Series:
+    """
+    A column as text for hashing: numbers with integral values without a decimal
+    part (3 and 3.0 are both "3"), other numbers in their shortest round-trip form,
+    missing values empty.
+    """
+    if pd.api.types.is_bool_dtype(values) or not pd.api.types.is_numeric_dtype(values):
+        return values.astype("string").fillna("")
+    numbers = values.astype(float)
+    text = pd.Series("", index=values.index, dtype="string")
+    integral = numbers.notna() & (numbers == numbers.round())
+    text[integral] = numbers[integral].astype("int64").astype(str)
+    other = numbers.notna() & ~integral
+    text[other] = numbers[other].map(repr)
+    return text
+
+
+def row_hashes(df: pd.DataFrame, table: str) -> pd.Series:
+    """Content hash per row of a table, as 16 hex characters, see HASH_COLUMNS."""
+    columns = sorted(HASH_COLUMNS[table])
+    values = pd.DataFrame(
+        {
+            column: (
+                _hash_text(df[column])
+                if column in df.columns
+                else pd.Series("", index=df.index, dtype="string")
+            )
+            for column in columns
+        },
+        index=df.index,
+    )
+    hashes = pd.util.hash_pandas_object(values, index=False)
+    return hashes.map("{:016x}".format)
+
+
+def digest(hashes: pd.Series) -> str:
+    """Digest of a table from its row hashes, independent of the row order."""
+    return hashlib.sha256("".join(sorted(hashes)).encode("ascii")).hexdigest()
+
+
+def list_versions(versions_dir: Path) -> List[int]:
+    """The versions in versions_dir, in order."""
+    if not versions_dir.exists():
+        return []
+    return sorted(int(p.parent.name[1:]) for p in versions_dir.glob("v*/manifest.json"))
+
+
+def read_manifest(versions_dir: Path, version: int) -> Dict:
+    """The manifest of a version."""
+    with open(versions_dir / f"v{version:04d}" / "manifest.json") as f:
+        return json.load(f)
+
+
+def diff_table(
+    df_old: pd.DataFrame, df_new: pd.DataFrame, keys: List[str]
+) -> pd.DataFrame:
+    """
+    Rows added, changed or removed between two versions of a table.
+
+    Args:
+        df_old: Keys and row_hash of the previous version
+        df_new: The complete new version, with row_hash
+        keys: Columns that identify a row
+
+    Returns:
+        The added and changed rows of df_new and the keys of the removed rows, with a
+        change column
+    """
+    joined = df_old[keys + ["row_hash"]].merge(
+        df_new[keys + ["row_hash"]].reset_index(),
+        on=keys,
+        how="outer",
+        suffixes=("_old", ""),
+        indicator=True,
+    )
+    added = joined.loc[joined["_merge"] == "right_only", "index"]
+    changed = joined.loc[
+        (joined["_merge"] == "both") & (joined["row_hash_old"] != joined["row_hash"]),
+        "index",
+    ]
+    removed = joined.loc[joined["_merge"] == "left_only", keys]
+    return pd.concat(
+        [
+            df_new.loc[added.astype(int)].assign(change=ADDED),
+            df_new.loc[changed.astype(int)].assign(change=CHANGED),
+            removed.assign(change=REMOVED),
+        ],
+        ignore_index=True,
+    )
+
+
+def write_version(
+    versions_dir: Path,
+    tables: Dict[str, pd.DataFrame],
+    previous: Optional[Dict[str, pd.DataFrame]] = None,
+    base: Optional[bool] = None,
+    base_ratio: float = 0.5,
+) -> Optional[int]:
+    """
+    Save the changes of the combined tables as a new version.
+
+    Args:
+        versions_dir: Directory of the versions
+        tables: The complete tables by name, with row_hash
+        previous: Keys and row_hash of the tables of the last version
+        base: Write the complete tables too; by default only for the first version and
+            when more than base_ratio of the rows changed since the last base
+        base_ratio: Fraction of changed rows after which a new base is written
+
+    Returns:
+        The new version, or None if nothing changed
+    """
+    versions = list_versions(versions_dir)
+    parent = versions[-1] if versions else None
+    if parent is not None and previous is None:
+        raise ValueError("The row hashes of the last version are needed for a delta")
+
+    deltas = {}
+    for name, df in tables.items():
+        keys = TABLE_KEYS[name]
+        if df.duplicated(keys).any():
+            raise ValueError(f"{name}: duplicate keys {keys}")
+        df_old = (
+            previous[name]
+            if parent is not None and name in previous
+            else pd.DataFrame(columns=keys + ["row_hash"])
+        )
+        deltas[name] = diff_table(df_old, df, keys)
+    if parent is not None and all(delta.empty for delta in deltas.values()):
+        return None
+
+    if base is None:
+        since_base = sum(len(delta) for delta in deltas.values())
+        version = parent
+        while version is not None:
+            manifest = read_manifest(versions_dir, version)
+            if manifest["base"]:
+                break
+            since_base += sum(t["changes"] for t in manifest["tables"].values())
+            version = manifest["parent"]
+        rows = sum(len(df) for df in tables.values())
+        base = parent is None or since_base > base_ratio * rows
+
+    version = (parent or 0) + 1
+    path = versions_dir / f"v{version:04d}"
+    tmp_path = versions_dir / f".v{version:04d}"
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    manifest = {
+        "version": version,
+        "parent": parent,
+        "base": base,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "tables": {},
+    }
+    for name, df in tables.items():
+        delta = deltas[name]
+        if parent is not None:
+            removed = delta["change"] == REMOVED
+            delta[~removed].to_csv(tmp_path / f"{name}.csv", index=False)
+            delta.loc[removed, TABLE_KEYS[name]].to_csv(
+                tmp_path / f"{name}_removed.csv", index=False
+            )
+        if base:
+            df.to_csv(tmp_path / f"{name}_full.csv", index=False)
+        counts = delta["change"].value_counts()
+        manifest["tables"][name] = {
+            "rows": len(df),
+            "digest": digest(df["row_hash"]),
+            "changes": len(delta),
+            **{
+                change: int(counts.get(change, 0))
+                for change in [ADDED, CHANGED, REMOVED]
+            },
+        }
+    with open(tmp_path / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    # The manifest marks a complete version, the rename makes it appear at once
+    os.replace(tmp_path, path)
+    return version
+
+
+def _read_delta(versions_dir: Path, version: int, name: str):
+    """
+    The rows added or changed and the keys removed in a version.
+
+    The first version has no delta, all rows of its base are added.
+    """
+    path = versions_dir / f"v{version:04d}"
+    if not (path / f"{name}.csv").exists():
+        df_full = pd.read_csv(path / f"{name}_full.csv", dtype={"row_hash": str})
+        return df_full.assign(change=ADDED), df_full[TABLE_KEYS[name]].iloc[:0]
+    return (
+        pd.read_csv(path / f"{name}.csv", dtype={"row_hash": str}),
+        pd.read_csv(path / f"{name}_removed.csv"),
+    )
+
+
+def _key_index(df: pd.DataFrame, keys: List[str]) -> pd.MultiIndex:
+    return pd.MultiIndex.from_frame(df[keys].astype(str))
+
+
+def _apply(
+    df: pd.DataFrame, upserts: pd.DataFrame, removed: pd.DataFrame, keys: List[str]
+) -> pd.DataFrame:
+    """Remove the changed and removed keys, then append the added and changed rows."""
+    dropped = _key_index(upserts, keys).append(_key_index(removed, keys))
+    keep = ~_key_index(df, keys).isin(dropped)
+    upserts = upserts.drop(columns="change").reindex(columns=df.columns)
+    return pd.concat([df[keep], upserts], ignore_index=True)
+
+
+def load_version(
+    versions_dir: Path, version: Optional[int] = None, verify: bool = True
+) -> Dict[str, pd.DataFrame]:
+    """
+    The tables of a version, from the last base before it plus the deltas after that.
+
+    Args:
+        versions_dir: Directory of the versions
+        version: Version to load, defaults to the last
+        verify: Check the row counts and digests against the manifest
+
+    Returns:
+        The tables by name; changed rows are moved to the end
+    """
+    versions = list_versions(versions_dir)
+    if not versions:
+        raise FileNotFoundError(f"No versions in {versions_dir}")
+    version = version or versions[-1]
+    chain = [version]
+    while not read_manifest(versions_dir, chain[-1])["base"]:
+        chain.append(read_manifest(versions_dir, chain[-1])["parent"])
+    base = chain.pop()
+
+    manifest = read_manifest(versions_dir, version)
+    tables = {}
+    for name in manifest["tables"]:
+        df = pd.read_csv(
+            versions_dir / f"v{base:04d}" / f"{name}_full.csv",
+            dtype={"row_hash": str},
+        )
+        for delta_version in reversed(chain):
+            upserts, removed = _read_delta(versions_dir, delta_version, name)
+            df = _apply(df, upserts, removed, TABLE_KEYS[name])
+        expected = manifest["tables"][name]
+        if verify and (
+            len(df) != expected["rows"] or digest(df["row_hash"]) != expected["digest"]
+        ):
+            raise ValueError(f"{name} of version {version} does not match its manifest")
+        tables[name] = df
+    return tables
+
+
+def changes_since(
+    versions_dir: Path, since: int, until: Optional[int] = None
+) -> Dict[str, Tuple[pd.DataFrame, pd.DataFrame]]:
+    """
+    The net changes per table from version since to version until (default the last).
+
+    Only the deltas are read, per key the last change counts.
+
+    Returns:
+        Per table the rows to upsert (with a change column) and the keys to delete
+    """
+    versions = [
+        v for v in list_versions(versions_dir) if since < v <= (until or float("inf"))
+    ]
+    deltas: Dict[str, List] = {}
+    for version in versions:
+        for name in read_manifest(versions_dir, version)["tables"]:
+            deltas.setdefault(name, []).append(_read_delta(versions_dir, version, name))
+
+    changes = {}
+    for name, pairs in deltas.items():
+        keys = TABLE_KEYS[name]
+        last = pd.concat(
+            [
+                frame[keys].assign(change=change)
+                for upserts, removed in pairs
+                for frame, change in [(upserts, ADDED), (removed, REMOVED)]
+            ],
+            ignore_index=True,
+        ).drop_duplicates(keys, keep="last")
+        removed_keys = _key_index(last[last["change"] == REMOVED], keys)
+        upserts = pd.concat([u for u, _ in pairs], ignore_index=True)
+        upserts = upserts.drop_duplicates(keys, keep="last")
+        upserts = upserts[~_key_index(upserts, keys).isin(removed_keys)]
+        changes[name] = (
+            upserts.reset_index(drop=True),
+            last.loc[last["change"] == REMOVED, keys].reset_index(drop=True),
+        )
+    return changes
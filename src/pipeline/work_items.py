@@ -0,0 +1,323 @@
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+import pandas as pd
+from jinja2 import Environment, FileSystemLoader
+from pydantic import BaseModel
+
+from prompts.category_notes_data import input_data_list
+from prompts.category_notes_rm import Note
+from prompts.generate_records_rm import ClientRecord
+from prompts.generate_scenarios_rm import ClientScenarios
+from tracing.spans import span
+
+"""
+Work Items Module
+
+A work item is a single LLM call of a generation stage, with its prompt fully rendered:
+- scenarios: one item per client profile (03generate_scenarios.py)
+- records: one item per client week (04generate_records.py)
+- notes: one item per category and completion (06category_notes.py)
+
+Items are plain dictionaries so they can be stored in a job queue and processed by any
+worker. result_rows converts a completion into the rows the stage writes to its CSV file.
+"""
+
+DATA_PATH = Path(__file__).resolve().parents[2] / "data"
+PROMPTS_PATH = Path(__file__).resolve().parents[1] / "prompts"
+
+RESPONSE_MODELS: Dict[str, Type[BaseModel]] = {
+    "scenarios": ClientScenarios,
+    "records": ClientRecord,
+    "notes": Note,
+}
+
+# Columns of the rows produced per stage, before the stage's id column is added
+ROW_COLUMNS: Dict[str, List[str]] = {
+    "scenarios": [
+        "client_id",
+        "week",
+        "date_start_of_week",
+        "events_description",
+        "served_provider",
+        "served_model",
+    ],
+    "records": [
+        "client_id",
+        "scenario_id",
+        "date",
+        "note",
+        "served_provider",
+        "served_model",
+    ],
+    "notes": ["category", "note", "model", "served_provider", "served_model"],
+}
+
+
+@lru_cache
+def get_template_env() -> Environment:
+    """Get the Jinja2 environment for the prompt templates, templates are compiled once."""
+    return Environment(loader=FileSystemLoader(PROMPTS_PATH))
+
+
+def render_messages(template: str, **kwargs) -> List[Dict[str, str]]:
+    """
+    Render the system and user prompt of a template pair into a list of messages.
+
+    Args:
+        template: Template name without suffix, e.g. "generate_records"
+        **kwargs: Variables for the user prompt
+
+    Returns:
+        List of message dictionaries
+    """
+    env = get_template_env()
+    with span("render", template=template):
+        system_prompt = env.get_template(f"{template}_s.jinja").render()
+        user_prompt = env.get_template(f"{template}_u.jinja").render(**kwargs)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def format_naam(row: pd.Series) -> str:
+    titel = "Mevrouw" if row["geslacht"] == "v" else "Meneer"
+    return f"{titel} {row['voornaam']} {row['achternaam']}"
+
+
+def format_client_profile(row: pd.Series) -> str:
+    return (
+        f"Naam: {format_naam(row)}\n"
+        f"Diagnose: {row['diagnose']}\n"
+        f"Lichamelijke klachten: {row['somatiek']}\n"
+        f"ADL: {row['adl']}\n"
+        f"Mobiliteit: {row['mobiliteit']}\n"
+        f"Gedrag: {row['gedrag']}"
+    )
+
+
+def scenario_item(
+    provider: str,
+    model: str,
+    row_profiles: pd.Series,
+    wire_format: str = "full",
+    df_client_scenarios: Optional[pd.DataFrame] = None,
+    missing_weeks: Optional[List[int]] = None,
+) -> Dict[str, Any]:
+    """
+    Work item for the scenario of one client profile.
+
+    With missing_weeks, only those weeks are asked for and the client's existing
+    scenario weeks (df_client_scenarios) are passed as context, so the new weeks
+    continue the same storyline.
+    """
+    sex = row_profiles["geslacht"]
+    existing_scenario = None
+    if missing_weeks:
+        existing_scenario = "\n".join(
+            f"Week {week}: {description}"
+            for week, description in df_client_scenarios.sort_values("week")[
+                ["week", "events_description"]
+            ].itertuples(index=False)
+        )
+    messages = render_messages(
+        "generate_scenarios",
+        client_profile=format_client_profile(row_profiles),
+        num_weeks=row_profiles["duration"],
+        zijn_haar="haar" if sex == "v" else "zijn",
+        complications=row_profiles["complications"],
+        dhr_mw="mw." if sex == "v" else "dhr.",
+        outcome=row_profiles.get("outcome"),
+        existing_scenario=existing_scenario,
+        missing_weeks=", ".join(map(str, missing_weeks)) if missing_weeks else None,
+    )
+    return {
+        "stage": "scenarios",
+        "key": f"scenarios/{model}/{row_profiles['client_id']}",
+        "provider": provider,
+        "model": model,
+        "client_id": int(row_profiles["client_id"]),
+        "start_date": str(pd.to_datetime(row_profiles["start_date"])),
+        "wire_format": wire_format,
+        "messages": messages,
+    }
+
+
+def record_item(
+    provider: str,
+    model: str,
+    row_profiles: pd.Series,
+    df_profile_scenarios: pd.DataFrame,
+    row_profile_scenarios: pd.Series,
+    wire_format: str = "full",
+) -> Dict[str, Any]:
+    """Work item for the records of one client week."""
+    current_week = row_profile_scenarios["week"]
+    past_scenario = "\n".join(
+        df_profile_scenarios[df_profile_scenarios["week"] < current_week][
+            "events_description"
+        ].tolist()
+    )
+    admission_date = pd.to_datetime(row_profiles["start_date"])
+    start_date = (admission_date + pd.Timedelta(weeks=(current_week - 1))).date()
+    sex = row_profiles["geslacht"]
+    messages = render_messages(
+        "generate_records",
+        client_profile=format_client_profile(row_profiles),
+        weekno=current_week - 1,
+        events_description=past_scenario,
+        scenario=row_profile_scenarios["events_description"],
+        start_date=start_date,
+        dhr_mw="mw." if sex == "v" else "dhr.",
+        compact=wire_format == "compact",
+    )
+    return {
+        "stage": "records",
+        "key": f"records/{model}/{row_profile_scenarios['scenario_id']}",
+        "provider": provider,
+        "model": model,
+        "client_id": int(row_profiles["client_id"]),
+        "scenario_id": int(row_profile_scenarios["scenario_id"]),
+        "week": int(current_week),
+        "start_date": str(start_date),
+        "wire_format": wire_format,
+        "messages": messages,
+    }
+
+
+def note_item(
+    provider: str,
+    model: str,
+    input_data: Dict[str, str],
+    num_notes: int,
+    completion: int = 0,
+) -> Dict[str, Any]:
+    """Work item for one completion of category notes."""
+    messages = render_messages(
+        "category_notes",
+        num_notes=num_notes,
+        category=input_data["category"],
+        note_topics=input_data["note_topics"],
+        examples=input_data["examples"],
+    )
+    return {
+        "stage": "notes",
+        "key": f"notes/{model}/{input_data['cat']}/{completion}",
+        "provider": provider,
+        "model": model,
+        "cat": input_data["cat"],
+        "messages": messages,
+    }
+
+
+def build_work_items(
+    stage: str,
+    df_models: pd.DataFrame,
+    datapath: Path = DATA_PATH,
+    num_notes: int = 50,
+    num_completions: int = 1,
+    wire_format: str = "full",
+) -> List[Dict[str, Any]]:
+    """
+    Build all work items of a stage from the data files, as the stage script would process them.
+
+    Args:
+        stage: "scenarios", "records" or "notes"
+        df_models: The LLM models, as stored in llm_models.csv
+        datapath: Directory with the profiles_<model>.csv and scenarios_<model>.csv files
+        num_notes: Number of notes per completion (notes stage)
+        num_completions: Number of completions per category (notes stage)
+        wire_format: "full" or "compact" (scenarios and records stages)
+
+    Returns:
+        List of work items
+    """
+    if stage not in RESPONSE_MODELS:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    items = []
+    for _, row_models in df_models.iterrows():
+        provider = row_models["llm_provider"]
+        model = row_models["llm_model"]
+
+        if stage == "notes":
+            for input_data in input_data_list:
+                for completion in range(num_completions):
+                    items.append(
+                        note_item(provider, model, input_data, num_notes, completion)
+                    )
+            continue
+
+        df_profiles = pd.read_csv(datapath / f"profiles_{model}.csv")
+        if stage == "scenarios":
+            for _, row_profiles in df_profiles.iterrows():
+                items.append(scenario_item(provider, model, row_profiles, wire_format))
+            continue
+
+        df_scenarios = pd.read_csv(datapath / f"scenarios_{model}.csv")
+        for _, row_profiles in df_profiles.iterrows():
+            df_profile_scenarios = df_scenarios[
+                df_scenarios["client_id"] == row_profiles["client_id"]
+            ]
+            for _, row_profile_scenarios in df_profile_scenarios.iterrows():
+                items.append(
+                    record_item(
+                        provider,
+                        model,
+                        row_profiles,
+                        df_profile_scenarios,
+                        row_profile_scenarios,
+                        wire_format,
+                    )
+                )
+    return items
+
+
+def result_rows(
+    item: Dict[str, Any],
+    response_model: BaseModel,
+    endpoint: Optional[Tuple[str, str]] = None,
+) -> List[tuple]:
+    """
+    Convert the parsed completion of a work item into the rows of its stage.
+
+    Args:
+        item: The work item
+        response_model: The parsed completion
+        endpoint: The (provider, model) that served the request, defaults to the item's
+
+    Returns:
+        List of row tuples, matching ROW_COLUMNS for the stage
+    """
+    served_provider, served_model = endpoint or (item["provider"], item["model"])
+    if item["stage"] == "scenarios":
+        start_date = pd.to_datetime(item["start_date"])
+        return [
+            (
+                item["client_id"],
+                scenario.week,
+                start_date + pd.Timedelta(weeks=scenario.week),
+                scenario.events_description,
+                served_provider,
+                served_model,
+            )
+            for scenario in response_model.scenario
+        ]
+    if item["stage"] == "records":
+        return [
+            (
+                item["client_id"],
+                item["scenario_id"],
+                record.date,
+                record.note,
+                served_provider,
+                served_model,
+            )
+            for record in response_model.record
+        ]
+    return [
+        (item["cat"], note, item["model"], served_provider, served_model)
+        for note in response_model.note
+    ]
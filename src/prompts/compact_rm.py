@@ -0,0 +1,113 @@
+from datetime import date, datetime, timedelta
+from typing import List
+
+from pydantic import BaseModel, ConfigDict, Field
+
+from prompts.generate_profiles_rm import ClientProfile, ClientProfiles
+from prompts.generate_records_rm import ClientRecord, NursesNote
+from prompts.generate_scenarios_rm import ClientScenario, ClientScenarios
+
+
+# Compact wire format of the response models: short JSON keys (aliases) and short
+# descriptions to save output tokens. After parsing, expand() converts a compact
+# model into the regular response model.
+class CompactModel(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+
+class CompactClientProfile(CompactModel):
+    geslacht: str = Field(alias="g", description="m/v")
+    voornaam: str = Field(alias="vn", description="ongebruikelijke voornaam")
+    achternaam: str = Field(alias="an", description="ongebruikelijke achternaam")
+    diagnose: str = Field(alias="dx", description="hoofddiagnose")
+    somatiek: str = Field(alias="so", description="lichamelijke klachten")
+    adl: str = Field(alias="adl", description="benodigde ADL hulp")
+    mobiliteit: str = Field(alias="mo", description="mobiliteit")
+    gedrag: str = Field(alias="ge", description="cognitie en gedrag")
+
+
+class CompactClientProfiles(CompactModel):
+    clients: List[CompactClientProfile] = Field(alias="c")
+
+    @classmethod
+    def from_full(cls, profiles: ClientProfiles) -> "CompactClientProfiles":
+        return cls(
+            clients=[CompactClientProfile(**c.model_dump()) for c in profiles.clients]
+        )
+
+    def expand(self) -> ClientProfiles:
+        return ClientProfiles(
+            clients=[ClientProfile(**c.model_dump()) for c in self.clients]
+        )
+
+
+class CompactClientScenario(CompactModel):
+    week: int = Field(alias="w", description="weeknummer")
+    events_description: str = Field(alias="e", description="korte beschrijving")
+
+
+class CompactClientScenarios(CompactModel):
+    scenario: List[CompactClientScenario] = Field(alias="s")
+
+    @classmethod
+    def from_full(cls, scenarios: ClientScenarios) -> "CompactClientScenarios":
+        return cls(
+            scenario=[
+                CompactClientScenario(**s.model_dump()) for s in scenarios.scenario
+            ]
+        )
+
+    def expand(self) -> ClientScenarios:
+        return ClientScenarios(
+            scenario=[ClientScenario(**s.model_dump()) for s in self.scenario]
+        )
+
+
+class CompactNursesNote(CompactModel):
+    day: int = Field(alias="d", ge=0, le=6, description="dag, 0 = startdatum")
+    time: str = Field(
+        alias="t", pattern=r"^([01]?\d|2[0-3]):[0-5]\d$", description="UU:MM"
+    )
+    note: str = Field(alias="n", description="rapportage")
+
+
+class CompactClientRecord(CompactModel):
+    record: List[CompactNursesNote] = Field(alias="r")
+
+    @classmethod
+    def from_full(cls, record: ClientRecord, start_date: date) -> "CompactClientRecord":
+        """Express the datetimes of a record relative to the start of the week."""
+        start = datetime.combine(start_date, datetime.min.time())
+        notes = []
+        for note in record.record:
+            offset = note.date - start
+            minutes = offset.seconds // 60
+            notes.append(
+                CompactNursesNote(
+                    day=offset.days,
+                    time=f"{minutes // 60:02d}:{minutes % 60:02d}",
+                    note=note.note,
+                )
+            )
+        return cls(record=notes)
+
+    def expand(self, start_date: date) -> ClientRecord:
+        """Convert day offsets and times relative to the start of the week into datetimes."""
+        start = datetime.combine(start_date, datetime.min.time())
+        notes = []
+        for note in self.record:
+            hours, minutes = (int(part) for part in note.time.split(":"))
+            notes.append(
+                NursesNote(
+                    date=start + timedelta(days=note.day, hours=hours, minutes=minutes),
+                    note=note.note,
+                )
+            )
+        return ClientRecord(record=notes)
+
+
+COMPACT_MODELS = {
+    ClientProfiles: CompactClientProfiles,
+    ClientScenarios: CompactClientScenarios,
+    ClientRecord: CompactClientRecord,
+}
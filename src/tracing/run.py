@@ -0,0 +1,37 @@
+import argparse
+import runpy
+import sys
+from pathlib import Path
+
+from tracing.profiler import SamplingProfiler
+from tracing.spans import enable_tracing
+
+"""
+Run a script with tracing and, optionally, the sampling profiler.
+
+Usage:
+    python -m tracing.run --trace trace.json --profile run.folded scripts/04generate_records.py
+
+The trace opens in chrome://tracing or https://ui.perfetto.dev, the collapsed stacks in
+https://www.speedscope.app or with flamegraph.pl.
+"""
+
+parser = argparse.ArgumentParser(description="Run a script with tracing")
+parser.add_argument("--trace", type=Path, default=Path("trace.json"))
+parser.add_argument("--profile", type=Path, help="Write sampled stacks to this file")
+parser.add_argument("--interval", type=float, default=0.005, help="Sampling interval")
+parser.add_argument("script", type=Path)
+parser.add_argument("args", nargs=argparse.REMAINDER)
+args = parser.parse_args()
+
+enable_tracing(args.trace)
+profiler = SamplingProfiler(args.interval).start() if args.profile else None
+
+sys.argv = [str(args.script)] + args.args
+try:
+    runpy.run_path(str(args.script), run_name="__main__")
+finally:
+    if profiler is not None:
+        profiler.stop()
+        profiler.export(args.profile)
+        print(f"Profile saved to {args.profile}.")
@@ -0,0 +1,155 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+"""
+Tracing Module
+
+Lightweight spans around the phases of a work item: render, request, parse (instructor
+validation) and persist. Spans are kept in memory and exported as a Chrome trace
+(JSON), which can be opened in chrome://tracing or https://ui.perfetto.dev.
+
+Tracing is off by default, and a disabled span is a shared no-op context manager.
+Enable it with the GENCARE_TRACE environment variable (path of the trace file), with
+enable_tracing(), or by running a script through `python -m tracing.run`.
+"""
+
+_NOOP = nullcontext()
+_local = threading.local()
+
+
+class Tracer:
+    """Collects spans as Chrome trace complete events."""
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.pid = os.getpid()
+        self._origin = time.perf_counter()
+
+    def add(self, name: str, start: float, end: float, **attrs) -> None:
+        # list.append is atomic, no lock needed
+        self.events.append(
+            {
+                "name": name,
+                "cat": attrs.pop("cat", "gencare"),
+                "ph": "X",
+                "ts": (start - self._origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+                "args": attrs,
+            }
+        )
+
+    def export(self, path: Path) -> None:
+        """Write the spans as a Chrome trace file."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"traceEvents": self.events, "displayTimeUnit": "ms"}, f, default=str
+            )
+
+    def summary(self) -> str:
+        """Total and mean duration per span name."""
+        totals = defaultdict(lambda: [0, 0.0])
+        for event in self.events:
+            totals[event["name"]][0] += 1
+            totals[event["name"]][1] += event["dur"] / 1e6
+        lines = [f"{'span':<20}{'count':>8}{'total s':>12}{'mean ms':>12}"]
+        for name, (count, total) in sorted(totals.items(), key=lambda t: -t[1][1]):
+            lines.append(
+                f"{name:<20}{count:>8}{total:>12.2f}{total / count * 1e3:>12.1f}"
+            )
+        return "\n".join(lines)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    """The active tracer, None if tracing is disabled."""
+    return _tracer
+
+
+def enable_tracing(path: Optional[Path] = None) -> Tracer:
+    """
+    Enable tracing for this process.
+
+    Args:
+        path: If given, the trace is written to this file at exit and a summary is printed
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+        if path is not None:
+            atexit.register(_export_at_exit, _tracer, Path(path))
+    return _tracer
+
+
+def _export_at_exit(tracer: Tracer, path: Path) -> None:
+    tracer.export(path)
+    print(tracer.summary())
+    print(f"Trace saved to {path}.")
+
+
+@contextmanager
+def _span(tracer: Tracer, name: str, attrs: Dict[str, Any]):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.add(name, start, time.perf_counter(), **attrs)
+
+
+def span(name: str, **attrs):
+    """
+    Context manager that records a span, a no-op when tracing is disabled.
+
+    Example:
+        with span("render", model=model):
+            user_prompt = u_template.render(...)
+    """
+    if _tracer is None:
+        return _NOOP
+    return _span(_tracer, name, attrs)
+
+
+def trace_client(client: Any) -> None:
+    """Register a hook on an instructor client that marks when the response arrived."""
+    if _tracer is None or getattr(client, "_gencare_traced", False):
+        return
+    client.on("completion:response", _mark_response)
+    client._gencare_traced = True
+
+
+def _mark_response(*args, **kwargs) -> None:
+    _local.response_time = time.perf_counter()
+
+
+def traced_completion(fn: Callable[[], Any], **attrs) -> Any:
+    """
+    Run a completion, recording a request span and a parse span.
+
+    The split point is the moment the last response arrived (see trace_client); the
+    parse span covers instructor's parsing and validation of that response.
+    """
+    if _tracer is None:
+        return fn()
+    _local.response_time = None
+    start = time.perf_counter()
+    try:
+        return fn()
+    finally:
+        end = time.perf_counter()
+        response_time = _local.response_time or end
+        _tracer.add("request", start, response_time, **attrs)
+        _tracer.add("parse", response_time, end, **attrs)
+
+
+if os.getenv("GENCARE_TRACE"):
+    enable_tracing(os.getenv("GENCARE_TRACE"))
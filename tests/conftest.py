@@ -0,0 +1,24 @@
+import os
+import sys
+from pathlib import Path
+
+# The modules live in src/ as namespace packages, as when running the scripts
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+# The settings require credentials, the tests never call a provider
+for name in ["AZURE_OPENAI_API_KEY", "ANTHROPIC_API_KEY", "OPENAI_API_KEY"]:
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "https://localhost")
+
+
+class Clock:
+    """A manual clock to replace time.time or time.monotonic."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
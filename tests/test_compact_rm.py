@@ -0,0 +1,36 @@
+from datetime import date, datetime
+
+import pytest
+from pydantic import ValidationError
+
+from prompts.compact_rm import CompactClientRecord, CompactNursesNote
+
+
+@pytest.mark.parametrize("time", ["00:00", "7:05", "09:30", "19:59", "23:59"])
+def test_valid_times(time):
+    assert CompactNursesNote(d=0, t=time, n="Rustig").time == time
+
+
+@pytest.mark.parametrize("time", ["24:00", "29:10", "12:60", "7:5", "12:3O", "1230"])
+def test_invalid_times(time):
+    with pytest.raises(ValidationError):
+        CompactNursesNote(d=0, t=time, n="Rustig")
+
+
+@pytest.mark.parametrize("day", [-1, 7])
+def test_day_outside_the_week(day):
+    with pytest.raises(ValidationError):
+        CompactNursesNote(d=day, t="08:00", n="Rustig")
+
+
+def test_expand_round_trip():
+    record = CompactClientRecord(
+        r=[{"d": 0, "t": "7:15", "n": "Ontbijt"}, {"d": 6, "t": "23:59", "n": "Slaapt"}]
+    )
+    full = record.expand(date(2024, 1, 8))
+    assert [note.date for note in full.record] == [
+        datetime(2024, 1, 8, 7, 15),
+        datetime(2024, 1, 14, 23, 59),
+    ]
+    compact = CompactClientRecord.from_full(full, date(2024, 1, 8))
+    assert [(n.day, n.time) for n in compact.record] == [(0, "07:15"), (6, "23:59")]
@@ -0,0 +1,70 @@
+import pytest
+from conftest import Clock
+
+from llm import failover
+from llm.failover import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(failover.time, "monotonic", clock)
+    return clock
+
+
+def test_opens_after_failure_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, recovery_time=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+
+
+def test_success_resets_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=2, recovery_time=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_single_probe_after_recovery_time(clock):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_time=60)
+    breaker.record_failure()
+    clock.advance(59)
+    assert not breaker.allow_request()
+
+    clock.advance(1)
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    # Other requests keep failing over while the probe runs
+    assert not breaker.allow_request()
+
+
+def test_probe_success_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_time=60)
+    breaker.record_failure()
+    clock.advance(60)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+    assert breaker.allow_request()
+
+
+def test_probe_failure_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=3, recovery_time=60)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.advance(60)
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    clock.advance(60)
+    assert breaker.allow_request()
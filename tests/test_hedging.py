@@ -0,0 +1,62 @@
+import itertools
+import time
+
+from llm.hedging import HedgePolicy
+
+KEY = ("openai", "gpt-4o-mini", "ClientRecord")
+
+
+def policy(threshold: float, max_workers: int = 2) -> HedgePolicy:
+    hedge_policy = HedgePolicy(min_samples=1, budget=1.0, max_workers=max_workers)
+    hedge_policy.tracker.observe(KEY, threshold)
+    return hedge_policy
+
+
+def test_queue_time_does_not_count_towards_threshold():
+    hedge_policy = policy(threshold=0.2)
+    # Occupy all threads, the primary call waits longer than the threshold to start
+    for _ in range(2):
+        hedge_policy._executor.submit(time.sleep, 0.4)
+
+    def call():
+        time.sleep(0.05)
+        return "result"
+
+    assert hedge_policy.run(KEY, call) == "result"
+    assert hedge_policy.hedged == 0
+
+
+def test_running_loser_is_paid_for():
+    hedge_policy = policy(threshold=0.05)
+    calls = itertools.count()
+
+    def call():
+        if next(calls) == 0:
+            time.sleep(0.3)
+            return "primary"
+        return "hedge"
+
+    assert hedge_policy.run(KEY, call) == "hedge"
+    hedge_policy._executor.shutdown(wait=True)
+    report = hedge_policy.report()
+    assert report["hedged"] == 1
+    assert report["hedge_wins"] == 1
+    assert report["duplicates_paid"] == 1
+    assert report["latency_saved_s"] > 0
+
+
+def test_queued_loser_is_cancelled_without_cost():
+    hedge_policy = policy(threshold=0.05, max_workers=1)
+
+    def call():
+        # Keeps the only thread busy after the primary call, ahead of the hedge
+        hedge_policy._executor.submit(time.sleep, 0.3)
+        time.sleep(0.1)
+        return "result"
+
+    # The only thread runs the primary call, the hedge is cancelled before it starts
+    assert hedge_policy.run(KEY, call) == "result"
+    report = hedge_policy.report()
+    assert report["hedged"] == 1
+    assert report["hedge_wins"] == 0
+    assert report["duplicates_paid"] == 0
@@ -0,0 +1,76 @@
+import pytest
+from conftest import Clock
+
+from jobs import job_queue
+from jobs.job_queue import DONE, FAILED, LEASED, PENDING, SQLiteJobQueue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_queue.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = SQLiteJobQueue(str(tmp_path / "queue.db"), max_attempts=2)
+    queue.enqueue([{"key": "records/m/1", "stage": "records"}])
+    return queue
+
+
+def test_leased_job_is_not_handed_out_twice(queue):
+    job = queue.lease("w1", lease_seconds=30)
+    assert job.job_id == "records/m/1"
+    assert job.attempts == 1
+    assert queue.lease("w2", lease_seconds=30) is None
+
+
+def test_expired_lease_is_leased_again(queue, clock):
+    queue.lease("w1", lease_seconds=30)
+    clock.advance(31)
+
+    job = queue.lease("w2", lease_seconds=30)
+    assert job.job_id == "records/m/1"
+    assert job.attempts == 2
+    # The first worker lost its lease and can no longer extend or acknowledge it
+    assert not queue.heartbeat(job.job_id, "w1", 30)
+    assert not queue.ack(job.job_id, "w1")
+    assert queue.ack(job.job_id, "w2")
+    assert queue.counts()[DONE] == 1
+
+
+def test_heartbeat_extends_lease(queue, clock):
+    job = queue.lease("w1", lease_seconds=30)
+    clock.advance(20)
+    assert queue.heartbeat(job.job_id, "w1", 30)
+    clock.advance(20)
+    assert queue.lease("w2", lease_seconds=30) is None
+    assert queue.counts()[LEASED] == 1
+
+
+def test_expired_last_attempt_fails(queue, clock):
+    queue.lease("w1", lease_seconds=30)
+    clock.advance(31)
+    queue.lease("w2", lease_seconds=30)
+    clock.advance(31)
+
+    assert queue.lease("w3", lease_seconds=30) is None
+    counts = queue.counts()
+    assert counts[FAILED] == 1
+    assert counts.get(PENDING, 0) == 0
+
+
+def test_requeue_replaces_the_payload(queue):
+    key = "scenarios/m/1"
+    for missing_weeks in [[2, 3], [3]]:
+        # A repair round: queue the item with its new prompt, then process it
+        queue.requeue([{"key": key, "stage": "scenarios", "weeks": missing_weeks}])
+        job = queue.lease("w1", lease_seconds=30)
+        while job.job_id != key:
+            queue.ack(job.job_id, "w1")
+            job = queue.lease("w1", lease_seconds=30)
+        assert job.payload["weeks"] == missing_weeks
+        assert job.attempts == 1
+        assert queue.ack(job.job_id, "w1")
+    assert queue.lease("w1", lease_seconds=30) is None
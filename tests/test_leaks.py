@@ -0,0 +1,65 @@
+import pandas as pd
+
+from pipeline.leaks import NameScanner, name_variants, redact_file
+from pipeline.versions import row_hashes
+
+
+def names(hits):
+    return [name for _, _, name in hits]
+
+
+def test_matches_whole_words_only():
+    scanner = NameScanner(["Jan", "Berg"])
+    assert scanner.scan("In januari naar de Bergen, Janssen belde.") == []
+    assert names(scanner.scan("Jan ging naar de berg.")) == ["Jan", "Berg"]
+
+
+def test_offsets_point_at_the_name():
+    text = "Vandaag heeft Berg goed gegeten."
+    [(start, end, name)] = NameScanner(["Berg"]).scan(text)
+    assert text[start:end] == "Berg"
+    assert name == "Berg"
+
+
+def test_case_and_accents_are_folded():
+    scanner = NameScanner(["Renée"])
+    assert names(scanner.scan("mw. RENEE was onrustig")) == ["Renée"]
+
+
+def test_punctuation_is_a_word_boundary():
+    scanner = NameScanner(["Visser"])
+    assert names(scanner.scan("(Visser), Visser. Visser's")) == ["Visser"] * 3
+
+
+def test_multi_word_names_and_overlaps():
+    scanner = NameScanner(["van den Berg", "Berg"])
+    hits = scanner.scan("Mw. van den Berg rustte.")
+    assert sorted(names(hits)) == ["Berg", "van den Berg"]
+    assert scanner.scan("van de Berg") == [(7, 11, "Berg")]
+
+
+def test_name_variants_drop_prefixes_and_short_names():
+    assert name_variants("Jo", "van den Berg") == ["van den Berg", "Berg"]
+
+
+def test_redact_file_updates_row_hashes(tmp_path):
+    path = tmp_path / "records.csv"
+    df = pd.DataFrame(
+        {
+            "note_id": ["nA_0001", "nA_0002"],
+            "client_id": ["cA_01", "cA_01"],
+            "scenario_id": ["sA_001", "sA_001"],
+            "date": ["2024-01-08 08:00", "2024-01-08 12:00"],
+            "note": ["Mw. Visser at goed.", "Rustig."],
+            "model": ["gpt-4o", "gpt-4o"],
+        }
+    )
+    df["row_hash"] = row_hashes(df, "records")
+    df.to_csv(path, index=False)
+    df_hits = pd.DataFrame({"file": [str(path)], "row": [0], "start": [4], "end": [10]})
+
+    assert redact_file(path, df_hits) == 1
+    redacted = pd.read_csv(path, dtype={"row_hash": str})
+    assert redacted["note"].tolist() == ["Mw. client at goed.", "Rustig."]
+    assert redacted["row_hash"].equals(row_hashes(redacted, "records"))
+    assert redacted.loc[1, "row_hash"] == df.loc[1, "row_hash"]
@@ -0,0 +1,32 @@
+import numpy as np
+
+from pipeline.profiles import COMPLICATIONS_LIBRARY, draw_complications
+
+
+def test_no_repeated_complications_per_profile():
+    rng = np.random.default_rng(0)
+    for complications in draw_complications(2000, rng):
+        picked = complications.split(", ")
+        assert len(picked) == len(set(picked))
+        assert set(picked) <= set(COMPLICATIONS_LIBRARY)
+
+
+def test_number_of_complications_within_bounds():
+    rng = np.random.default_rng(1)
+    counts = [
+        len(c.split(", ")) for c in draw_complications(2000, rng, min_complications=2)
+    ]
+    assert min(counts) == 2
+    assert max(counts) == 3
+
+
+def test_all_of_a_small_library():
+    rng = np.random.default_rng(2)
+    library = ["a", "b", "c"]
+    drawn = draw_complications(50, rng, library, min_complications=3)
+    assert all(sorted(c.split(", ")) == library for c in drawn)
+
+
+def test_seeded_draws_repeat():
+    first = draw_complications(10, np.random.default_rng(3))
+    assert first == draw_complications(10, np.random.default_rng(3))
@@ -0,0 +1,214 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline.versions import (
+    ADDED,
+    CHANGED,
+    REMOVED,
+    TABLE_KEYS,
+    changes_since,
+    diff_table,
+    load_version,
+    read_manifest,
+    row_hashes,
+    write_version,
+)
+
+
+def scenarios() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "scenario_id": ["sA_001", "sA_002"],
+            "client_id": ["cA_01", "cA_01"],
+            "week": [1, 2],
+            "date_start_of_week": ["2024-01-08", "2024-01-15"],
+            "events_description": ["Rustige week.", "Mw. valt in de badkamer."],
+            "model": ["gpt-4o", "gpt-4o"],
+        }
+    )
+
+
+def test_hashes_are_stable():
+    hashes = row_hashes(scenarios(), "scenarios")
+    assert hashes.str.fullmatch("[0-9a-f]{16}").all()
+    assert hashes.is_unique
+    assert hashes.equals(row_hashes(scenarios(), "scenarios"))
+
+
+def test_column_order_and_extra_columns_do_not_change_hashes():
+    df = scenarios()
+    reordered = df[df.columns[::-1]].assign(route="cheap", served_model="gpt-4o-mini")
+    assert row_hashes(reordered, "scenarios").equals(row_hashes(df, "scenarios"))
+
+
+def test_dtypes_do_not_change_hashes():
+    df = scenarios()
+    expected = row_hashes(df, "scenarios")
+    assert row_hashes(df.assign(week=df["week"].astype(float)), "scenarios").equals(
+        expected
+    )
+    assert row_hashes(df.assign(week=df["week"].astype("Int64")), "scenarios").equals(
+        expected
+    )
+    round_trip = pd.read_csv(io.StringIO(df.to_csv(index=False)))
+    assert row_hashes(round_trip, "scenarios").equals(expected)
+
+
+def test_missing_values_and_columns_hash_as_empty():
+    df = pd.DataFrame({"model": ["m"], "client_id": ["cA_01"], "bed": [np.nan]})
+    assert row_hashes(df, "profiles").equals(
+        row_hashes(df.drop(columns="bed"), "profiles")
+    )
+
+
+def test_content_change_changes_only_that_row():
+    df = scenarios()
+    changed = df.assign(events_description=["Rustige week.", "Mw. is gevallen."])
+    before, after = row_hashes(df, "scenarios"), row_hashes(changed, "scenarios")
+    assert before[0] == after[0]
+    assert before[1] != after[1]
+
+
+def tables(scenarios_df: pd.DataFrame) -> dict:
+    df = scenarios_df.copy()
+    df["row_hash"] = row_hashes(df, "scenarios")
+    return {"scenarios": df}
+
+
+def hashes(df: pd.DataFrame) -> pd.DataFrame:
+    return df[TABLE_KEYS["scenarios"] + ["row_hash"]]
+
+
+def load(versions_dir, version=None) -> pd.DataFrame:
+    df = load_version(versions_dir, version)["scenarios"]
+    return df.sort_values("scenario_id").reset_index(drop=True)
+
+
+def test_diff_table():
+    old = tables(scenarios())["scenarios"]
+    new = scenarios().iloc[1:].copy()
+    new.loc[1, "events_description"] = "Mw. is gevallen."
+    new = pd.concat(
+        [new, scenarios().iloc[:1].assign(scenario_id="sA_003", week=3)],
+        ignore_index=True,
+    )
+    new = tables(new)["scenarios"]
+
+    delta = diff_table(hashes(old), new, TABLE_KEYS["scenarios"])
+    changes = dict(zip(delta["scenario_id"], delta["change"]))
+    assert changes == {"sA_001": REMOVED, "sA_002": CHANGED, "sA_003": ADDED}
+
+
+def test_delta_round_trip(tmp_path):
+    v1 = tables(scenarios())
+    assert write_version(tmp_path, v1) == 1
+    assert read_manifest(tmp_path, 1)["base"]
+
+    df = scenarios()
+    df.loc[1, "events_description"] = "Mw. is gevallen."
+    df = pd.concat(
+        [df, df.iloc[:1].assign(scenario_id="sA_003", week=3)], ignore_index=True
+    )
+    v2 = tables(df)
+    previous = {"scenarios": hashes(v1["scenarios"])}
+    assert write_version(tmp_path, v2, previous, base_ratio=1.0) == 2
+    manifest = read_manifest(tmp_path, 2)
+    assert not manifest["base"]
+    assert manifest["tables"]["scenarios"]["added"] == 1
+    assert manifest["tables"]["scenarios"]["changed"] == 1
+    assert not (tmp_path / "v0002" / "scenarios_full.csv").exists()
+
+    expected = v2["scenarios"].sort_values("scenario_id").reset_index(drop=True)
+    pd.testing.assert_frame_equal(load(tmp_path), expected, check_dtype=False)
+    pd.testing.assert_frame_equal(
+        load(tmp_path, 1),
+        v1["scenarios"].sort_values("scenario_id").reset_index(drop=True),
+        check_dtype=False,
+    )
+
+    # Nothing changed, no new version
+    previous = {"scenarios": hashes(v2["scenarios"])}
+    assert write_version(tmp_path, v2, previous) is None
+
+
+def test_new_base_after_base_ratio(tmp_path):
+    v1 = tables(scenarios())
+    write_version(tmp_path, v1)
+    df = scenarios().assign(events_description=["Koorts.", "Herstel."])
+    v2 = tables(df)
+    previous = {"scenarios": hashes(v1["scenarios"])}
+    assert write_version(tmp_path, v2, previous, base_ratio=0.5) == 2
+    assert read_manifest(tmp_path, 2)["base"]
+    assert (tmp_path / "v0002" / "scenarios_full.csv").exists()
+
+
+def test_delta_requires_previous_hashes(tmp_path):
+    write_version(tmp_path, tables(scenarios()))
+    with pytest.raises(ValueError):
+        write_version(tmp_path, tables(scenarios()))
+
+
+def test_load_version_verifies_digest(tmp_path):
+    write_version(tmp_path, tables(scenarios()))
+    path = tmp_path / "v0001" / "scenarios_full.csv"
+    df = pd.read_csv(path, dtype={"row_hash": str})
+    df.loc[0, "row_hash"] = "0" * 16
+    df.to_csv(path, index=False)
+    with pytest.raises(ValueError):
+        load_version(tmp_path)
+    assert len(load_version(tmp_path, verify=False)["scenarios"]) == 2
+
+
+def test_changes_since_add_change_remove_readd(tmp_path):
+    df = scenarios()
+    versions = [df]
+    # v2: sA_002 changed, sA_003 added
+    df = pd.concat(
+        [df, df.iloc[:1].assign(scenario_id="sA_003", week=3)], ignore_index=True
+    )
+    df.loc[1, "events_description"] = "Mw. is gevallen."
+    versions.append(df)
+    # v3: sA_001 and sA_003 removed
+    versions.append(df[df["scenario_id"] == "sA_002"].reset_index(drop=True))
+    # v4: sA_001 added again with new content
+    versions.append(
+        pd.concat(
+            [versions[-1], scenarios().iloc[:1].assign(events_description="Opname.")],
+            ignore_index=True,
+        )
+    )
+
+    previous = None
+    for df in versions:
+        current = tables(df)
+        write_version(tmp_path, current, previous, base=previous is None)
+        previous = {"scenarios": hashes(current["scenarios"])}
+
+    upserts, removed = changes_since(tmp_path, 1)["scenarios"]
+    assert dict(zip(upserts["scenario_id"], upserts["events_description"])) == {
+        "sA_002": "Mw. is gevallen.",
+        "sA_001": "Opname.",
+    }
+    assert removed["scenario_id"].tolist() == ["sA_003"]
+
+    upserts, removed = changes_since(tmp_path, 2, until=3)["scenarios"]
+    assert upserts.empty
+    assert sorted(removed["scenario_id"]) == ["sA_001", "sA_003"]
+
+    # A consumer at v1 that applies the changes has the last version
+    df_v1 = load(tmp_path, 1)
+    upserts, removed = changes_since(tmp_path, 1)["scenarios"]
+    keep = ~df_v1["scenario_id"].isin(
+        list(upserts["scenario_id"]) + list(removed["scenario_id"])
+    )
+    applied = pd.concat(
+        [df_v1[keep], upserts.drop(columns="change")], ignore_index=True
+    )
+    pd.testing.assert_frame_equal(
+        applied.sort_values("scenario_id").reset_index(drop=True),
+        load(tmp_path),
+        check_dtype=False,
+    )